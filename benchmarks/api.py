@@ -0,0 +1,316 @@
+"""
+Load test of the API, run in-process against SQLite (aiosqlite) and an in-memory fake Redis.
+
+Seeds one confirmed user per concurrent client and spreads the contacts over them,
+then runs every scenario for --duration seconds with --concurrency clients and reports
+latency percentiles and requests per second per operation as JSON.
+
+Most requests of a steady load are served from the token, user and response caches.
+With --cache cold every lookup in them misses, with --cache both (the default) each
+scenario runs warm and then cold, the cold operations being reported as "<operation>:cold".
+
+Scenarios:
+    login    POST /api/auth/login
+    refresh  GET /api/auth/refresh_token
+    me       GET /api/users/me
+    list     GET /api/contacts/ pages of 100
+    search   GET /api/contacts/search?q=
+    crud     POST, GET, PUT and DELETE of one contact
+
+Run from the project root with the application environment (.env) in place:
+
+    python -m benchmarks.api --contacts 10000 --output results.json
+    python -m benchmarks.api --contacts 10000 --baseline results.json --fail-on-regression
+    python -m benchmarks.api --contacts 10000 --scenarios list me --cache cold
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import date
+
+import httpx
+from fastapi_limiter import FastAPILimiter
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from benchmarks.fake_redis import ColdRedis, FakeRedis
+from main import app
+from src.database.db import get_db
+from src.database.models import Base, Contact, User, birth_doy
+from src.services.auth import auth_service
+from src.services.cache import response_cache, token_cache, token_revocations, user_cache
+
+SCENARIOS = ("login", "refresh", "me", "list", "search", "crud")
+CACHE_MODES = ("warm", "cold", "both")
+PASSWORD = "benchmark"
+
+
+class Client:
+    """
+    One simulated API client, logged in as its own user
+    """
+
+    def __init__(self, http: httpx.AsyncClient, email: str, contacts: int):
+        self.http = http
+        self.email = email
+        self.contacts = contacts
+        self.access_token = None
+        self.refresh_token = None
+
+    @property
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.access_token}"}
+
+    def remember(self, response: httpx.Response) -> None:
+        if response.status_code == 200:
+            data = response.json()
+            self.access_token = data["access_token"]
+            self.refresh_token = data["refresh_token"]
+
+    async def login(self, record) -> None:
+        response = await record("login", self.http.post(
+            "/api/auth/login", data={"username": self.email, "password": PASSWORD}))
+        self.remember(response)
+
+    async def refresh(self, record) -> None:
+        response = await record("refresh", self.http.get(
+            "/api/auth/refresh_token", headers={"Authorization": f"Bearer {self.refresh_token}"}))
+        self.remember(response)
+
+    async def me(self, record) -> None:
+        await record("me", self.http.get("/api/users/me", headers=self.headers))
+
+    async def list(self, record) -> None:
+        skip = random.randrange(0, max(self.contacts, 1), 100)
+        await record("list", self.http.get("/api/contacts/", params={"skip": skip, "limit": 100},
+                                           headers=self.headers))
+
+    async def search(self, record) -> None:
+        q = f"name{random.randrange(max(self.contacts, 1))}"[:random.randint(5, 8)]
+        await record("search", self.http.get("/api/contacts/search", params={"q": q}, headers=self.headers))
+
+    async def crud(self, record) -> None:
+        body = {"name": "bench", "surname": "contact", "email": "bench@example.com", "date_of_birth": "1990-01-01"}
+        response = await record("create", self.http.post("/api/contacts/", json=body, headers=self.headers))
+        if response.status_code != 201:
+            return
+        contact_id = response.json()["id"]
+        url = f"/api/contacts/{contact_id}"
+        await record("get", self.http.get(url, headers=self.headers))
+        await record("update", self.http.put(url, json=dict(body, phone="+380000000000"), headers=self.headers))
+        await record("delete", self.http.delete(url, headers=self.headers))
+
+
+class Recorder:
+    """
+    Latencies and error counts per operation
+    """
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    async def __call__(self, operation: str, request) -> httpx.Response:
+        started_at = time.perf_counter()
+        response = await request
+        self.latencies.setdefault(operation, []).append(time.perf_counter() - started_at)
+        if response.status_code >= 400:
+            self.errors[operation] = self.errors.get(operation, 0) + 1
+        return response
+
+
+def percentile(values: list, q: float) -> float:
+    """
+    Nearest-rank percentile of sorted values
+    """
+    index = max(0, min(len(values) - 1, round(q / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def summarize(recorder: Recorder, elapsed: float) -> dict:
+    results = {}
+    for operation, latencies in recorder.latencies.items():
+        latencies.sort()
+        results[operation] = {
+            "requests": len(latencies),
+            "errors": recorder.errors.get(operation, 0),
+            "rps": len(latencies) / elapsed,
+            "mean_ms": sum(latencies) / len(latencies) * 1000,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+        }
+    return results
+
+
+async def seed(session_factory, users: int, contacts: int, chunk_size: int = 10000) -> list:
+    """
+    Create confirmed users sharing one password and spread the contacts over them
+
+    :return: emails and contact counts of the users
+    """
+    password = auth_service.pwd_context.hash(PASSWORD)
+    seeded = []
+    async with session_factory() as session:
+        user_rows = [User(name=f"bench{i}", email=f"bench{i}@example.com", password=password, confirmed=True)
+                     for i in range(users)]
+        session.add_all(user_rows)
+        await session.commit()
+        rows = []
+        for n in range(contacts):
+            date_of_birth = date(1970 + n % 40, 1 + n % 12, 1 + n % 28)
+            rows.append({
+                "name": f"name{n}",
+                "surname": f"surname{n}",
+                "email": f"contact{n}@example.com",
+                "phone": f"+380{n:09d}",
+                "date_of_birth": date_of_birth,
+                "birth_doy": birth_doy(date_of_birth),
+                "user_id": user_rows[n % users].id,
+            })
+            if len(rows) >= chunk_size:
+                await session.execute(insert(Contact), rows)
+                rows = []
+        if rows:
+            await session.execute(insert(Contact), rows)
+        await session.commit()
+        for i, user in enumerate(user_rows):
+            seeded.append((user.email, contacts // users + (i < contacts % users)))
+    return seeded
+
+
+@contextmanager
+def caches_disabled():
+    """
+    Make every lookup in the token, user and response caches miss
+    """
+    saved = token_cache.maxsize, user_cache.local, user_cache.r, response_cache.r
+    token_cache.maxsize = 0
+    token_cache.clear()
+    user_cache.local = None
+    user_cache.r = response_cache.r = ColdRedis()
+    try:
+        yield
+    finally:
+        token_cache.maxsize, user_cache.local, user_cache.r, response_cache.r = saved
+
+
+async def run_scenario(clients: list, scenario: str, duration: float) -> dict:
+    recorder = Recorder()
+    deadline = time.perf_counter() + duration
+
+    async def worker(client: Client) -> None:
+        action = getattr(client, scenario)
+        while time.perf_counter() < deadline:
+            await action(recorder)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker(client) for client in clients))
+    return summarize(recorder, time.perf_counter() - started_at)
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> dict:
+    """
+    Relative change of p95 latency and rps per operation against the baseline.
+    An operation regresses when p95 grows or rps drops by more than tolerance.
+    """
+    comparison = {}
+    for operation, current in results["operations"].items():
+        base = baseline.get("operations", {}).get(operation)
+        if base is None:
+            continue
+        p95_change = current["p95_ms"] / base["p95_ms"] - 1 if base["p95_ms"] else 0.0
+        rps_change = current["rps"] / base["rps"] - 1 if base["rps"] else 0.0
+        comparison[operation] = {
+            "p95_change": p95_change,
+            "rps_change": rps_change,
+            "regression": p95_change > tolerance or rps_change < -tolerance,
+        }
+    return comparison
+
+
+async def main(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="contacts-bench-")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False, autoflush=False)
+
+    async def override_get_db():
+        async with session_factory() as session:
+            yield session
+
+    fake_redis = FakeRedis()
+    app.dependency_overrides[get_db] = override_get_db
+    auth_service.r = user_cache.r = response_cache.r = token_revocations.r = fake_redis
+    await FastAPILimiter.init(fake_redis)
+    user_cache.local.clear()
+    token_cache.clear()
+
+    seed_started_at = time.perf_counter()
+    users = await seed(session_factory, args.concurrency, args.contacts)
+    seed_seconds = time.perf_counter() - seed_started_at
+
+    results = {
+        "config": {
+            "contacts": args.contacts,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "scenarios": args.scenarios,
+            "cache": args.cache,
+            "seed_seconds": seed_seconds,
+        },
+        "operations": {},
+    }
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as http:
+        clients = [Client(http, email, contacts) for email, contacts in users]
+        for client in clients:
+            await client.login(Recorder())
+        for scenario in args.scenarios:
+            if args.cache in ("warm", "both"):
+                results["operations"].update(await run_scenario(clients, scenario, args.duration))
+            if args.cache in ("cold", "both"):
+                with caches_disabled():
+                    cold = await run_scenario(clients, scenario, args.duration)
+                results["operations"].update({f"{operation}:cold": item for operation, item in cold.items()})
+
+    await engine.dispose()
+    app.dependency_overrides.pop(get_db, None)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--contacts", type=int, default=1000, help="contacts to seed, 1k to 1M")
+    parser.add_argument("--concurrency", type=int, default=10, help="concurrent clients, one user each")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per scenario")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--cache", choices=CACHE_MODES, default="both",
+                        help="run scenarios with warm caches, with every cache lookup missing, or both")
+    parser.add_argument("--output", help="write results to this file instead of stdout")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative p95/rps change")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 on regression")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    regressed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            results["comparison"] = compare(results, json.load(f), args.tolerance)
+        regressed = any(item["regression"] for item in results["comparison"].values())
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    sys.exit(1 if regressed and args.fail_on_regression else 0)
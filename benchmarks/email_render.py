@@ -0,0 +1,59 @@
+"""
+Renders per second of a batch of confirmation emails.
+
+lookup:      a new Jinja environment per message that locates and compiles the template,
+             as fastapi_mail did for every send_email call
+precompiled: the template compiled once at startup by EmailTemplates
+precompiled_message: precompiled rendering plus the MIME message handed to the SMTP transport
+
+Run from the project root with the application environment (.env) in place:
+
+    python -m benchmarks.email_render --emails 5000
+"""
+import argparse
+import json
+import time
+
+from jinja2 import Environment, FileSystemLoader
+
+from src.services.email import TEMPLATE_FOLDER
+from src.services.email_worker import EmailTemplates, render_message
+
+
+def lookup(job: dict) -> str:
+    env = Environment(loader=FileSystemLoader(TEMPLATE_FOLDER))
+    return env.get_template(job["template"]).render(**job["body"])
+
+
+def measure(render, jobs: list) -> dict:
+    started_at = time.perf_counter()
+    for job in jobs:
+        render(job)
+    elapsed = time.perf_counter() - started_at
+    return {"seconds": elapsed, "renders_per_second": len(jobs) / elapsed}
+
+
+def main(emails: int) -> dict:
+    jobs = [{
+        "template": "email_template.html",
+        "subject": "Confirm your email ",
+        "recipient": f"user{i}@example.com",
+        "body": {"host": "http://localhost:8000/", "username": f"user{i}", "token": f"token{i}"},
+    } for i in range(emails)]
+    templates = EmailTemplates(TEMPLATE_FOLDER)
+
+    results = {
+        "emails": emails,
+        "lookup": measure(lookup, jobs),
+        "precompiled": measure(lambda job: templates.render(job["template"], job["body"]), jobs),
+        "precompiled_message": measure(lambda job: render_message(job, templates), jobs),
+    }
+    results["speedup"] = results["precompiled"]["renders_per_second"] / results["lookup"]["renders_per_second"]
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=5000)
+    args = parser.parse_args()
+    print(json.dumps(main(args.emails), indent=2))
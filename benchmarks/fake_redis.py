@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+
+class FakeRedis:
+    """
+    In-process stand-in for redis.asyncio.Redis, with just the commands the application uses:
+    the user, token and response caches and fastapi_limiter.
+
+    Every call yields to the event loop once, like a round trip would. The rate limiter
+    script always allows the request, so benchmarks are never throttled.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self.calls = 0
+
+    async def _round_trip(self) -> None:
+        self.calls += 1
+        await asyncio.sleep(0)
+
+    def _alive(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    @staticmethod
+    def _encode(value) -> bytes:
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode()
+
+    async def get(self, key):
+        await self._round_trip()
+        return self._alive(key)
+
+    async def set(self, key, value, ex=None, px=None):
+        await self._round_trip()
+        expires_at = None
+        if ex is not None:
+            expires_at = time.monotonic() + ex
+        elif px is not None:
+            expires_at = time.monotonic() + px / 1000
+        self._data[key] = (self._encode(value), expires_at)
+        return True
+
+    async def delete(self, *keys):
+        await self._round_trip()
+        return sum(self._data.pop(key, None) is not None for key in keys)
+
+    async def incr(self, key):
+        await self._round_trip()
+        value = int(self._alive(key) or 0) + 1
+        expires_at = self._data[key][1] if key in self._data else None
+        self._data[key] = (self._encode(value), expires_at)
+        return value
+
+    async def expire(self, key, seconds):
+        await self._round_trip()
+        value = self._alive(key)
+        if value is None:
+            return False
+        self._data[key] = (value, time.monotonic() + seconds)
+        return True
+
+    async def publish(self, channel, message):
+        await self._round_trip()
+        return 0
+
+    async def script_load(self, script):
+        await self._round_trip()
+        return "fake"
+
+    async def evalsha(self, sha, numkeys, *args):
+        await self._round_trip()
+        return 0
+
+    async def close(self):
+        self._data.clear()
+
+
+class ColdRedis(FakeRedis):
+    """
+    FakeRedis that forgets every write, so each cache lookup is a miss that still
+    costs its round trips.
+    """
+
+    async def set(self, key, value, ex=None, px=None):
+        await self._round_trip()
+        return True
@@ -0,0 +1,89 @@
+"""
+CPU cost of building a contact list response, before and after the orjson fast path.
+
+before: load Contact entities, validate them through ContactSchemaResponse and
+        encode with the stdlib JSON encoder, as FastAPI does for a response_model
+after:  select the response columns only and encode the rows with orjson
+
+Run from the project root with the application environment (.env) in place:
+
+    python -m benchmarks.serialization --rows 100 --requests 2000
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import date
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from src.database.models import Base, Contact, User
+from src.repository.contacts import CONTACT_COLUMNS
+from src.schemas.schemas import ContactSchemaResponse
+from src.services.contacts_io import encode_json
+
+adapter = TypeAdapter(List[ContactSchemaResponse])
+
+
+async def before(session, user_id: int, limit: int) -> bytes:
+    res = await session.execute(select(Contact).where(Contact.user_id == user_id).order_by(Contact.id).limit(limit))
+    contacts = res.scalars().all()
+    content = jsonable_encoder(adapter.validate_python(contacts, from_attributes=True))
+    body = json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+    session.expunge_all()
+    return body
+
+
+async def after(session, user_id: int, limit: int) -> bytes:
+    query = select(*CONTACT_COLUMNS, Contact.updated_at).where(Contact.user_id == user_id).order_by(Contact.id)
+    res = await session.execute(query.limit(limit))
+    return encode_json(res.all())
+
+
+async def measure(fn, session_factory, user_id: int, limit: int, requests: int) -> dict:
+    async with session_factory() as session:
+        await fn(session, user_id, limit)
+        started_at = time.process_time()
+        for _ in range(requests):
+            await fn(session, user_id, limit)
+        cpu = time.process_time() - started_at
+    return {"cpu_ms_per_request": cpu / requests * 1000, "requests_per_cpu_second": requests / cpu}
+
+
+async def main(rows: int, requests: int) -> None:
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+    async with session_factory() as session:
+        user = User(name="bench", email="bench@example.com", password="x")
+        session.add(user)
+        await session.commit()
+        session.add_all([
+            Contact(name=f"name{i}", surname=f"surname{i}", email=f"contact{i}@example.com",
+                    phone=f"+38000000{i:04d}", date_of_birth=date(1990, 1 + i % 12, 1 + i % 28), user_id=user.id)
+            for i in range(rows)
+        ])
+        await session.commit()
+
+    results = {
+        "rows": rows,
+        "requests": requests,
+        "before": await measure(before, session_factory, user.id, rows, requests),
+        "after": await measure(after, session_factory, user.id, rows, requests),
+    }
+    results["speedup"] = results["before"]["cpu_ms_per_request"] / results["after"]["cpu_ms_per_request"]
+    print(json.dumps(results, indent=2))
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.requests))
@@ -1,11 +1,14 @@
 import uvicorn
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
 
-from src.database.db import get_db
+from src.database.db import get_db, engine, pool_stats, replica_router, async_session_factory
+from src.repository import contacts as contacts_repo
 
 from src.routes.contacts import router as contacts_router
 from src.routes.tests import router as tests_router
@@ -15,18 +18,57 @@ from src.routes.users import router as users_router
 from fastapi_limiter import FastAPILimiter
 from fastapi_limiter.depends import RateLimiter
 
+import asyncio
+from datetime import timedelta
 import redis.asyncio as redis
 from contextlib import asynccontextmanager
 
+from src.services.cache import redis_client, user_cache, token_cache, token_revocations
+from src.services.auth import auth_service
+from src.services import instrumentation
+from src.services.email_worker import create_worker
+from src.services.avatars import avatar_pipeline
 from settings import settings
 
 db_uri = settings.get_uri()
 
+
+async def prune_contact_deletions(interval: float) -> None:
+    """
+    Delete the deletion tombstones older than the retention every interval seconds. Runs until cancelled.
+    """
+    retention = timedelta(days=settings.contacts_deletions_retention_days)
+    while True:
+        try:
+            async with async_session_factory() as db:
+                await contacts_repo.prune_deletions(contacts_repo.deletions_horizon(retention), db)
+        except SQLAlchemyError as e:
+            print(e)
+        await asyncio.sleep(interval)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     r = await redis.from_url("redis://localhost:6379", db=0, encoding="utf-8", decode_responses=True)
+    if settings.instrumentation_enabled:
+        instrumentation.instrument_redis(r)
     await FastAPILimiter.init(r)
+    user_cache_listener = asyncio.create_task(user_cache.listen())
+    revocations_listener = asyncio.create_task(token_revocations.listen())
+    replica_monitor = asyncio.create_task(replica_router.monitor(settings.db_replica_check_interval))
+    deletions_pruner = asyncio.create_task(prune_contact_deletions(settings.contacts_deletions_prune_interval))
+    # Development only, deployments run the worker process: python -m src.services.email_worker
+    email_worker = asyncio.create_task(create_worker().run()) if settings.email_worker_in_app else None
     yield
+    user_cache_listener.cancel()
+    revocations_listener.cancel()
+    replica_monitor.cancel()
+    deletions_pruner.cancel()
+    if email_worker is not None:
+        # Lets the worker put the jobs it has not sent back in the queue
+        email_worker.cancel()
+        await asyncio.gather(email_worker, return_exceptions=True)
+    await avatar_pipeline.close()
     await FastAPILimiter.close()
 
 
@@ -42,6 +84,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if settings.instrumentation_enabled:
+    instrumentation.instrument_sql()
+    instrumentation.instrument_redis(redis_client)
+    app.add_middleware(
+        instrumentation.InstrumentationMiddleware,
+        registry=instrumentation.registry,
+        profiler=instrumentation.Profiler(settings.profile_dir, settings.profile_sample_rate,
+                                          secret=settings.profile_secret, max_files=settings.profile_max_files),
+    )
+
+    @app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+    async def metrics():
+        """
+        Per-route request metrics of this worker in the Prometheus text format
+
+        :return: metrics
+        :rtype: str
+        """
+        return instrumentation.registry.render()
+
+
 app.include_router(contacts_router, prefix='/api')
 app.include_router(auth_router, prefix='/api')
 app.include_router(users_router, prefix='/api')
@@ -74,5 +137,38 @@ async def healthchecker(db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=500, detail="Error connecting to the database")
 
 
+@app.get("/api/healthchecker/cache")
+async def cache_stats():
+    """
+    Hit/miss counters of the access token verification cache of this worker
+
+    :return: token_cache stats
+    :rtype: dict
+    """
+    return {"token_cache": token_cache.stats()}
+
+
+@app.get("/api/healthchecker/pool")
+async def database_pool_stats():
+    """
+    Usage and checkout wait metrics of the database pool of this worker
+
+    :return: pool stats
+    :rtype: dict
+    """
+    return pool_stats(engine)
+
+
+@app.get("/api/healthchecker/password_hasher")
+async def password_hasher_stats():
+    """
+    Queueing metrics of the password hashing pool of this worker
+
+    :return: pool stats
+    :rtype: dict
+    """
+    return auth_service.pwd_hasher.stats()
+
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
@@ -11,6 +11,27 @@ class Settings(BaseSettings):
     db_name: str = "contacts"
     domain: str = "localhost"
     port: str = "5432"
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = -1
+    db_pool_pre_ping: bool = False
+    db_statement_cache_size: int = 100
+    db_prepared_statement_cache_size: int = 100
+    # Comma separated URIs of read replicas
+    db_replica_uris: str = ""
+    db_replica_pin_seconds: float = 5
+    db_replica_check_interval: float = 10
+
+    # CONTACTS
+    contacts_import_chunk_size: int = 1000
+    contacts_import_max_errors: int = 1000
+    contacts_export_batch_size: int = 1000
+    # Seconds a transaction may take to commit, the sync watermark is moved back by it
+    contacts_sync_lag_seconds: float = 10
+    # Deletion tombstones older than this are pruned, older syncs get a full resync
+    contacts_deletions_retention_days: int = 30
+    contacts_deletions_prune_interval: float = 3600
 
     # MAIL
     mail_username: str
@@ -19,26 +40,75 @@ class Settings(BaseSettings):
     mail_port: int
     mail_server: str
     mail_from_name: str
+    mail_ssl_tls: bool = True
+    mail_starttls: bool = False
+    email_batch_size: int = 50
+    email_max_attempts: int = 5
+    email_retry_backoff: float = 30
+    # Emails are sent by a separate process, python -m src.services.email_worker, run next to
+    # the web workers. In app mode every web worker sends them too, meant for development only
+    email_worker_in_app: bool = False
 
     # JWT
     secret_key: str
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 60
+    token_cache_size: int = 4096
+    password_hash_workers: int = 2
+    password_hash_max_pending: int = 64
 
     # REDIS
     redis_host: str = "localhost"
     redis_port: int = 6379
     redis_db: int = 0
+    user_cache_ttl: int = 900
+    user_cache_local_size: int = 1024
+    user_cache_local_ttl: int = 30
+    response_cache_ttl: int = 300
+
+    # INSTRUMENTATION
+    instrumentation_enabled: bool = False
+    profile_sample_rate: float = 0.0
+    profile_dir: str = "profiles"
+    # X-Profile header value that requests a profile, empty to only sample
+    profile_secret: str = ""
+    profile_max_files: int = 100
 
     # CLOUDINARY
     cloudinary_name: str
     cloudinary_api_key: str
     cloudinary_api_secret: str
 
+    # AVATARS
+    # "cloudinary" or "local"
+    avatar_storage: str = "cloudinary"
+    avatar_local_dir: str = "media/avatars"
+    avatar_local_url: str = "/api/users/avatars/"
+    # Scheme and host clients reach the API at, e.g. https://contacts.example.com. Avatar paths are
+    # returned as absolute URLs of it, or of the URL of the request when empty
+    avatar_public_url: str = ""
+    avatar_workers: int = 2
+    avatar_max_pending: int = 32
+    avatar_max_bytes: int = 5 * 1024 * 1024
+    # Empty for the system temp directory
+    avatar_spool_dir: str = ""
+    avatar_memory_cache_size: int = 256
+    avatar_memory_cache_ttl: int = 3600
+    # How long an uploaded image is remembered by content hash to skip processing it again
+    avatar_index_ttl: int = 30 * 86400
+    # Only use the Gravatar of users who have one, costs a request to Gravatar per new email
+    gravatar_verify: bool = False
+    gravatar_timeout: float = 3
+    gravatar_cache_ttl: int = 86400
+
     @staticmethod
     def get_uri():
         return f"postgresql+asyncpg://{settings.user}:{settings.password}@{settings.domain}:{settings.port}/{settings.db_name}"
 
+    @staticmethod
+    def get_replica_uris():
+        return [uri.strip() for uri in settings.db_replica_uris.split(",") if uri.strip()]
+
     model_config = SettingsConfigDict(
         env_file=".env",  # Path("../.env").resolve()
         env_file_encoding="utf-8",
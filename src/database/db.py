@@ -1,11 +1,231 @@
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+import asyncio
+import time
+
+import redis.asyncio as redis
+from fastapi import Depends
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine, AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
 from settings import settings
+from src.services.cache import redis_client
+from src.services.instrumentation import record_pool_wait
+
+
+class PoolMetrics:
+    """
+    Counters of connection checkouts, including how long callers waited for a free connection
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record_checkout(self, wait: float) -> None:
+        self.checkouts += 1
+        self.wait_seconds += wait
+        self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    AsyncAdaptedQueuePool that measures how long each checkout takes,
+    including waiting for a free connection or opening a new one
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+        connection = super()._do_get()
+        wait = time.perf_counter() - started_at
+        self.metrics.record_checkout(wait)
+        record_pool_wait(wait)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+def create_engine(uri: str) -> AsyncEngine:
+    """
+    Create an async engine with the pool and statement cache tuned by settings
+
+    :param uri:
+    :return: engine
+    :rtype: AsyncEngine
+    """
+    url = make_url(uri)
+    connect_args = {}
+    if url.get_driver_name() == "asyncpg":
+        url = url.update_query_dict(
+            {"prepared_statement_cache_size": str(settings.db_prepared_statement_cache_size)})
+        connect_args["statement_cache_size"] = settings.db_statement_cache_size
+    return create_async_engine(
+        url,
+        poolclass=TimedQueuePool,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        connect_args=connect_args,
+    )
+
+
+def pool_stats(engine: AsyncEngine) -> dict:
+    """
+    Current usage and checkout wait metrics of the engine pool
+
+    :param engine:
+    :return: stats
+    :rtype: dict
+    """
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "max_overflow": pool._max_overflow,
+        "in_use": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "checkouts": pool.metrics.checkouts,
+        "wait_seconds": pool.metrics.wait_seconds,
+        "max_wait_seconds": pool.metrics.max_wait_seconds,
+    }
+
+
+class ReplicaRouter:
+    """
+    Spreads reads over healthy read replicas in round-robin order.
 
-engine = create_async_engine(settings.get_uri())
-async_session_factory = async_sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    A user who has just written is pinned to the primary for pin_seconds,
+    so they read their own writes despite replication lag. Pins are kept in Redis
+    so every worker sees them, Redis is not used when there are no replicas.
+    """
+
+    def __init__(self, engines: list[AsyncEngine], pin_seconds: float, r: redis.Redis = redis_client):
+        self.engines = engines
+        self.session_factories = [
+            async_sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+            for engine in engines
+        ]
+        self.healthy = [True] * len(engines)
+        self.pin_seconds = pin_seconds
+        self.r = r
+        self._next = 0
+
+    @staticmethod
+    def pin_key(key: str) -> str:
+        return f"replica_pin:{key}"
+
+    async def pin(self, key: str) -> None:
+        if not self.engines:
+            return
+        try:
+            await self.r.set(self.pin_key(key), 1, px=max(int(self.pin_seconds * 1000), 1))
+        except redis.RedisError as e:
+            print(e)
+
+    async def is_pinned(self, key: str) -> bool:
+        try:
+            return bool(await self.r.exists(self.pin_key(key)))
+        except redis.RedisError as e:
+            # Without the pins a replica may miss the user's last write
+            print(e)
+            return True
+
+    async def session_factory_for(self, key: str | None) -> async_sessionmaker | None:
+        """
+        Session factory of the next healthy replica, None if the primary must be used
+        """
+        if not any(self.healthy):
+            return None
+        if key is not None and await self.is_pinned(key):
+            return None
+        for _ in range(len(self.session_factories)):
+            index = self._next
+            self._next = (self._next + 1) % len(self.session_factories)
+            if self.healthy[index]:
+                return self.session_factories[index]
+        return None
+
+    async def check_health(self, timeout: float = 2.0) -> None:
+        for index, engine in enumerate(self.engines):
+            try:
+                async with engine.connect() as conn:
+                    await asyncio.wait_for(conn.execute(text("SELECT 1")), timeout)
+                self.healthy[index] = True
+            except Exception as e:
+                print(e)
+                self.healthy[index] = False
+
+    async def monitor(self, interval: float) -> None:
+        """
+        Re-check replica health every interval seconds. Runs until cancelled.
+        """
+        while self.engines:
+            await self.check_health()
+            await asyncio.sleep(interval)
+
+
+class PinningSession(AsyncSession):
+    """
+    Session that pins the user it writes for to the primary after every commit.
+    Sessions are tagged with the user in info["user"], by get_current_user for request
+    sessions and by the repository functions that write a user row.
+    """
+
+    async def commit(self) -> None:
+        await super().commit()
+        key = self.info.get("user")
+        if key is not None:
+            await replica_router.pin(key)
+
+
+engine = create_engine(settings.get_uri())
+async_session_factory = async_sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine,
+                                           class_=PinningSession)
+replica_router = ReplicaRouter([create_engine(uri) for uri in settings.get_replica_uris()],
+                               pin_seconds=settings.db_replica_pin_seconds)
 
 
 # Dependency
 async def get_db():
     async with async_session_factory() as session:
         yield session
+
+
+def get_read_db_for(current_user_dependency):
+    """
+    Build a dependency that yields a read replica session for read-only routes,
+    or the primary session when there are no healthy replicas or the user has just written.
+
+    :param current_user_dependency: dependency returning the authenticated user
+    :return: dependency
+    """
+
+    async def get_read_db(db: AsyncSession = Depends(get_db), user=Depends(current_user_dependency)):
+        session_factory = await replica_router.session_factory_for(user.email)
+        if session_factory is None:
+            yield db
+            return
+        async with session_factory() as session:
+            # A replica read may predate the user's last write, see is_replica_session
+            session.info["replica"] = True
+            yield session
+
+    return get_read_db
+
+
+def is_replica_session(session: AsyncSession) -> bool:
+    """
+    Whether the session reads from a replica. Results of such reads must not be cached,
+    they may predate a write that already invalidated the cache.
+    """
+    return session.info.get("replica", False)
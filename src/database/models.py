@@ -1,9 +1,22 @@
-from sqlalchemy import Integer, String, func, Date, DateTime, Boolean
+from datetime import date
 
-from sqlalchemy.orm import Mapped, mapped_column, DeclarativeBase, relationship
+from sqlalchemy import Integer, SmallInteger, String, func, Date, DateTime, Boolean, Index
+
+from sqlalchemy.orm import Mapped, mapped_column, DeclarativeBase, relationship, validates
 from sqlalchemy.sql.schema import ForeignKey
 
 
+def birth_doy(date_of_birth: date | str | None) -> int | None:
+    """
+    Month/day ordinal of a birthday, e.g. 1231 for December 31
+    """
+    if date_of_birth is None:
+        return None
+    if isinstance(date_of_birth, str):
+        date_of_birth = date.fromisoformat(date_of_birth)
+    return date_of_birth.month * 100 + date_of_birth.day
+
+
 class Base(DeclarativeBase):
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     created_at: Mapped[DateTime] = mapped_column(DateTime, default=func.now())
@@ -27,16 +40,52 @@ class User(Base):
 
 class Contact(Base):
     __tablename__ = 'contacts'
+    __table_args__ = (
+        Index('ix_contacts_user_id_id', 'user_id', 'id'),
+        Index('ix_contacts_user_id_birth_doy', 'user_id', 'birth_doy'),
+        Index('ix_contacts_user_id_updated_at', 'user_id', 'updated_at'),
+        # Searches are per user, btree_gin lets user_id share the GIN index with the trigrams
+        Index('ix_contacts_user_id_name_trgm', 'user_id', 'name', postgresql_using='gin',
+              postgresql_ops={'name': 'gin_trgm_ops'}),
+        Index('ix_contacts_user_id_surname_trgm', 'user_id', 'surname', postgresql_using='gin',
+              postgresql_ops={'surname': 'gin_trgm_ops'}),
+        Index('ix_contacts_user_id_email_trgm', 'user_id', 'email', postgresql_using='gin',
+              postgresql_ops={'email': 'gin_trgm_ops'}),
+    )
     name: Mapped[str] = mapped_column(String(50), nullable=False)
     surname: Mapped[str] = mapped_column(String(50), nullable=False)
     email: Mapped[str] = mapped_column(String(50), nullable=True)
     phone: Mapped[str] = mapped_column(String(50), nullable=True)
     date_of_birth: Mapped[Date] = mapped_column(Date)
+    # Kept in sync with date_of_birth, see birth_doy()
+    birth_doy: Mapped[int] = mapped_column(SmallInteger, nullable=True)
     user_id: Mapped[User] = mapped_column(
         ForeignKey('users.id', ondelete='CASCADE', onupdate='CASCADE')
     )
-    # Alchemy
-    user: Mapped["Contact"] = relationship("User", backref="contacts", lazy="selectin")
+    # Alchemy. Never loaded implicitly, read paths select the columns they need
+    user: Mapped["Contact"] = relationship("User", backref="contacts", lazy="raise")
+
+    @validates('date_of_birth')
+    def validate_date_of_birth(self, key, value):
+        self.birth_doy = birth_doy(value)
+        return value
 
     def __repr__(self):
         return f'Contact(name={self.name}, surname={self.surname}, email={self.email}, phone={self.phone})'
+
+
+class ContactDeletion(Base):
+    """
+    Tombstone of a deleted contact, lets clients sync deletions incrementally
+    """
+    __tablename__ = 'contact_deletions'
+    __table_args__ = (
+        Index('ix_contact_deletions_user_id_created_at', 'user_id', 'created_at'),
+    )
+    contact_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    user_id: Mapped[User] = mapped_column(
+        ForeignKey('users.id', ondelete='CASCADE', onupdate='CASCADE')
+    )
+
+    def __repr__(self):
+        return f'ContactDeletion(contact_id={self.contact_id})'
@@ -1,31 +1,125 @@
+import base64
+import json
+from datetime import date, datetime, timedelta, timezone
+
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_
+from sqlalchemy import select, insert, update, delete, and_, or_, case, func, literal
+from sqlalchemy.engine import Row
 
-from src.database.models import Contact, User
+from src.database.models import Contact, ContactDeletion, User, birth_doy
 from src.schemas.schemas import ContactSchema
+from src.services.cache import response_cache
+
+# Columns returned by write statements, enough to build a ContactSchemaResponse
+CONTACT_COLUMNS = (Contact.id, Contact.name, Contact.surname, Contact.email, Contact.phone, Contact.date_of_birth)
 
 
-async def get_contacts(skip: int, limit: int, db: AsyncSession, user: User) -> [Contact]:
+async def get_contacts(skip: int, limit: int, db: AsyncSession, user: User) -> [Row]:
     """
-    Get all users contacts
+    Get all users contacts.
+    Selects the response columns only, so no ORM entities are built.
 
     :param skip:
     :param limit:
     :param db:
     :param user:
-    :return: contacts
-    :rtype: [Contact]
+    :return: contacts with updated_at
+    :rtype: [Row]
     """
-    query = select(Contact).where(Contact.user_id == user.id).offset(skip).limit(limit)
+    query = (
+        select(*CONTACT_COLUMNS, Contact.updated_at)
+        .where(Contact.user_id == user.id)
+        .order_by(Contact.id)
+        .offset(skip)
+        .limit(limit)
+    )
     res = await db.execute(query)
-    return res.scalars().all()
+    return res.all()
+
+
+def encode_cursor(contact_id: int) -> str:
+    """
+    Build an opaque pagination cursor pointing after the given contact
+
+    :param contact_id:
+    :return: cursor
+    :rtype: str
+    """
+    raw = json.dumps({"id": contact_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    """
+    Get the last seen contact id from a pagination cursor
+
+    :param cursor:
+    :return: contact id
+    :rtype: int
+    :raises ValueError: if the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        contact_id = json.loads(raw)["id"]
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(contact_id, int):
+        raise ValueError("Invalid cursor")
+    return contact_id
+
+
+async def get_contacts_after(cursor: str | None, limit: int, db: AsyncSession, user: User) -> ([Row], str | None):
+    """
+    Get users contacts page by keyset (cursor) pagination.
+
+    Every page is an index range scan on (user_id, id), so its cost does not
+    depend on how deep the client has paged.
+
+    :param cursor: cursor returned with the previous page, None for the first page
+    :param limit:
+    :param db:
+    :param user:
+    :return: contacts with updated_at, next_cursor
+    :rtype: ([Row], str | None)
+    :raises ValueError: if the cursor is malformed
+    """
+    query = select(*CONTACT_COLUMNS, Contact.updated_at).where(Contact.user_id == user.id)
+    if cursor:
+        query = query.where(Contact.id > decode_cursor(cursor))
+    query = query.order_by(Contact.id).limit(limit)
+    res = await db.execute(query)
+    contacts = res.all()
+    next_cursor = encode_cursor(contacts[-1].id) if contacts and len(contacts) == limit else None
+    return contacts, next_cursor
+
+
+async def get_contacts_version(user: User, db: AsyncSession, limit: int, skip: int = 0,
+                               after_id: int | None = None) -> Row:
+    """
+    Aggregate fingerprint of a contacts page, as returned by get_contacts or get_contacts_after,
+    without loading the page itself
+
+    :param user:
+    :param db:
+    :param limit:
+    :param skip:
+    :param after_id: decoded cursor, the page starts after this id
+    :return: count, max updated_at and sum of ids of the page
+    :rtype: Row
+    """
+    page = select(Contact.id, Contact.updated_at).where(Contact.user_id == user.id)
+    if after_id is not None:
+        page = page.where(Contact.id > after_id)
+    page = page.order_by(Contact.id).offset(skip).limit(limit).subquery()
+    res = await db.execute(select(func.count(), func.max(page.c.updated_at), func.sum(page.c.id)))
+    return res.one()
 
 
 async def search_contacts(user: User, db: AsyncSession,
                           name: str = None,
                           surname: str = None,
                           email: str = None,
-                          ) -> [Contact]:
+                          ) -> [Row]:
     """
     Search users contacts
 
@@ -35,7 +129,7 @@ async def search_contacts(user: User, db: AsyncSession,
     :param surname:
     :param email:
     :return: contacts
-    :rtype: [Contact]
+    :rtype: [Row]
     """
     params = {}
     if name:
@@ -45,24 +139,247 @@ async def search_contacts(user: User, db: AsyncSession,
     if email:
         params['email'] = email
 
-    query = select(Contact).where(Contact.user_id == user.id).filter_by(**params)
+    query = select(*CONTACT_COLUMNS).where(Contact.user_id == user.id).filter_by(**params)
     res = await db.execute(query)
-    return res.scalars().all()
+    return res.all()
+
+
+# pg_trgm default of pg_trgm.similarity_threshold, used by the % operator
+SIMILARITY_THRESHOLD = 0.3
+
+
+def _trigrams(value: str) -> set:
+    trigrams = set()
+    for word in "".join(c if c.isalnum() else " " for c in value.lower()).split():
+        word = f"  {word} "
+        trigrams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return trigrams
+
+
+def trigram_similarity(a: str, b: str) -> float:
+    """
+    Similarity of two strings computed the way pg_trgm similarity() does
+
+    :param a:
+    :param b:
+    :return: similarity from 0 to 1
+    :rtype: float
+    """
+    a, b = _trigrams(a), _trigrams(b)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("/", "//").replace("%", "/%").replace("_", "/_")
+
+
+async def fuzzy_search_contacts(user: User, db: AsyncSession, q: str, limit: int = 20) -> [Row]:
+    """
+    Search users contacts by name, surname or email with prefix, substring and
+    typo-tolerant matching. Prefix matches come first, then contacts ranked by similarity.
+
+    On PostgreSQL the query is served by the (user_id, column) pg_trgm GIN indexes, other databases
+    fall back to ranking the users contacts in memory.
+
+    :param user:
+    :param db:
+    :param q:
+    :param limit:
+    :return: contacts
+    :rtype: [Row]
+    """
+    fields = (Contact.name, Contact.surname, Contact.email)
+    if db.get_bind().dialect.name == "postgresql":
+        prefix = _escape_like(q) + "%"
+        substring = "%" + _escape_like(q) + "%"
+        is_prefix = or_(*(field.ilike(prefix, escape="/") for field in fields))
+        rank = func.greatest(*(func.similarity(field, q) for field in fields))
+        query = (
+            select(*CONTACT_COLUMNS)
+            .where(Contact.user_id == user.id)
+            .where(or_(*(field.ilike(substring, escape="/") for field in fields),
+                       *(field.op("%")(q) for field in fields)))
+            .order_by(case((is_prefix, 1), else_=0).desc(), rank.desc(), Contact.id)
+            .limit(limit)
+        )
+        res = await db.execute(query)
+        return res.all()
+
+    res = await db.execute(select(*CONTACT_COLUMNS).where(Contact.user_id == user.id))
+    needle = q.lower()
+    ranked = []
+    for contact in res.all():
+        values = [value.lower() for value in (contact.name, contact.surname, contact.email) if value]
+        is_prefix = any(value.startswith(needle) for value in values)
+        is_substring = any(needle in value for value in values)
+        rank = max((trigram_similarity(value, needle) for value in values), default=0.0)
+        if is_substring or rank >= SIMILARITY_THRESHOLD:
+            ranked.append((not is_prefix, -rank, contact.id, contact))
+    ranked.sort(key=lambda item: item[:3])
+    return [item[3] for item in ranked[:limit]]
+
+
+async def stream_contacts(user: User, db: AsyncSession, batch_size: int = 1000):
+    """
+    Stream all users contacts from a server-side cursor, batch_size rows at a time.
+    Only the exported columns are selected, no ORM objects are built.
+
+    :param user:
+    :param db:
+    :param batch_size:
+    :return: batches of rows
+    :rtype: AsyncIterator[[Row]]
+    """
+    query = (
+        select(*CONTACT_COLUMNS)
+        .where(Contact.user_id == user.id)
+        .order_by(Contact.id)
+        .execution_options(yield_per=batch_size)
+    )
+    res = await db.stream(query)
+    async for rows in res.partitions():
+        yield rows
+
+
+async def get_upcoming_birthdays(user: User, days: int, db: AsyncSession, today: date | None = None) -> [Row]:
+    """
+    Get users contacts whose birthday is within the next days days, soonest first.
+
+    The window is one or, when it wraps past the end of the year, two ranges
+    of the (user_id, birth_doy) index.
+
+    :param user:
+    :param days:
+    :param db:
+    :param today: defaults to the current date
+    :return: contacts
+    :rtype: [Row]
+    """
+    today = today or date.today()
+    end = today + timedelta(days=days)
+    start_doy, end_doy = birth_doy(today), birth_doy(end)
+    if days >= 365:
+        window = Contact.birth_doy.is_not(None)
+    elif end.year == today.year:
+        window = Contact.birth_doy.between(start_doy, end_doy)
+    else:
+        window = or_(Contact.birth_doy >= start_doy, Contact.birth_doy <= end_doy)
+    query = (
+        select(*CONTACT_COLUMNS)
+        .where(Contact.user_id == user.id, window)
+        .order_by(case((Contact.birth_doy >= start_doy, 0), else_=1), Contact.birth_doy, Contact.id)
+    )
+    res = await db.execute(query)
+    return res.all()
+
+
+def deletions_horizon(retention: timedelta, now: datetime | None = None) -> datetime:
+    """
+    Oldest time deletion tombstones are kept for. A sync from before it may miss deletions,
+    the client has to resync from scratch.
+
+    :param retention:
+    :param now: current UTC time
+    :return: horizon
+    :rtype: datetime
+    """
+    if now is None:
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return now - retention
+
+
+async def get_changes(user: User, since: datetime | None, db: AsyncSession,
+                      lag: timedelta = timedelta(0)) -> ([Row], [int], datetime | None):
+    """
+    Get contacts changed and ids of contacts deleted at or after since, all contacts if since is None.
+    The bound is inclusive, so changes sharing the watermark timestamp are sent again rather than lost.
+
+    Timestamps are taken when a transaction starts, so one that commits late can show up below the
+    newest timestamp already returned. The watermark is moved back by lag to pick those up on the
+    next sync, at the cost of sending the changes of the last lag seconds again.
+
+    :param user:
+    :param since: watermark returned by the previous sync
+    :param db:
+    :param lag: how long a transaction may take to commit
+    :return: changed contacts, deleted contact ids and the new watermark
+    :rtype: ([Row], [int], datetime | None)
+    """
+    query = select(*CONTACT_COLUMNS, Contact.updated_at).where(Contact.user_id == user.id)
+    if since is not None:
+        query = query.where(Contact.updated_at >= since)
+    res = await db.execute(query.order_by(Contact.updated_at, Contact.id))
+    changed = res.all()
+
+    deleted = []
+    if since is not None:
+        res = await db.execute(
+            select(ContactDeletion.contact_id, ContactDeletion.created_at)
+            .where(and_(ContactDeletion.user_id == user.id, ContactDeletion.created_at >= since))
+            .order_by(ContactDeletion.created_at)
+        )
+        deleted = res.all()
+
+    timestamps = [row.updated_at for row in changed] + [row.created_at for row in deleted]
+    watermark = max(timestamps, default=None)
+    if watermark is not None:
+        watermark -= lag
+    if since is not None and (watermark is None or watermark < since):
+        watermark = since
+    return changed, [row.contact_id for row in deleted], watermark
+
+
+async def prune_deletions(before: datetime, db: AsyncSession) -> int:
+    """
+    Delete the tombstones of contacts deleted before the given time
+
+    :param before: horizon returned by deletions_horizon
+    :param db:
+    :return: number of tombstones deleted
+    :rtype: int
+    """
+    res = await db.execute(
+        delete(ContactDeletion)
+        .where(ContactDeletion.created_at < before)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return res.rowcount
 
 
-async def get_contact(user: User, contact_id: int, db: AsyncSession) -> Contact:
+async def get_contact(user: User, contact_id: int, db: AsyncSession) -> Row | None:
     """
     Get contact by id
 
     :param user:
     :param contact_id:
     :param db:
-    :return: contact
-    :rtype: Contact
+    :return: contact with updated_at
+    :rtype: Row | None
     """
-    query = select(Contact).where(and_(Contact.user_id == user.id, Contact.id == contact_id))
+    query = (
+        select(*CONTACT_COLUMNS, Contact.updated_at)
+        .where(and_(Contact.user_id == user.id, Contact.id == contact_id))
+    )
     res = await db.execute(query)
-    return res.scalars().first()
+    return res.first()
+
+
+async def get_contact_version(user: User, contact_id: int, db: AsyncSession) -> datetime | None:
+    """
+    Get updated_at of a contact without loading it
+
+    :param user:
+    :param contact_id:
+    :param db:
+    :return: updated_at, None if the contact does not exist
+    :rtype: datetime | None
+    """
+    query = select(Contact.updated_at).where(and_(Contact.user_id == user.id, Contact.id == contact_id))
+    res = await db.execute(query)
+    return res.scalar_one_or_none()
 
 
 async def create_contact(user: User, contact: ContactSchema, db: AsyncSession) -> Contact:
@@ -77,53 +394,171 @@ async def create_contact(user: User, contact: ContactSchema, db: AsyncSession) -
     """
     contact = Contact(**contact.model_dump(exclude_unset=True), user_id=user.id)
     db.add(contact)
+    # The INSERT returns the generated id, the session does not expire it on commit
     await db.commit()
-    await db.refresh(contact)
+    await response_cache.invalidate(user.id)
 
     return contact
 
 
-async def update_contact(user: User, contact_id: int, contact: ContactSchema, db: AsyncSession) -> Contact | None:
+async def insert_contacts(user: User, contacts: [ContactSchema], db: AsyncSession) -> [int]:
     """
-    Update contact by id
+    Insert many contacts with a single multi-row INSERT ... RETURNING, without committing.
+    The caller commits and invalidates the response cache of the user.
+
+    :param user:
+    :param contacts:
+    :param db:
+    :return: ids of new contacts
+    :rtype: [int]
+    """
+    rows = [dict(contact.model_dump(), birth_doy=birth_doy(contact.date_of_birth), user_id=user.id)
+            for contact in contacts]
+    res = await db.execute(insert(Contact).returning(Contact.id), rows)
+    return res.scalars().all()
+
+
+async def create_contacts(user: User, contacts: [ContactSchema], db: AsyncSession) -> [int]:
+    """
+    Create many contacts with a single multi-row INSERT ... RETURNING
+
+    :param user:
+    :param contacts:
+    :param db:
+    :return: ids of new contacts
+    :rtype: [int]
+    """
+    ids = await insert_contacts(user, contacts, db)
+    await db.commit()
+    await response_cache.invalidate(user.id)
+
+    return ids
+
+
+async def update_contact(user: User, contact_id: int, contact: ContactSchema, db: AsyncSession) -> Row | None:
+    """
+    Update contact by id with a single UPDATE ... RETURNING
 
     :param user:
     :param contact_id:
     :param contact:
     :param db:
     :return: contact
-    :rtype: Contact
+    :rtype: Row
     """
-    query = select(Contact).where(and_(Contact.user_id == user.id, Contact.id == contact_id))
+    values = contact.model_dump(exclude_unset=True)
+    if "date_of_birth" in values:
+        values["birth_doy"] = birth_doy(values["date_of_birth"])
+    query = (
+        update(Contact)
+        .where(and_(Contact.user_id == user.id, Contact.id == contact_id))
+        .values(**values)
+        .returning(*CONTACT_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )
     res = await db.execute(query)
-    contact_db = res.scalars().first()
-    if contact_db:
-        dump = contact.model_dump(exclude_unset=True)
-        for key in dump:
-            setattr(contact_db, key, dump[key])
-
-        await db.commit()
-        await db.refresh(contact_db)
+    contact_db = res.first()
+    await db.commit()
+    if contact_db is not None:
+        await response_cache.invalidate(user.id)
 
     return contact_db
 
 
-async def delete_contact(user: User, contact_id: int, db: AsyncSession) -> Contact | None:
+async def delete_contact(user: User, contact_id: int, db: AsyncSession) -> Row | None:
     """
-    Delete contact by id
+    Delete contact by id with a single DELETE ... RETURNING
 
     :param user:
     :param contact_id:
     :param db:
     :return: contact
-    :rtype: Contact
+    :rtype: Row
     """
-    query = select(Contact).where(and_(Contact.user_id == user.id, Contact.id == contact_id))
+    query = (
+        delete(Contact)
+        .where(and_(Contact.user_id == user.id, Contact.id == contact_id))
+        .returning(*CONTACT_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )
     res = await db.execute(query)
-    contact = res.scalars().first()
-    if contact:
-        await db.delete(contact)
-        await db.flush()
-        await db.commit()
+    contact = res.first()
+    if contact is not None:
+        db.add(ContactDeletion(user_id=user.id, contact_id=contact.id))
+    await db.commit()
+    if contact is not None:
+        await response_cache.invalidate(user.id)
 
     return contact
+
+
+async def update_contacts(user: User, patches: dict, db: AsyncSession) -> set:
+    """
+    Apply patches to many contacts with a single UPDATE ... RETURNING. Every patched column
+    is set with a CASE on the contact id that keeps the current value of contacts without
+    a patch for it, so one statement covers patches of different columns.
+    Contacts with an empty patch are matched but left untouched.
+
+    :param user:
+    :param patches: contact id -> dict of changed fields
+    :param db:
+    :return: ids of updated contacts
+    :rtype: set
+    """
+    patches = {contact_id: dict(values) for contact_id, values in patches.items()}
+    for values in patches.values():
+        if "date_of_birth" in values:
+            values["birth_doy"] = birth_doy(values["date_of_birth"])
+    columns = sorted({column for values in patches.values() for column in values})
+    changed = [contact_id for contact_id, values in patches.items() if values]
+
+    assignments = {}
+    for column in columns:
+        attribute = getattr(Contact, column)
+        whens = {contact_id: literal(values[column], attribute.type)
+                 for contact_id, values in patches.items() if column in values}
+        assignments[column] = case(whens, value=Contact.id, else_=attribute)
+    # Set explicitly so that contacts with an empty patch keep their updated_at
+    assignments["updated_at"] = (
+        case((Contact.id.in_(changed), func.now()), else_=Contact.updated_at) if changed else Contact.updated_at
+    )
+    query = (
+        update(Contact)
+        .where(and_(Contact.user_id == user.id, Contact.id.in_(patches)))
+        .values(assignments)
+        .returning(Contact.id)
+        .execution_options(synchronize_session=False)
+    )
+    res = await db.execute(query)
+    found = set(res.scalars().all())
+    await db.commit()
+    if found.intersection(changed):
+        await response_cache.invalidate(user.id)
+
+    return found
+
+
+async def delete_contacts(user: User, contact_ids: [int], db: AsyncSession) -> set:
+    """
+    Delete many contacts with a single DELETE ... RETURNING
+
+    :param user:
+    :param contact_ids:
+    :param db:
+    :return: ids of deleted contacts
+    :rtype: set
+    """
+    query = (
+        delete(Contact)
+        .where(and_(Contact.user_id == user.id, Contact.id.in_(contact_ids)))
+        .returning(Contact.id)
+        .execution_options(synchronize_session=False)
+    )
+    res = await db.execute(query)
+    deleted = set(res.scalars().all())
+    db.add_all([ContactDeletion(user_id=user.id, contact_id=contact_id) for contact_id in deleted])
+    await db.commit()
+    if deleted:
+        await response_cache.invalidate(user.id)
+
+    return deleted
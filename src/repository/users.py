@@ -1,10 +1,9 @@
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from libgravatar import Gravatar
-
 from src.database.models import User
 from src.schemas.schemas import UserSchema
+from src.services.cache import user_cache
 
 
 async def get_user_by_email(email: str, db: AsyncSession):
@@ -24,22 +23,18 @@ async def get_user_by_email(email: str, db: AsyncSession):
 
 async def create_user(body: UserSchema, db: AsyncSession):
     """
-    Create new user
+    Create new user. The avatar is left empty, the Gravatar is set after signup by gravatar_resolver.
 
     :param body:
     :param db:
     :return: user
     :rtype: User
     """
-    avatar = None
-    try:
-        g = Gravatar(body.email)
-        avatar = g.get_image()
-    except Exception as e:
-        print(e)
     new_user = User(**body.model_dump(exclude_defaults=True))
-    new_user.avatar = avatar
+    new_user.avatar = None
     db.add(new_user)
+    # Reads of the user go to the primary for a while after the commit, see PinningSession
+    db.info["user"] = new_user.email
     await db.commit()
     await db.refresh(new_user)
     return new_user
@@ -56,7 +51,9 @@ async def update_token(user: User, token: str | None, db: AsyncSession):
     :rtype:
     """
     user.refresh_token = token
+    db.info["user"] = user.email
     await db.commit()
+    await user_cache.invalidate(user.email)
 
 
 async def confirmed_email(email: str, db: AsyncSession) -> None:
@@ -70,8 +67,10 @@ async def confirmed_email(email: str, db: AsyncSession) -> None:
     """
     user = await get_user_by_email(email, db)
     user.confirmed = True
+    db.info["user"] = email
     await db.commit()
     await db.refresh(user)
+    await user_cache.invalidate(email)
 
 
 async def update_avatar(email, url: str, db: AsyncSession) -> User:
@@ -86,6 +85,28 @@ async def update_avatar(email, url: str, db: AsyncSession) -> User:
     """
     user = await get_user_by_email(email, db)
     user.avatar = url
+    db.info["user"] = email
     await db.commit()
     await db.refresh(user)
+    await user_cache.invalidate(email)
     return user
+
+
+async def set_default_avatar(email: str, url: str, db: AsyncSession) -> bool:
+    """
+    Set the avatar of a user who has none, an avatar uploaded in the meantime is kept
+
+    :param email:
+    :param url:
+    :param db:
+    :return: whether the avatar was set
+    :rtype: bool
+    """
+    stmt = update(User).where(User.email == email, User.avatar.is_(None)).values(avatar=url)
+    result = await db.execute(stmt)
+    db.info["user"] = email
+    await db.commit()
+    if not result.rowcount:
+        return False
+    await user_cache.invalidate(email)
+    return True
@@ -9,6 +9,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.services.auth import auth_service
 from src.services.email import send_email
+from src.services.gravatar import gravatar_resolver
 
 router = APIRouter(prefix='/auth', tags=["auth"])
 get_refresh_token = HTTPBearer()
@@ -44,9 +45,10 @@ async def signup(body: UserSchema, background_tasks: BackgroundTasks, request: R
     if exist_user:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Account already exists")
     #
-    body.password = auth_service.get_password_hash(body.password)
+    body.password = await auth_service.get_password_hash(body.password)
     new_user = await create_user(body, db)
     background_tasks.add_task(send_email, new_user.email, new_user.name, request.base_url)
+    background_tasks.add_task(gravatar_resolver.assign, new_user.email)
     return new_user
 
 
@@ -66,7 +68,7 @@ async def login(body: OAuth2PasswordRequestForm = Depends(), db: AsyncSession =
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email")
     if not user.confirmed:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Email not confirmed")
-    if not auth_service.verify_password(body.password, user.password):
+    if not await auth_service.verify_password(body.password, user.password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid password")
     # Generate JWT
     access_token = await auth_service.create_access_token(data={"sub": user.email})
@@ -95,6 +97,7 @@ async def refresh_token(
     if user.refresh_token != token:
         user.refresh_token = None
         await db.commit()
+        await auth_service.revoke_access_tokens(email)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
 
     access_token = await auth_service.create_access_token(data={"sub": email})
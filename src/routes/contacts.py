@@ -1,16 +1,45 @@
+from datetime import datetime, timedelta, timezone
+import json
 from typing import List
 
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, status, Response, UploadFile, File, Query, Header
+from fastapi.responses import StreamingResponse
 from fastapi_limiter.depends import RateLimiter
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db
+from src.database.db import get_db, get_read_db_for, is_replica_session
 from src.database.models import User
-from src.schemas.schemas import ContactSchema, ContactSchemaResponse
+from src.schemas.schemas import (
+    ContactSchema,
+    ContactSchemaResponse,
+    ContactImportReport,
+    ContactBatchUpdate,
+    ContactBatchDelete,
+    ContactBatchResult,
+    ContactChanges,
+)
 from src.repository import contacts as contacts_repo
 from src.services.auth import auth_service
+from src.services.cache import response_cache
+from src.services.instrumentation import timed_serialization
+from src.services.etag import etag_matches, make_etag, page_etag
+from src.services import contacts_io
+from settings import settings
 
 router = APIRouter(prefix='/contacts', tags=["contacts"])
+get_read_db = get_read_db_for(auth_service.get_current_user)
+
+async def cached_response(key: str, if_none_match: str | None) -> Response | None:
+    """
+    Cached response for the key, 304 Not Modified if it matches If-None-Match, None on a miss
+    """
+    cached = await response_cache.get(key)
+    if cached is None:
+        return None
+    headers, body = cached
+    if etag_matches(if_none_match, headers.get("ETag", "")):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": headers["ETag"]})
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @router.get("/",
@@ -21,21 +50,62 @@ router = APIRouter(prefix='/contacts', tags=["contacts"])
 async def get_contacts(
         skip: int = 0,
         limit: int = 100,
-        db: AsyncSession = Depends(get_db),
+        cursor: str = None,
+        if_none_match: str = Header(default=None),
+        db: AsyncSession = Depends(get_read_db),
         current_user: User = Depends(auth_service.get_current_user)):
     """
-    Get contacts
+    Get contacts.
+
+    Pages either by skip/limit or, when cursor is passed, by keyset pagination.
+    Whenever the page is full the cursor of the next page is returned in the
+    X-Next-Cursor header, so a client can switch to cursor paging at any point.
+
+    Every page carries an ETag. A request with a matching If-None-Match gets
+    304 Not Modified after one aggregate query, without loading the page.
+    Serialized pages read from the primary are cached in Redis until the user changes a contact.
 
-    :param current_user:
     :param skip:
     :param limit:
+    :param cursor: X-Next-Cursor value of the previous page
+    :param if_none_match: ETag of the page the client has
     :param db:
     :param current_user:
     :return: List[ContactSchemaResponse]
     :rtype: List[ContactSchemaResponse]
     """
-    contacts = await contacts_repo.get_contacts(skip, limit, db, current_user)
-    return contacts
+    after_id = None
+    if cursor:
+        try:
+            after_id = contacts_repo.decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    cache_key = await response_cache.key(current_user.id, json.dumps(["list", skip, limit, cursor]))
+    cached = await cached_response(cache_key, if_none_match)
+    if cached is not None:
+        return cached
+    if if_none_match:
+        version = await contacts_repo.get_contacts_version(current_user, db, limit,
+                                                           skip=0 if cursor else skip, after_id=after_id)
+        etag = page_etag(current_user.id, *version)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    if cursor:
+        contacts, next_cursor = await contacts_repo.get_contacts_after(cursor, limit, db, current_user)
+    else:
+        contacts = await contacts_repo.get_contacts(skip, limit, db, current_user)
+        next_cursor = contacts_repo.encode_cursor(contacts[-1].id) if contacts and len(contacts) == limit else None
+    headers = {"ETag": page_etag(current_user.id,
+                                 len(contacts),
+                                 max((contact.updated_at for contact in contacts), default=None),
+                                 sum(contact.id for contact in contacts))}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    with timed_serialization():
+        body = contacts_io.encode_json(contacts)
+    if not is_replica_session(db):
+        await response_cache.set(cache_key, headers, body)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @router.get("/search",
@@ -47,22 +117,134 @@ async def get_contacts(
 async def search_contacts(name: str = None,
                           surname: str = None,
                           email: str = None,
-                          db: AsyncSession = Depends(get_db),
+                          q: str = Query(default=None, min_length=1, max_length=50),
+                          limit: int = Query(default=20, ge=1, le=100),
+                          db: AsyncSession = Depends(get_read_db),
                           current_user: User = Depends(auth_service.get_current_user)):
     """
-    Search contacts
+    Search contacts.
+
+    With q, contacts are matched by prefix, substring or similarity of name, surname
+    or email and ranked, otherwise name, surname and email must match exactly.
+    Serialized results are cached in Redis until the user changes a contact.
 
     :param current_user:
     :param name:
     :param surname:
     :param email:
+    :param q: free text query
+    :param limit: maximum number of contacts found by q
+    :param db:
+    :param current_user:
+    :return: List[ContactSchemaResponse]
+    :rtype: List[ContactSchemaResponse]
+    """
+    cache_key = await response_cache.key(current_user.id, json.dumps(["search", name, surname, email, q, limit]))
+    cached = await cached_response(cache_key, None)
+    if cached is not None:
+        return cached
+    if q:
+        contacts = await contacts_repo.fuzzy_search_contacts(current_user, db, q, limit)
+    else:
+        contacts = await contacts_repo.search_contacts(current_user, db, name, surname, email)
+    with timed_serialization():
+        body = contacts_io.encode_json(contacts)
+    if not is_replica_session(db):
+        await response_cache.set(cache_key, {}, body)
+    return Response(content=body, media_type="application/json")
+
+
+@router.get("/birthdays",
+            response_model=List[ContactSchemaResponse],
+            description='No more than 10 requests per minute',
+            dependencies=[Depends(RateLimiter(times=10, seconds=60))],
+            status_code=status.HTTP_200_OK)
+async def get_upcoming_birthdays(
+        days: int = Query(default=7, ge=0, le=366),
+        db: AsyncSession = Depends(get_read_db),
+        current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Get contacts whose birthday is within the next days days, soonest first
+
+    :param days:
     :param db:
     :param current_user:
     :return: List[ContactSchemaResponse]
     :rtype: List[ContactSchemaResponse]
     """
-    tags = await contacts_repo.search_contacts(current_user, db, name, surname, email)
-    return tags
+    contacts = await contacts_repo.get_upcoming_birthdays(current_user, days, db)
+    return contacts
+
+
+@router.get("/changes",
+            response_model=ContactChanges,
+            description='No more than 10 requests per minute',
+            dependencies=[Depends(RateLimiter(times=10, seconds=60))],
+            status_code=status.HTTP_200_OK)
+async def get_contact_changes(
+        since: datetime = None,
+        db: AsyncSession = Depends(get_read_db),
+        current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Get contacts changed and ids of contacts deleted since the watermark of the previous sync.
+    Without since, or with a since older than the deletions kept, all contacts are returned and
+    full is set: the client replaces its copy instead of merging. Items from the last
+    seconds before the watermark may be sent twice, clients apply them idempotently.
+
+    :param since: watermark returned by the previous call
+    :param db:
+    :param current_user:
+    :return: changed contacts, deleted ids, the watermark for the next call and whether it is a full resync
+    :rtype: ContactChanges
+    """
+    if since is not None and since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    horizon = contacts_repo.deletions_horizon(timedelta(days=settings.contacts_deletions_retention_days))
+    if since is not None and since < horizon:
+        since = None
+    changed, deleted, watermark = await contacts_repo.get_changes(
+        current_user, since, db, lag=timedelta(seconds=settings.contacts_sync_lag_seconds))
+    return {"changed": changed, "deleted": deleted, "watermark": watermark, "full": since is None}
+
+
+@router.get("/export",
+            response_class=StreamingResponse,
+            description='No more than 1 request per 10 seconds',
+            dependencies=[Depends(RateLimiter(times=1, seconds=10))],
+            status_code=status.HTTP_200_OK)
+async def export_contacts(
+        format: str = Query(default="csv", pattern="^(csv|ndjson|vcard)$"),
+        gzip: bool = False,
+        db: AsyncSession = Depends(get_read_db),
+        current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Export all contacts as CSV, NDJSON or vCard, optionally gzip-compressed.
+    Rows are streamed from the database, so memory use stays flat.
+
+    :param format: csv, ndjson or vcard
+    :param gzip: compress the file
+    :param db:
+    :param current_user:
+    :return: contacts file
+    :rtype: StreamingResponse
+    """
+
+    async def content():
+        try:
+            batches = contacts_repo.stream_contacts(current_user, db, settings.contacts_export_batch_size)
+            async for chunk in contacts_io.export_contacts(batches, format, compress=gzip):
+                yield chunk
+        finally:
+            # The response outlives the session dependency, release the connection here
+            await db.close()
+
+    filename = f"contacts.{contacts_io.EXPORT_EXTENSIONS[format]}"
+    media_type = contacts_io.EXPORT_MEDIA_TYPES[format]
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(content(), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
 
 
 @router.get("/{contact_id}",
@@ -72,21 +254,33 @@ async def search_contacts(name: str = None,
             status_code=status.HTTP_200_OK)
 async def get_contact_by_id(
         contact_id: int,
-        db: AsyncSession = Depends(get_db),
+        response: Response,
+        if_none_match: str = Header(default=None),
+        db: AsyncSession = Depends(get_read_db),
         current_user: User = Depends(auth_service.get_current_user)):
     """
-    Get contact by id
+    Get contact by id.
+    Answers 304 Not Modified when If-None-Match carries the current ETag of the contact.
 
-    :param current_user:
     :param contact_id:
+    :param response:
+    :param if_none_match: ETag of the contact the client has
     :param db:
     :param current_user:
     :return: ContactSchemaResponse
     :rtype: ContactSchemaResponse
     """
+    if if_none_match:
+        updated_at = await contacts_repo.get_contact_version(current_user, contact_id, db)
+        if updated_at is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Contact not found!")
+        etag = make_etag("contact", contact_id, updated_at)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
     contact = await contacts_repo.get_contact(current_user, contact_id, db)
     if contact is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Contact not found!")
+    response.headers["ETag"] = make_etag("contact", contact.id, contact.updated_at)
     return contact
 
 
@@ -113,6 +307,86 @@ async def create_contact(
     return contact
 
 
+@router.post("/import",
+             response_model=ContactImportReport,
+             description='No more than 1 request per 10 seconds',
+             dependencies=[Depends(RateLimiter(times=1, seconds=10))],
+             status_code=status.HTTP_200_OK)
+async def import_contacts(
+        file: UploadFile = File(),
+        format: str = Query(default=None, pattern="^(csv|ndjson)$"),
+        db: AsyncSession = Depends(get_db),
+        current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Import contacts from a CSV (with a header row) or NDJSON file.
+    Valid rows are inserted in chunks, invalid ones are listed in the report.
+    A file that is not UTF-8 or not valid CSV is rejected with 400 and the report up to
+    the unreadable row, the rows before it are kept.
+
+    :param file:
+    :param format: csv or ndjson, guessed from the file name and content type if omitted
+    :param db:
+    :param current_user:
+    :return: ContactImportReport
+    :rtype: ContactImportReport
+    """
+    fmt = format or contacts_io.detect_import_format(file.filename, file.content_type)
+    try:
+        report = await contacts_io.import_contacts(file.file, fmt, current_user, db,
+                                                   chunk_size=settings.contacts_import_chunk_size,
+                                                   max_errors=settings.contacts_import_max_errors)
+    except contacts_io.ContactImportFileError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.report)
+    return report
+
+
+@router.post("/batch/update",
+             response_model=List[ContactBatchResult],
+             description='No more than 10 requests per minute',
+             dependencies=[Depends(RateLimiter(times=10, seconds=60))],
+             status_code=status.HTTP_200_OK)
+async def batch_update_contacts(
+        body: ContactBatchUpdate,
+        db: AsyncSession = Depends(get_db),
+        current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Update many contacts in one transaction.
+    Only the fields present in each patch are changed, a later patch of the same id wins.
+
+    :param body:
+    :param db:
+    :param current_user:
+    :return: status of every item, updated or not_found
+    :rtype: List[ContactBatchResult]
+    """
+    patches = {item.id: item.patch.model_dump(exclude_unset=True) for item in body.items}
+    updated = await contacts_repo.update_contacts(current_user, patches, db)
+    return [{"id": item.id, "status": "updated" if item.id in updated else "not_found"} for item in body.items]
+
+
+@router.post("/batch/delete",
+             response_model=List[ContactBatchResult],
+             description='No more than 10 requests per minute',
+             dependencies=[Depends(RateLimiter(times=10, seconds=60))],
+             status_code=status.HTTP_200_OK)
+async def batch_delete_contacts(
+        body: ContactBatchDelete,
+        db: AsyncSession = Depends(get_db),
+        current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Delete many contacts in one transaction
+
+    :param body:
+    :param db:
+    :param current_user:
+    :return: status of every id, deleted or not_found
+    :rtype: List[ContactBatchResult]
+    """
+    deleted = await contacts_repo.delete_contacts(current_user, body.ids, db)
+    return [{"id": contact_id, "status": "deleted" if contact_id in deleted else "not_found"}
+            for contact_id in body.ids]
+
+
 @router.put("/{contact_id}",
             response_model=ContactSchemaResponse,
             description='No more than 10 requests per minute',
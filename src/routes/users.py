@@ -1,52 +1,110 @@
-from fastapi import APIRouter, Depends, status, UploadFile, File
-from sqlalchemy.ext.asyncio import AsyncSession
-import cloudinary
-import cloudinary.uploader
+from fastapi import APIRouter, Depends, status, UploadFile, File, Header, Request, Response, HTTPException
 
-from src.database.db import get_db
 from src.database.models import User
-from src.repository import users as repository_users
 from src.services.auth import auth_service
-from settings import settings
-from src.schemas.schemas import UserSchema
+from src.services.avatars import AVATAR_NAME, avatar_pipeline, avatar_thumbnail_url, public_avatar_url, read_avatar
+from src.services.etag import etag_matches, make_etag
+from src.schemas.schemas import UserResponseSchema, AvatarJobSchema
 
 router = APIRouter(prefix="/users", tags=["users"])
 
 
-@router.get("/me", response_model=UserSchema)
-async def read_users_me(current_user: User = Depends(auth_service.get_current_user)):
+def job_response(job: dict, request: Request) -> dict:
     """
-    Get current user
+    Avatar job with the absolute URLs of the avatar and its thumbnail
 
+    :param job:
+    :param request:
+    :return: job
+    :rtype: dict
+    """
+    avatar = public_avatar_url(job["avatar"], str(request.base_url))
+    return dict(job, avatar=avatar, avatar_thumbnail=avatar_thumbnail_url(avatar))
+
+
+@router.get("/me", response_model=UserResponseSchema)
+async def read_users_me(request: Request,
+                        response: Response,
+                        if_none_match: str = Header(default=None),
+                        current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Get current user.
+    Answers 304 Not Modified when If-None-Match carries the current ETag.
+
+    :param request:
+    :param response:
+    :param if_none_match: ETag of the profile the client has
     :param current_user:
     :return: current_user
-    :rtype: UserSchema
+    :rtype: UserResponseSchema
     """
-    return current_user
+    avatar = public_avatar_url(current_user.avatar, str(request.base_url))
+    etag = make_etag("user", current_user.id, current_user.name, current_user.email, avatar)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return UserResponseSchema(id=current_user.id, name=current_user.name, email=current_user.email, avatar=avatar,
+                              avatar_thumbnail=avatar_thumbnail_url(avatar))
 
 
-@router.patch('/avatar', response_model=UserSchema)
-async def update_avatar_user(file: UploadFile = File(),
-                             current_user: User = Depends(auth_service.get_current_user),
-                             db: AsyncSession = Depends(get_db)):
+@router.patch('/avatar', response_model=AvatarJobSchema, status_code=status.HTTP_202_ACCEPTED)
+async def update_avatar_user(request: Request,
+                             response: Response,
+                             file: UploadFile = File(),
+                             current_user: User = Depends(auth_service.get_current_user)):
     """
-    Update avatar user
+    Update avatar user.
+    The upload is accepted once spooled, the avatar is cropped and stored in the background
+    and the user is updated when its job is done. Poll the job at the Location header
+    for the absolute URL of the new avatar.
 
+    :param request:
+    :param response:
     :param file:
     :param current_user:
-    :param db:
-    :return: user
-    :rtype: UserSchema
-    """
-    cloudinary.config(
-        cloud_name=settings.cloudinary_name,
-        api_key=settings.cloudinary_api_key,
-        api_secret=settings.cloudinary_api_secret,
-        secure=True
-    )
-
-    r = cloudinary.uploader.upload(file.file, public_id=f'ContactsApp/{current_user.name}', overwrite=True)
-    src_url = cloudinary.CloudinaryImage(f'ContactsApp/{current_user.name}')\
-                        .build_url(width=250, height=250, crop='fill', version=r.get('version'))
-    user = await repository_users.update_avatar(current_user.email, src_url, db)
-    return user
+    :return: avatar job
+    :rtype: AvatarJobSchema
+    """
+    job = await avatar_pipeline.submit(current_user, file)
+    response.headers["Location"] = f"/api/users/avatar/jobs/{job['job_id']}"
+    return job_response(job, request)
+
+
+@router.get('/avatar/jobs/{job_id}', response_model=AvatarJobSchema)
+async def read_avatar_job(job_id: str, request: Request,
+                          current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Get the status of an avatar upload
+
+    :param job_id:
+    :param request:
+    :param current_user:
+    :return: avatar job
+    :rtype: AvatarJobSchema
+    """
+    job = await avatar_pipeline.jobs.get(job_id)
+    if job is None or job["user_id"] != current_user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Avatar job not found")
+    return job_response(job, request)
+
+
+@router.get('/avatars/{name}', response_class=Response)
+async def read_avatar_file(name: str, if_none_match: str = Header(default=None)):
+    """
+    Get a stored avatar image.
+    File names carry the content hash, so the image never changes and can be cached for good.
+
+    :param name: file name
+    :param if_none_match: ETag of the image the client has
+    :return: JPEG image
+    :rtype: Response
+    """
+    if not AVATAR_NAME.fullmatch(name):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Avatar not found")
+    headers = {"ETag": f'"{name}"', "Cache-Control": "public, max-age=31536000, immutable"}
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    data = await read_avatar(name)
+    if data is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Avatar not found")
+    return Response(content=data, media_type="image/jpeg", headers=headers)
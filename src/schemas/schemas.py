@@ -1,13 +1,13 @@
-from datetime import date
-from typing import Optional
+from datetime import date, datetime
+from typing import Any, List, Optional
 
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, Field, EmailStr, field_validator
 
 
 class ContactSchema(BaseModel):
     name: str = Field(min_length=3, max_length=50)
     surname: str = Field(min_length=3, max_length=50)
-    email: EmailStr = Field(default=None)
+    email: Optional[EmailStr] = Field(default=None)
     phone: Optional[str] = Field(default=None)
     date_of_birth: Optional[date] = Field(default=None)
 
@@ -16,10 +16,64 @@ class ContactSchema(BaseModel):
 
 
 class ContactSchemaResponse(ContactSchema):
+    id: int
+
     class ConfigDict:
         from_attributes = True
 
 
+class ContactPatchSchema(BaseModel):
+    name: Optional[str] = Field(default=None, min_length=3, max_length=50)
+    surname: Optional[str] = Field(default=None, min_length=3, max_length=50)
+    email: Optional[EmailStr] = Field(default=None)
+    phone: Optional[str] = Field(default=None)
+    date_of_birth: Optional[date] = Field(default=None)
+
+    @field_validator("name", "surname", "date_of_birth")
+    @classmethod
+    def not_null(cls, value):
+        if value is None:
+            raise ValueError("Field may be omitted but not null")
+        return value
+
+
+class ContactBatchUpdateItem(BaseModel):
+    id: int
+    patch: ContactPatchSchema
+
+
+class ContactBatchUpdate(BaseModel):
+    items: List[ContactBatchUpdateItem] = Field(min_length=1, max_length=1000)
+
+
+class ContactBatchDelete(BaseModel):
+    ids: List[int] = Field(min_length=1, max_length=1000)
+
+
+class ContactBatchResult(BaseModel):
+    id: int
+    status: str
+
+
+class ContactChanges(BaseModel):
+    changed: List[ContactSchemaResponse]
+    deleted: List[int]
+    watermark: Optional[datetime]
+    # All contacts of the user are in changed, local contacts missing from it were deleted
+    full: bool = False
+
+
+class ContactImportError(BaseModel):
+    row: int
+    errors: List[Any]
+
+
+class ContactImportReport(BaseModel):
+    imported: int
+    failed: int
+    errors: List[ContactImportError]
+
+
 class UserLoginSchema(BaseModel):
     email: EmailStr
     password: str = Field(min_length=3)
@@ -36,9 +90,23 @@ class UserSchema(UserLoginSchema):
         from_attributes = True
 
 
-# class UserResponseSchema(BaseModel):
-#     user: UserSchema
-#     detail: str = "User successfully created"
+class UserResponseSchema(BaseModel):
+    id: int
+    name: str
+    email: EmailStr
+    avatar: Optional[str] = None
+    avatar_thumbnail: Optional[str] = None
+
+    class ConfigDict:
+        from_attributes = True
+
+
+class AvatarJobSchema(BaseModel):
+    job_id: str
+    status: str
+    avatar: Optional[str] = None
+    avatar_thumbnail: Optional[str] = None
+    error: Optional[str] = None
 
 
 class TokenModel(BaseModel):
@@ -1,4 +1,4 @@
-import pickle
+import time
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
@@ -7,27 +7,28 @@ from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 from jose import JWTError, jwt
-import redis.asyncio as redis
 
 from src.database.db import get_db
 from src.repository import users as repository_users
+from src.services.cache import redis_client, user_cache, token_cache, token_revocations
+from src.services.passwords import PasswordHasher
 from settings import settings
 
 
 class Auth:
     pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    pwd_hasher = PasswordHasher(pwd_context, settings.password_hash_workers, settings.password_hash_max_pending)
     SECRET_KEY = settings.secret_key
     ALGORITHM = settings.algorithm
-    r = redis.Redis(
-        host=settings.redis_host,
-        port=settings.redis_port,
-        db=settings.redis_db)
+    r = redis_client
+    token_cache = token_cache
+    revocations = token_revocations
 
-    def verify_password(self, plain_password, hashed_password):
-        return self.pwd_context.verify(plain_password, hashed_password)
+    async def verify_password(self, plain_password, hashed_password):
+        return await self.pwd_hasher.verify(plain_password, hashed_password)
 
-    def get_password_hash(self, password: str):
-        return self.pwd_context.hash(password)
+    async def get_password_hash(self, password: str):
+        return await self.pwd_hasher.hash(password)
 
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
@@ -38,7 +39,8 @@ class Auth:
             expire = datetime.utcnow() + timedelta(seconds=expires_delta)
         else:
             expire = datetime.utcnow() + timedelta(minutes=settings.access_token_expire_minutes)
-        to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "access_token"})
+        # Issue time to the millisecond, see TokenRevocations
+        to_encode.update({"iat": round(time.time(), 3), "exp": expire, "scope": "access_token"})
         encoded_access_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
         return encoded_access_token
 
@@ -70,29 +72,44 @@ class Auth:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-        try:
-            # Decode JWT
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
-            if payload['scope'] == 'access_token':
-                email = payload["sub"]
-                if email is None:
+        claims = self.token_cache.get(token)
+        if claims is not None:
+            email = claims[0]
+        else:
+            try:
+                # Decode JWT
+                payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+                if payload['scope'] == 'access_token':
+                    email = payload["sub"]
+                    if email is None:
+                        raise credentials_exception
+                else:
                     raise credentials_exception
-            else:
+            except JWTError as e:
+                raise credentials_exception
+            self.token_cache.set(token, email, payload['scope'], payload['exp'])
+            # Checked once cached: a revocation published from now on evicts the entry in every worker
+            if await self.revocations.is_revoked(email, payload.get("iat", 0)):
+                self.token_cache.revoke(token)
                 raise credentials_exception
-        except JWTError as e:
-            raise credentials_exception
 
-        user = await self.r.get(f"user:{email}")
+        # Commits made on behalf of this user pin their reads to the primary
+        db.info["user"] = email
+        user = await user_cache.get(email)
         if user is None:
+            # Read from the primary, a lagging replica would put an old row back in the cache
             user = await repository_users.get_user_by_email(email, db)
             if user is None:
                 raise credentials_exception
-            await self.r.set(f"user:{email}", pickle.dumps(user))
-            await self.r.expire(f"user:{email}", 900)
-        else:
-            user = pickle.loads(user)
+            user = await user_cache.set(user)
         return user
 
+    async def revoke_access_tokens(self, email: str) -> None:
+        """
+        Reject the access tokens issued to the user so far, in every worker
+        """
+        await self.revocations.revoke(email)
+
     def create_email_token(self, data: dict):
         to_encode = data.copy()
         expire = datetime.now(timezone.utc) + timedelta(days=1)
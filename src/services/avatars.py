@@ -0,0 +1,384 @@
+import asyncio
+import hashlib
+import io
+import json
+import re
+import tempfile
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO
+from urllib.parse import urljoin
+
+import cloudinary
+import cloudinary.uploader
+import redis.asyncio as redis
+from fastapi import HTTPException, UploadFile, status
+from PIL import Image, ImageOps
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from src.database.db import async_session_factory
+from src.repository import users as repository_users
+from src.services.cache import LocalCache, redis_client
+from settings import settings
+
+# Side of the square avatar stored on the user, followed by the thumbnail sizes
+AVATAR_SIZES = (250, 64)
+
+
+def render_avatar(path: str | Path, sizes: tuple = AVATAR_SIZES) -> dict[int, bytes]:
+    """
+    Decode an uploaded image and crop it to JPEG squares of each size, largest first.
+    Blocking, runs on the avatar worker pool.
+
+    :param path: spooled upload
+    :param sizes:
+    :return: JPEG bytes by size
+    :rtype: dict[int, bytes]
+    """
+    with Image.open(path) as image:
+        # Lets the JPEG decoder scale down while decoding instead of producing full size pixels
+        image.draft("RGB", (max(sizes), max(sizes)))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+    variants = {}
+    for size in sorted(sizes, reverse=True):
+        image = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=85, optimize=True)
+        variants[size] = buffer.getvalue()
+    return variants
+
+
+class LocalStorage:
+    """
+    Stores avatars as files of a local directory served under base_url.
+    """
+
+    def __init__(self, directory: str | Path, base_url: str):
+        self.directory = Path(directory)
+        self.base_url = base_url.rstrip("/") + "/"
+
+    def url(self, name: str) -> str:
+        return f"{self.base_url}{name}"
+
+    def _write(self, name: str, data: bytes) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self.directory / f".{name}.{uuid.uuid4().hex}"
+        tmp.write_bytes(data)
+        tmp.replace(self.directory / name)
+
+    def _read(self, name: str) -> bytes | None:
+        try:
+            return (self.directory / name).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    async def save(self, name: str, data: bytes) -> str:
+        await asyncio.to_thread(self._write, name, data)
+        return self.url(name)
+
+    async def read(self, name: str) -> bytes | None:
+        return await asyncio.to_thread(self._read, name)
+
+
+class CloudinaryStorage:
+    """
+    Stores avatars on Cloudinary. The SDK is blocking, uploads and downloads run on a thread.
+    """
+
+    def __init__(self, cloud_name: str, api_key: str, api_secret: str, folder: str = "ContactsApp",
+                 timeout: float = 10):
+        cloudinary.config(cloud_name=cloud_name, api_key=api_key, api_secret=api_secret, secure=True)
+        self.folder = folder
+        self.timeout = timeout
+
+    def public_id(self, name: str) -> str:
+        return f"{self.folder}/{Path(name).stem}"
+
+    def url(self, name: str) -> str:
+        return cloudinary.CloudinaryImage(self.public_id(name)).build_url(format=Path(name).suffix.lstrip("."))
+
+    def _download(self, name: str) -> bytes | None:
+        try:
+            with urllib.request.urlopen(self.url(name), timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.URLError as e:
+            print(e)
+            return None
+
+    async def save(self, name: str, data: bytes) -> str:
+        r = await asyncio.to_thread(cloudinary.uploader.upload, data, public_id=self.public_id(name),
+                                    overwrite=True)
+        return r["secure_url"]
+
+    async def read(self, name: str) -> bytes | None:
+        return await asyncio.to_thread(self._download, name)
+
+
+class MirroredStorage:
+    """
+    Remote storage with a copy of every avatar on local disk. Avatars are served from the copy,
+    a worker without it downloads the avatar from the remote once.
+    """
+
+    def __init__(self, origin, local: LocalStorage):
+        self.origin = origin
+        self.local = local
+
+    def url(self, name: str) -> str:
+        return self.local.url(name)
+
+    async def save(self, name: str, data: bytes) -> str:
+        await asyncio.gather(self.local.save(name, data), self.origin.save(name, data))
+        return self.url(name)
+
+    async def read(self, name: str) -> bytes | None:
+        data = await self.local.read(name)
+        if data is None:
+            data = await self.origin.read(name)
+            if data is not None:
+                await self.local.save(name, data)
+        return data
+
+
+def create_storage():
+    local = LocalStorage(settings.avatar_local_dir, settings.avatar_local_url)
+    if settings.avatar_storage == "local":
+        return local
+    origin = CloudinaryStorage(settings.cloudinary_name, settings.cloudinary_api_key, settings.cloudinary_api_secret)
+    return MirroredStorage(origin, local)
+
+
+avatar_storage = create_storage()
+
+# Decoded avatar names are the content hash and the size, see AvatarPipeline
+AVATAR_NAME = re.compile(r"[0-9a-f]{64}_\d+\.jpg")
+
+avatar_memory = LocalCache(maxsize=settings.avatar_memory_cache_size, ttl=settings.avatar_memory_cache_ttl)
+
+
+async def read_avatar(name: str) -> bytes | None:
+    """
+    Get a stored avatar file, hot avatars are kept in memory
+
+    :param name: file name
+    :return: JPEG bytes, None for an unknown name
+    :rtype: bytes | None
+    """
+    if not AVATAR_NAME.fullmatch(name):
+        return None
+    data = avatar_memory.get(name)
+    if data is None:
+        data = await avatar_storage.read(name)
+        if data is not None:
+            avatar_memory.set(name, data)
+    return data
+
+
+def public_avatar_url(avatar: str | None, base_url: str) -> str | None:
+    """
+    Absolute URL of an avatar. Avatars served by this API are stored as paths, they are
+    resolved against avatar_public_url, or against base_url when it is not set.
+
+    :param avatar: avatar of a user or a job
+    :param base_url: URL of the request
+    :return: url
+    :rtype: str | None
+    """
+    if avatar is None:
+        return None
+    return urljoin(settings.avatar_public_url or base_url, avatar)
+
+
+# Stored avatars are named {digest}_{size}.jpg, every size of AVATAR_SIZES exists for each digest
+AVATAR_VARIANT = re.compile(r"([0-9a-f]{64})_\d+\.jpg$")
+GRAVATAR_URL = "https://www.gravatar.com/avatar/"
+
+
+def avatar_thumbnail_url(avatar: str | None, size: int = AVATAR_SIZES[-1]) -> str | None:
+    """
+    URL of the thumbnail of an avatar: the stored variant of that size, or the
+    Gravatar resized on request
+
+    :param avatar: avatar URL
+    :param size:
+    :return: url, None when the avatar has no thumbnail
+    :rtype: str | None
+    """
+    if avatar is None:
+        return None
+    match = AVATAR_VARIANT.search(avatar)
+    if match is not None:
+        return f"{avatar[:match.start()]}{match.group(1)}_{size}.jpg"
+    if avatar.startswith(GRAVATAR_URL):
+        return f"{avatar}?s={size}"
+    return None
+
+
+class AvatarJobs:
+    """
+    Status of avatar jobs kept in Redis for ttl seconds, so any worker can answer for it.
+    """
+
+    def __init__(self, r: redis.Redis, ttl: int = 3600):
+        self.r = r
+        self.ttl = ttl
+
+    @staticmethod
+    def key(job_id: str) -> str:
+        return f"avatar_job:{job_id}"
+
+    async def set(self, job_id: str, record: dict) -> None:
+        try:
+            await self.r.set(self.key(job_id), json.dumps(record), ex=self.ttl)
+        except redis.RedisError as e:
+            print(e)
+
+    async def get(self, job_id: str) -> dict | None:
+        try:
+            data = await self.r.get(self.key(job_id))
+        except redis.RedisError as e:
+            print(e)
+            return None
+        return json.loads(data) if data else None
+
+
+class AvatarIndex:
+    """
+    Avatar URL by content hash of the uploaded image, for uploads stored in the last ttl seconds.
+    Once a record expires the image is rendered and stored again under the same names.
+    """
+
+    def __init__(self, r: redis.Redis, ttl: int = 30 * 86400):
+        self.r = r
+        self.ttl = ttl
+
+    @staticmethod
+    def key(digest: str) -> str:
+        return f"avatar_blob:{digest}"
+
+    async def get(self, digest: str) -> str | None:
+        try:
+            url = await self.r.get(self.key(digest))
+        except redis.RedisError as e:
+            print(e)
+            return None
+        return url.decode() if isinstance(url, bytes) else url
+
+    async def set(self, digest: str, url: str) -> None:
+        try:
+            await self.r.set(self.key(digest), url, ex=self.ttl)
+        except redis.RedisError as e:
+            print(e)
+
+
+class AvatarPipeline:
+    """
+    Spools avatar uploads to disk and finishes them in the background: the image is cropped
+    on a size-bounded thread pool, the variants are pushed to the storage backend and the user is
+    updated once they are stored. At most max_pending jobs are in flight per worker,
+    further uploads are rejected with 503. Jobs in flight are lost if the worker stops.
+
+    Stored files are named after the sha256 of the upload and the size, so they never change
+    and an image uploaded before, by any user, is not processed again.
+    """
+
+    def __init__(self, storage, jobs: AvatarJobs, index: AvatarIndex, workers: int = 2, max_pending: int = 32,
+                 max_bytes: int = 5 * 1024 * 1024, spool_dir: str | None = None,
+                 session_factory: async_sessionmaker = async_session_factory, sizes: tuple = AVATAR_SIZES):
+        self.storage = storage
+        self.jobs = jobs
+        self.index = index
+        self.max_pending = max_pending
+        self.max_bytes = max_bytes
+        self.spool_dir = spool_dir
+        self.session_factory = session_factory
+        self.sizes = sizes
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="avatar")
+        self.tasks = set()
+
+    def _spool(self, source: BinaryIO) -> tuple[Path, str]:
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=self.spool_dir, prefix="avatar-", delete=False) as spool:
+            try:
+                copied = 0
+                while chunk := source.read(64 * 1024):
+                    copied += len(chunk)
+                    if copied > self.max_bytes:
+                        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                            detail=f"Avatar is larger than {self.max_bytes} bytes")
+                    spool.write(chunk)
+                    digest.update(chunk)
+            except BaseException:
+                spool.close()
+                Path(spool.name).unlink(missing_ok=True)
+                raise
+        return Path(spool.name), digest.hexdigest()
+
+    async def submit(self, user, file: UploadFile) -> dict:
+        """
+        Spool the upload and start its job
+
+        :param user: user the avatar is for
+        :param file:
+        :return: job record
+        :rtype: dict
+        """
+        if not (file.content_type or "").startswith("image/"):
+            raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Avatar must be an image")
+        if file.size is not None and file.size > self.max_bytes:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                detail=f"Avatar is larger than {self.max_bytes} bytes")
+        if len(self.tasks) >= self.max_pending:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Too many avatar uploads in progress, try again later",
+                                headers={"Retry-After": "1"})
+        path, digest = await asyncio.to_thread(self._spool, file.file)
+        record = {"job_id": uuid.uuid4().hex, "user_id": user.id, "status": "pending", "avatar": None, "error": None}
+        await self.jobs.set(record["job_id"], record)
+        task = asyncio.create_task(self._run(record, user.email, path, digest))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return record
+
+    async def _store(self, path: Path, digest: str) -> str:
+        loop = asyncio.get_running_loop()
+        variants = await loop.run_in_executor(self.executor, render_avatar, path, self.sizes)
+        urls = await asyncio.gather(*(self.storage.save(f"{digest}_{size}.jpg", data)
+                                      for size, data in variants.items()))
+        await self.index.set(digest, urls[0])
+        return urls[0]
+
+    async def _run(self, record: dict, email: str, path: Path, digest: str) -> None:
+        try:
+            avatar = await self.index.get(digest) or await self._store(path, digest)
+            async with self.session_factory() as db:
+                await repository_users.update_avatar(email, avatar, db)
+            record.update(status="done", avatar=avatar)
+        except Exception as e:
+            print(e)
+            record.update(status="failed", error=str(e) or type(e).__name__)
+        finally:
+            path.unlink(missing_ok=True)
+        await self.jobs.set(record["job_id"], record)
+
+    async def close(self, timeout: float = 10) -> None:
+        """
+        Give the jobs in flight timeout seconds to finish, then stop the pool
+        """
+        if self.tasks:
+            await asyncio.wait(self.tasks, timeout=timeout)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+avatar_pipeline = AvatarPipeline(
+    avatar_storage,
+    AvatarJobs(redis_client),
+    AvatarIndex(redis_client, ttl=settings.avatar_index_ttl),
+    workers=settings.avatar_workers,
+    max_pending=settings.avatar_max_pending,
+    max_bytes=settings.avatar_max_bytes,
+    spool_dir=settings.avatar_spool_dir or None,
+)
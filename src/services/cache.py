@@ -0,0 +1,317 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import redis.asyncio as redis
+
+from settings import settings
+
+redis_client = redis.Redis(
+    host=settings.redis_host,
+    port=settings.redis_port,
+    db=settings.redis_db)
+
+
+@dataclass(frozen=True, slots=True)
+class UserSnapshot:
+    """
+    Fixed-schema view of a user, as seen by authenticated routes.
+    Never carries the password hash or the refresh token.
+    """
+    id: int
+    name: str
+    email: str
+    avatar: str | None
+    confirmed: bool
+
+
+class LocalCache:
+    """
+    Bounded in-process LRU cache with a TTL per entry.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at <= self.timer():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value) -> None:
+        self._data[key] = (value, self.timer() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+class UserCache:
+    """
+    Redis cache of user snapshots keyed by email, fronted by a per-worker LocalCache.
+
+    Records are stored as a compact JSON array prefixed with the schema version,
+    records written with another version are treated as a cache miss.
+    Invalidations are published on a Redis channel so every worker drops its local copy.
+    """
+    VERSION = 1
+    CHANNEL = "user_snapshot:invalidate"
+
+    def __init__(self, r: redis.Redis, ttl: int = 900, local: LocalCache | None = None):
+        self.r = r
+        self.ttl = ttl
+        self.local = local
+
+    @staticmethod
+    def key(email: str) -> str:
+        return f"user_snapshot:{email}"
+
+    def dumps(self, snapshot: UserSnapshot) -> bytes:
+        record = [self.VERSION, snapshot.id, snapshot.name, snapshot.email, snapshot.avatar, snapshot.confirmed]
+        return json.dumps(record, separators=(",", ":")).encode()
+
+    def loads(self, data: bytes) -> UserSnapshot | None:
+        try:
+            version, *fields = json.loads(data)
+        except (ValueError, TypeError):
+            return None
+        if version != self.VERSION:
+            return None
+        return UserSnapshot(*fields)
+
+    async def get(self, email: str) -> UserSnapshot | None:
+        if self.local is not None:
+            snapshot = self.local.get(email)
+            if snapshot is not None:
+                return snapshot
+        data = await self.r.get(self.key(email))
+        if data is None:
+            return None
+        snapshot = self.loads(data)
+        if snapshot is not None and self.local is not None:
+            self.local.set(email, snapshot)
+        return snapshot
+
+    async def set(self, user) -> UserSnapshot:
+        snapshot = UserSnapshot(
+            id=user.id,
+            name=user.name,
+            email=user.email,
+            avatar=user.avatar,
+            confirmed=bool(user.confirmed),
+        )
+        await self.r.set(self.key(snapshot.email), self.dumps(snapshot), ex=self.ttl)
+        if self.local is not None:
+            self.local.set(snapshot.email, snapshot)
+        return snapshot
+
+    async def invalidate(self, email: str) -> None:
+        if self.local is not None:
+            self.local.pop(email)
+        await self.r.delete(self.key(email))
+        await self.r.publish(self.CHANNEL, email)
+
+    async def listen(self, retry_delay: float = 1.0) -> None:
+        """
+        Drop local copies of users invalidated by any worker. Runs until cancelled.
+
+        :param retry_delay: pause before resubscribing after a connection error
+        """
+        if self.local is None:
+            return
+        while True:
+            try:
+                async with self.r.pubsub() as pubsub:
+                    await pubsub.subscribe(self.CHANNEL)
+                    # Invalidations sent while we were not subscribed are lost
+                    self.local.clear()
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self.local.pop(message["data"].decode())
+            except redis.ConnectionError as e:
+                print(e)
+                await asyncio.sleep(retry_delay)
+
+
+class TokenCache:
+    """
+    Bounded per-worker cache of verified tokens: sha256 digest -> (subject, scope, exp).
+
+    Entries are dropped once the token expires, so a hit never outlives the JWT itself.
+    """
+
+    def __init__(self, maxsize: int, timer=time.time):
+        self.maxsize = maxsize
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> tuple[str, str, int] | None:
+        key = self.digest(token)
+        claims = self._data.get(key)
+        if claims is not None and claims[2] <= self.timer():
+            del self._data[key]
+            claims = None
+        if claims is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return claims
+
+    def set(self, token: str, subject: str, scope: str, exp: int) -> None:
+        key = self.digest(token)
+        self._data[key] = (subject, scope, exp)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def revoke(self, token: str) -> None:
+        self._data.pop(self.digest(token), None)
+
+    def revoke_subject(self, subject: str) -> None:
+        for key in [key for key, claims in self._data.items() if claims[0] == subject]:
+            del self._data[key]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class TokenRevocations:
+    """
+    Access tokens revoked per subject, shared by all workers through Redis.
+
+    Revoking stores the time of revocation in milliseconds under the subject, tokens issued
+    before it are rejected. Access tokens carry their issue time with millisecond precision,
+    so a token issued right after the revocation is accepted and only tokens issued in the same
+    millisecond are ambiguous, they are accepted too.
+    The record expires with the longest lived access token, which it then outlives.
+    Revocations are published on a Redis channel so every worker drops the subject from its TokenCache.
+    """
+    CHANNEL = "access_token:revoke"
+
+    def __init__(self, r: redis.Redis, token_cache: TokenCache, ttl: int, timer=time.time):
+        self.r = r
+        self.token_cache = token_cache
+        self.ttl = ttl
+        self.timer = timer
+
+    @staticmethod
+    def key(subject: str) -> str:
+        return f"access_token_not_before:{subject}"
+
+    async def revoke(self, subject: str) -> None:
+        self.token_cache.revoke_subject(subject)
+        await self.r.set(self.key(subject), int(self.timer() * 1000), ex=self.ttl)
+        await self.r.publish(self.CHANNEL, subject)
+
+    async def is_revoked(self, subject: str, issued_at: float) -> bool:
+        """
+        :param subject:
+        :param issued_at: iat claim of the token, in seconds
+        :return: True if the token was issued before the subject was revoked
+        :rtype: bool
+        """
+        revoked_at = await self.r.get(self.key(subject))
+        return revoked_at is not None and int(issued_at * 1000) < int(revoked_at)
+
+    async def listen(self, retry_delay: float = 1.0) -> None:
+        """
+        Drop cached tokens of subjects revoked by any worker. Runs until cancelled.
+
+        :param retry_delay: pause before resubscribing after a connection error
+        """
+        while True:
+            try:
+                async with self.r.pubsub() as pubsub:
+                    await pubsub.subscribe(self.CHANNEL)
+                    # Revocations sent while we were not subscribed are lost
+                    self.token_cache.clear()
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self.token_cache.revoke_subject(message["data"].decode())
+            except redis.ConnectionError as e:
+                print(e)
+                await asyncio.sleep(retry_delay)
+
+
+class ResponseCache:
+    """
+    Redis cache of serialized contact responses, per user and per query.
+
+    Keys embed a per-user generation counter. Writes bump the counter instead of
+    deleting keys, so every cached response of the user becomes unreachable at once
+    and expires on its own.
+    Entries hold the response headers as a JSON line followed by the JSON body.
+    """
+
+    def __init__(self, r: redis.Redis, ttl: int = 300):
+        self.r = r
+        self.ttl = ttl
+
+    @staticmethod
+    def generation_key(user_id: int) -> str:
+        return f"contacts_generation:{user_id}"
+
+    async def key(self, user_id: int, query: str) -> str:
+        generation = await self.r.get(self.generation_key(user_id))
+        digest = hashlib.sha1(query.encode()).hexdigest()
+        return f"contacts_response:{user_id}:{int(generation or 0)}:{digest}"
+
+    async def get(self, key: str) -> tuple[dict, bytes] | None:
+        data = await self.r.get(key)
+        if data is None:
+            return None
+        headers, _, body = data.partition(b"\n")
+        return json.loads(headers), body
+
+    async def set(self, key: str, headers: dict, body: bytes) -> None:
+        data = json.dumps(headers, separators=(",", ":")).encode() + b"\n" + body
+        await self.r.set(key, data, ex=self.ttl)
+
+    async def invalidate(self, user_id: int) -> None:
+        await self.r.incr(self.generation_key(user_id))
+
+
+user_cache = UserCache(
+    redis_client,
+    ttl=settings.user_cache_ttl,
+    local=LocalCache(settings.user_cache_local_size, settings.user_cache_local_ttl),
+)
+
+token_cache = TokenCache(settings.token_cache_size)
+
+token_revocations = TokenRevocations(redis_client, token_cache, ttl=settings.access_token_expire_minutes * 60)
+
+response_cache = ResponseCache(redis_client, ttl=settings.response_cache_ttl)
@@ -0,0 +1,303 @@
+import asyncio
+import csv
+import io
+import zlib
+from typing import AsyncIterator, BinaryIO, Iterator
+
+import orjson
+from pydantic import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.models import User
+from src.repository import contacts as contacts_repo
+from src.schemas.schemas import ContactSchema
+from src.services.cache import response_cache
+
+
+def detect_import_format(filename: str | None, content_type: str | None) -> str:
+    """
+    Guess the format of an uploaded contacts file, csv by default
+
+    :param filename:
+    :param content_type:
+    :return: format
+    :rtype: str
+    """
+    if (filename or "").lower().endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    if content_type in ("application/x-ndjson", "application/jsonl"):
+        return "ndjson"
+    return "csv"
+
+
+class ContactImportFileError(ValueError):
+    """
+    The file cannot be read past a row: it is not UTF-8 or not valid CSV.
+    Carries the errors in the shape of a failed row of the import report.
+    """
+
+    def __init__(self, row: int, error_type: str, msg: str):
+        super().__init__(msg)
+        self.row = row
+        self.errors = [{"type": error_type, "loc": [], "msg": msg}]
+        self.report = None
+
+
+def decode_lines(file: BinaryIO) -> Iterator[str]:
+    """
+    Decode a file line by line so that an invalid byte sequence fails on the row that holds it.
+    A UTF-8 byte order mark at the start of the file is skipped.
+
+    :param file:
+    :return: lines
+    :rtype: Iterator[str]
+    """
+    for line_number, line in enumerate(file, start=1):
+        yield line.decode("utf-8-sig" if line_number == 1 else "utf-8")
+
+
+def read_csv(file: BinaryIO) -> Iterator[dict]:
+    """
+    Read contacts from a UTF-8 CSV file with a header row, one row at a time.
+    Empty cells are treated as missing values.
+
+    :param file:
+    :return: rows
+    :rtype: Iterator[dict]
+    :raise ContactImportFileError: on a row that is not UTF-8 or not valid CSV, row 0 being the header
+    """
+    reader = csv.DictReader(decode_lines(file))
+    row_number = -1
+    try:
+        if reader.fieldnames is None:
+            return
+        row_number = 0
+        for row in reader:
+            row_number += 1
+            yield {key: value for key, value in row.items() if key and value not in ("", None)}
+    except UnicodeDecodeError as e:
+        raise ContactImportFileError(row_number + 1, "unicode_decode_error",
+                                     f"File is not valid UTF-8: {e.reason}")
+    except csv.Error as e:
+        raise ContactImportFileError(row_number + 1, "csv_error", str(e))
+
+
+def read_ndjson(file: BinaryIO) -> Iterator[dict]:
+    """
+    Read contacts from a newline delimited JSON file, one line at a time.
+    A line that is not a JSON object is yielded as is and fails validation.
+
+    :param file:
+    :return: rows
+    :rtype: Iterator[dict]
+    """
+    for line in file:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield orjson.loads(line)
+        except ValueError:
+            yield line.decode(errors="replace")
+
+
+def validate_rows(rows: Iterator[tuple[int, dict]], limit: int) -> tuple[list, list, ContactImportFileError | None, bool]:
+    """
+    Read and validate up to limit numbered rows. Blocking, runs on a thread.
+
+    :param rows: row numbers and rows
+    :param limit:
+    :return: valid contacts and failed rows with their row numbers, the error that stopped
+        the file and whether the file is done
+    :rtype: tuple[list, list, ContactImportFileError | None, bool]
+    """
+    valid, invalid = [], []
+    try:
+        for row_number, row in rows:
+            try:
+                valid.append((row_number, ContactSchema.model_validate(row)))
+            except ValidationError as e:
+                invalid.append((row_number, e.errors(include_url=False, include_context=False)))
+            if len(valid) + len(invalid) >= limit:
+                return valid, invalid, None, False
+    except ContactImportFileError as e:
+        return valid, invalid, e, True
+    return valid, invalid, None, True
+
+
+async def import_contacts(file: BinaryIO, fmt: str, user: User, db: AsyncSession,
+                          chunk_size: int, max_errors: int) -> dict:
+    """
+    Validate contacts from the file and insert them in chunks of chunk_size rows.
+    Rows are numbered from 1, not counting the CSV header.
+
+    The file is read and validated on a thread, chunk by chunk, so the event loop stays free.
+    A chunk the database rejects is split in halves, each tried under a savepoint, until the
+    rejected rows are isolated. Every chunk is committed, the response cache is invalidated once.
+
+    :param file:
+    :param fmt: csv or ndjson
+    :param user:
+    :param db:
+    :param chunk_size:
+    :param max_errors: how many failed rows are listed in the report
+    :return: report
+    :rtype: dict
+    :raise ContactImportFileError: when the file cannot be read to the end, with the report so far
+    """
+    rows = enumerate(read_ndjson(file) if fmt == "ndjson" else read_csv(file), start=1)
+    report = {"imported": 0, "failed": 0, "errors": []}
+
+    def fail(row_number: int, errors: list) -> None:
+        report["failed"] += 1
+        if len(report["errors"]) < max_errors:
+            report["errors"].append({"row": row_number, "errors": errors})
+
+    async def insert(chunk: list) -> None:
+        try:
+            async with db.begin_nested():
+                await contacts_repo.insert_contacts(user, [contact for _, contact in chunk], db)
+            report["imported"] += len(chunk)
+            return
+        except SQLAlchemyError:
+            pass
+        if len(chunk) == 1:
+            fail(chunk[0][0], [{"type": "database_error", "loc": [], "msg": "Row rejected by the database"}])
+            return
+        # Bisect to find the rows the database rejects, the others go in as few statements as possible
+        middle = len(chunk) // 2
+        await insert(chunk[:middle])
+        await insert(chunk[middle:])
+
+    try:
+        done = False
+        while not done:
+            valid, invalid, error, done = await asyncio.to_thread(validate_rows, rows, chunk_size)
+            for row_number, errors in invalid:
+                fail(row_number, errors)
+            if valid:
+                await insert(valid)
+                await db.commit()
+            if error is not None:
+                # The rows before the unreadable one are kept, the report goes with the error
+                fail(error.row, error.errors)
+                error.report = report
+                raise error
+    finally:
+        if report["imported"]:
+            await response_cache.invalidate(user.id)
+    return report
+
+
+EXPORT_FIELDS = ("id", "name", "surname", "email", "phone", "date_of_birth")
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "vcard": "text/vcard",
+}
+
+EXPORT_EXTENSIONS = {
+    "csv": "csv",
+    "ndjson": "ndjson",
+    "vcard": "vcf",
+}
+
+
+def encode_json(contacts) -> bytes:
+    """
+    Encode contacts as a JSON array, the body of list and search responses.
+    Takes rows or entities with the EXPORT_FIELDS attributes, extra attributes are left out.
+
+    :param contacts:
+    :return: json
+    :rtype: bytes
+    """
+    return orjson.dumps([{field: getattr(contact, field) for field in EXPORT_FIELDS} for contact in contacts])
+
+
+def encode_csv(rows, header: bool = False) -> bytes:
+    """
+    Encode a batch of contact rows as CSV
+
+    :param rows:
+    :param header: prepend the header row
+    :return: csv
+    :rtype: bytes
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_FIELDS)
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def encode_ndjson(rows) -> bytes:
+    """
+    Encode a batch of contact rows as newline delimited JSON
+
+    :param rows:
+    :return: ndjson
+    :rtype: bytes
+    """
+    return b"".join(orjson.dumps(dict(zip(EXPORT_FIELDS, row)), option=orjson.OPT_APPEND_NEWLINE) for row in rows)
+
+
+def _vcard_escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace(",", "\\,").replace(";", "\\;").replace("\n", "\\n")
+
+
+def encode_vcard(rows) -> bytes:
+    """
+    Encode a batch of contact rows as vCard 3.0
+
+    :param rows:
+    :return: vcards
+    :rtype: bytes
+    """
+    lines = []
+    for contact_id, name, surname, email, phone, date_of_birth in rows:
+        lines.append("BEGIN:VCARD")
+        lines.append("VERSION:3.0")
+        lines.append(f"UID:{contact_id}")
+        lines.append(f"N:{_vcard_escape(surname)};{_vcard_escape(name)};;;")
+        lines.append(f"FN:{_vcard_escape(name)} {_vcard_escape(surname)}")
+        if email:
+            lines.append(f"EMAIL:{_vcard_escape(email)}")
+        if phone:
+            lines.append(f"TEL:{_vcard_escape(phone)}")
+        if date_of_birth:
+            lines.append(f"BDAY:{date_of_birth.isoformat()}")
+        lines.append("END:VCARD")
+    lines.append("")
+    return "\r\n".join(lines).encode()
+
+
+async def export_contacts(batches: AsyncIterator, fmt: str, compress: bool = False) -> AsyncIterator[bytes]:
+    """
+    Encode batches of contact rows in the given format, one chunk per batch,
+    so memory use does not depend on the number of contacts.
+
+    :param batches: batches of rows as yielded by contacts_repo.stream_contacts
+    :param fmt: csv, ndjson or vcard
+    :param compress: gzip the output
+    :return: encoded chunks
+    :rtype: AsyncIterator[bytes]
+    """
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None
+    encoders = {"csv": encode_csv, "ndjson": encode_ndjson, "vcard": encode_vcard}
+    encode = encoders[fmt]
+
+    def pack(data: bytes) -> bytes:
+        return compressor.compress(data) if compressor is not None else data
+
+    if fmt == "csv":
+        yield pack(encode_csv((), header=True))
+    async for rows in batches:
+        chunk = pack(encode(rows))
+        if chunk:
+            yield chunk
+    if compressor is not None:
+        yield compressor.flush()
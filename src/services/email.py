@@ -1,38 +1,173 @@
+import json
+import time
+import uuid
 from pathlib import Path
 
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
-from fastapi_mail.errors import ConnectionErrors
+import redis.asyncio as redis
 from pydantic import EmailStr
 
 from src.services.auth import auth_service
-from settings import settings
-
-conf = ConnectionConfig(
-    MAIL_USERNAME=settings.mail_username,
-    MAIL_PASSWORD=settings.mail_password,
-    MAIL_FROM=settings.mail_from,
-    MAIL_PORT=settings.mail_port,
-    MAIL_SERVER=settings.mail_server,
-    MAIL_FROM_NAME=settings.mail_from_name,
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-    TEMPLATE_FOLDER=Path(__file__).parent / 'templates',
-)
+from src.services.cache import redis_client
+
+TEMPLATE_FOLDER = Path(__file__).parent / 'templates'
+
+
+class EmailQueue:
+    """
+    Redis backed queue of outgoing emails.
+
+    Jobs are JSON objects pushed to a list. A worker moves the jobs it takes to its own
+    processing list and removes them only once they are sent, scheduled for retry or buried,
+    so a job is never lost, at worst sent twice. Each worker keeps a heartbeat key alive,
+    the processing lists of workers whose heartbeat expired are moved back to the queue.
+    heartbeat_ttl must be longer than the worker takes to send a batch.
+    Failed jobs wait in a sorted set scored by the time they are due again,
+    jobs that keep failing end up in a dead letter list.
+    """
+    QUEUE = "email:queue"
+    RETRY = "email:retry"
+    DEAD = "email:dead"
+    PROCESSING = "email:processing:"
+    HEARTBEAT = "email:worker:"
+
+    def __init__(self, r: redis.Redis, worker_id: str | None = None, heartbeat_ttl: int = 300):
+        self.r = r
+        self.worker_id = worker_id or uuid.uuid4().hex
+        self.heartbeat_ttl = heartbeat_ttl
+        self.processing = f"{self.PROCESSING}{self.worker_id}"
+        # Raw queue entry of each taken job by job id, needed to remove it from the processing list
+        self._taken = {}
+
+    async def put(self, job: dict) -> None:
+        job.setdefault("id", uuid.uuid4().hex)
+        job.setdefault("attempts", 0)
+        await self.r.lpush(self.QUEUE, json.dumps(job))
+
+    async def heartbeat(self) -> None:
+        await self.r.set(f"{self.HEARTBEAT}{self.worker_id}", 1, ex=self.heartbeat_ttl)
+
+    async def take(self, batch_size: int, timeout: float) -> list[dict]:
+        """
+        Wait up to timeout seconds for a job, then take up to batch_size jobs without waiting.
+        Taken jobs stay in the processing list of this worker until they are acknowledged.
+
+        :param batch_size:
+        :param timeout:
+        :return: jobs, oldest first
+        :rtype: list[dict]
+        """
+        item = await self.r.blmove(self.QUEUE, self.processing, timeout, src="RIGHT", dest="LEFT")
+        if item is None:
+            return []
+        items = [item]
+        if batch_size > 1:
+            pipe = self.r.pipeline(transaction=False)
+            for _ in range(batch_size - 1):
+                pipe.lmove(self.QUEUE, self.processing, src="RIGHT", dest="LEFT")
+            items.extend(data for data in await pipe.execute() if data is not None)
+        jobs = []
+        for data in items:
+            try:
+                job = json.loads(data)
+                self._taken[job["id"]] = data
+            except (ValueError, TypeError, KeyError) as e:
+                print(f"Malformed email job buried: {e}")
+                await self._bury_raw(data)
+                continue
+            jobs.append(job)
+        return jobs
+
+    async def _bury_raw(self, data) -> None:
+        pipe = self.r.pipeline(transaction=True)
+        pipe.lpush(self.DEAD, data)
+        pipe.lrem(self.processing, 1, data)
+        await pipe.execute()
+
+    def _remove_taken(self, pipe, job: dict) -> None:
+        data = self._taken.pop(job["id"], None)
+        if data is not None:
+            pipe.lrem(self.processing, 1, data)
+
+    async def ack(self, job: dict) -> None:
+        pipe = self.r.pipeline(transaction=True)
+        self._remove_taken(pipe, job)
+        await pipe.execute()
+
+    async def retry_later(self, job: dict, delay: float) -> None:
+        pipe = self.r.pipeline(transaction=True)
+        pipe.zadd(self.RETRY, {json.dumps(job): time.time() + delay})
+        self._remove_taken(pipe, job)
+        await pipe.execute()
+
+    async def bury(self, job: dict) -> None:
+        pipe = self.r.pipeline(transaction=True)
+        pipe.lpush(self.DEAD, json.dumps(job))
+        self._remove_taken(pipe, job)
+        await pipe.execute()
+
+    async def requeue_due(self) -> int:
+        """
+        Move the jobs whose retry is due back to the queue
+
+        :return: number of jobs moved
+        :rtype: int
+        """
+        moved = 0
+        for data in await self.r.zrangebyscore(self.RETRY, 0, time.time()):
+            # Only the worker that removes the job requeues it
+            if await self.r.zrem(self.RETRY, data):
+                await self.r.lpush(self.QUEUE, data)
+                moved += 1
+        return moved
+
+    async def _requeue_list(self, key: str) -> int:
+        # Newest first to the front of the queue, so the jobs keep their order
+        moved = 0
+        while await self.r.lmove(key, self.QUEUE, src="LEFT", dest="RIGHT") is not None:
+            moved += 1
+        return moved
+
+    async def requeue_unsent(self) -> int:
+        """
+        Put the jobs this worker took but did not finish back at the front of the queue
+
+        :return: number of jobs moved
+        :rtype: int
+        """
+        self._taken.clear()
+        return await self._requeue_list(self.processing)
+
+    async def recover_abandoned(self) -> int:
+        """
+        Put the jobs of workers that stopped without returning them back to the queue
+
+        :return: number of jobs moved
+        :rtype: int
+        """
+        moved = 0
+        async for key in self.r.scan_iter(match=f"{self.PROCESSING}*"):
+            key = key.decode() if isinstance(key, bytes) else key
+            worker_id = key.removeprefix(self.PROCESSING)
+            if worker_id != self.worker_id and not await self.r.exists(f"{self.HEARTBEAT}{worker_id}"):
+                moved += await self._requeue_list(key)
+        return moved
+
+
+email_queue = EmailQueue(redis_client)
 
 
 async def send_email(email: EmailStr, username: str, host: str):
-    try:
-        token_verification = auth_service.create_email_token({"sub": email})
-        message = MessageSchema(
-            subject="Confirm your email ",
-            recipients=[email],
-            template_body={"host": host, "username": username, "token": token_verification},
-            subtype=MessageType.html
-        )
-
-        fm = FastMail(conf)
-        await fm.send_message(message, template_name="email_template.html")
-    except ConnectionErrors as err:
-        print(err)
+    """
+    Queue the email confirmation message, it is sent by the email worker
+
+    :param email:
+    :param username:
+    :param host: base url of the API, used in the confirmation link
+    """
+    token_verification = auth_service.create_email_token({"sub": email})
+    await email_queue.put({
+        "template": "email_template.html",
+        "subject": "Confirm your email ",
+        "recipient": email,
+        "body": {"host": str(host), "username": username, "token": token_verification},
+    })
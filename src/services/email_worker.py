@@ -0,0 +1,269 @@
+import asyncio
+import time
+from email.message import Message
+from email.mime.text import MIMEText
+from email.utils import formataddr
+
+import aiosmtplib
+import redis.asyncio as redis
+from jinja2 import Environment, FileSystemLoader, Template
+
+from src.services.email import EmailQueue, TEMPLATE_FOLDER, email_queue
+from settings import settings
+
+# Errors after which the connection is dropped and the message sent again on a new one
+CONNECTION_ERRORS = (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPConnectError, aiosmtplib.SMTPTimeoutError,
+                     OSError)
+
+
+# Failures of the server or of our configuration rather than of a message, such as a wrong password
+SERVER_ERRORS = CONNECTION_ERRORS + (aiosmtplib.SMTPAuthenticationError, aiosmtplib.SMTPHeloError,
+                                     aiosmtplib.SMTPSenderRefused)
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    Whether sending may succeed later. Only a 5xx reply to the recipient (RCPT) or to
+    the message (DATA) is permanent, and so are rendering errors. Connection, login and
+    sender errors, 5xx ones included, are fixed on the server side and retried.
+
+    :param error:
+    :return: True if the message should be retried
+    :rtype: bool
+    """
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return not error.recipients or any(e.code < 500 for e in error.recipients)
+    if isinstance(error, (aiosmtplib.SMTPRecipientRefused, aiosmtplib.SMTPDataError)):
+        return error.code < 500
+    return isinstance(error, aiosmtplib.SMTPException) or isinstance(error, CONNECTION_ERRORS)
+
+
+def is_server_failure(error: Exception) -> bool:
+    """
+    Whether no message can be sent until the server or the configuration is fixed
+
+    :param error:
+    :return: True if the worker should stop sending and back off
+    :rtype: bool
+    """
+    return isinstance(error, SERVER_ERRORS)
+
+
+class EmailTemplates:
+    """
+    Jinja templates of the email template folder, compiled once and kept for the life
+    of the process. Templates are not checked for changes on disk.
+    """
+
+    def __init__(self, folder, preload: tuple = ("email_template.html",)):
+        self.env = Environment(loader=FileSystemLoader(folder), auto_reload=False)
+        self._templates = {}
+        for name in preload:
+            self.get(name)
+
+    def get(self, name: str) -> Template:
+        template = self._templates.get(name)
+        if template is None:
+            template = self._templates[name] = self.env.get_template(name)
+        return template
+
+    def render(self, name: str, context: dict) -> str:
+        return self.get(name).render(**context)
+
+
+email_templates = EmailTemplates(TEMPLATE_FOLDER)
+
+SENDER = formataddr((settings.mail_from_name, settings.mail_from))
+
+
+def render_message(job: dict, templates: EmailTemplates = email_templates) -> Message:
+    """
+    Build the email of a queued job from its precompiled template.
+    MIMEText skips the header policy machinery of EmailMessage, which costs more than the rendering.
+
+    :param job:
+    :param templates:
+    :return: message
+    :rtype: Message
+    """
+    message = MIMEText(templates.render(job["template"], job["body"]), "html", "utf-8")
+    message["From"] = SENDER
+    message["To"] = job["recipient"]
+    message["Subject"] = job["subject"]
+    return message
+
+
+class SmtpTransport:
+    """
+    Sends messages over one SMTP connection that stays open between batches.
+    The connection is opened on first use and reopened once when the server drops it.
+    """
+
+    def __init__(self, hostname: str, port: int, username: str | None = None, password: str | None = None,
+                 use_tls: bool = False, start_tls: bool = False, timeout: float = 30):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.start_tls = start_tls
+        self.timeout = timeout
+        self.smtp = None
+        self.connections = 0
+
+    async def connect(self) -> None:
+        smtp = aiosmtplib.SMTP(hostname=self.hostname, port=self.port, username=self.username,
+                               password=self.password, use_tls=self.use_tls, start_tls=self.start_tls,
+                               timeout=self.timeout)
+        await smtp.connect()
+        self.smtp = smtp
+        self.connections += 1
+
+    async def send(self, message: Message) -> Exception | None:
+        """
+        Send one message
+
+        :param message:
+        :return: the error if the message was not sent
+        :rtype: Exception | None
+        """
+        error = None
+        for _ in range(2):
+            try:
+                if self.smtp is None or not self.smtp.is_connected:
+                    await self.connect()
+                await self.smtp.send_message(message)
+                return None
+            except CONNECTION_ERRORS as e:
+                self.smtp = None
+                error = e
+            except aiosmtplib.SMTPException as e:
+                return e
+            except Exception as e:
+                # Unknown state of the connection, start over with a new one
+                self.smtp = None
+                return e
+        return error
+
+    async def send_batch(self, messages: list[Message]) -> list[Exception | None]:
+        return [await self.send(message) for message in messages]
+
+    async def close(self) -> None:
+        if self.smtp is not None and self.smtp.is_connected:
+            try:
+                await self.smtp.quit()
+            except aiosmtplib.SMTPException as e:
+                print(e)
+        self.smtp = None
+
+
+class EmailWorker:
+    """
+    Drains the email queue in batches. A message that failed for a transient reason is retried
+    after backoff seconds, doubling with every attempt, and buried after max_attempts.
+    Messages that failed permanently are buried at once.
+
+    When the server cannot be used at all, the rest of the batch is not tried: the batch is
+    retried after backoff seconds without counting an attempt and the worker pauses as long,
+    so a wrong password or an outage does not bury the queue.
+    """
+
+    def __init__(self, queue: EmailQueue, transport: SmtpTransport, render=render_message,
+                 batch_size: int = 50, max_attempts: int = 5, backoff: float = 30):
+        self.queue = queue
+        self.transport = transport
+        self.render = render
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+    async def process(self, jobs: list[dict]) -> Exception | None:
+        """
+        Send a batch of jobs and record the outcome of each
+
+        :param jobs:
+        :return: the error that stopped the batch, None if every message was tried
+        :rtype: Exception | None
+        """
+        failures, server_error = [], None
+        for job in jobs:
+            if server_error is not None:
+                await self.queue.retry_later(job, self.backoff)
+                continue
+            try:
+                error = await self.transport.send(self.render(job))
+            except Exception as e:
+                error = e
+            if error is None:
+                await self.queue.ack(job)
+            elif is_server_failure(error):
+                server_error = error
+                await self.queue.retry_later(job, self.backoff)
+            else:
+                failures.append((job, error))
+
+        for job, error in failures:
+            job["attempts"] = job.get("attempts", 0) + 1
+            job["error"] = str(error)
+            if not is_transient(error) or job["attempts"] >= self.max_attempts:
+                await self.queue.bury(job)
+            else:
+                await self.queue.retry_later(job, self.backoff * 2 ** (job["attempts"] - 1))
+        return server_error
+
+    async def run(self, poll_timeout: float = 1.0, recover_interval: float = 60) -> None:
+        """
+        Send queued emails until cancelled. On cancellation the jobs taken but not finished
+        are put back in the queue. Errors are printed and never stop the worker: a job that
+        cannot be sent is retried or buried, and a job left in the processing list by an
+        error is put back in the queue when the worker stops or by another worker.
+
+        :param poll_timeout: how long to wait for a job before checking the due retries again
+        :param recover_interval: how often to look for jobs of workers that died
+        """
+        recovered_at = None
+        try:
+            while True:
+                try:
+                    await self.queue.heartbeat()
+                    if recovered_at is None or time.monotonic() - recovered_at >= recover_interval:
+                        await self.queue.recover_abandoned()
+                        recovered_at = time.monotonic()
+                    await self.queue.requeue_due()
+                    jobs = await self.queue.take(self.batch_size, poll_timeout)
+                    if jobs:
+                        server_error = await self.process(jobs)
+                        if server_error is not None:
+                            print(f"Email server unavailable, pausing for {self.backoff}s: {server_error!r}")
+                            await asyncio.sleep(self.backoff)
+                except redis.ConnectionError as e:
+                    print(e)
+                    await asyncio.sleep(1)
+                except Exception as e:
+                    print(f"Email worker error: {e!r}")
+                    await asyncio.sleep(1)
+        finally:
+            try:
+                await self.queue.requeue_unsent()
+            except redis.RedisError as e:
+                print(e)
+            await self.transport.close()
+
+
+def create_worker() -> EmailWorker:
+    transport = SmtpTransport(
+        hostname=settings.mail_server,
+        port=settings.mail_port,
+        username=settings.mail_username,
+        password=settings.mail_password,
+        use_tls=settings.mail_ssl_tls,
+        start_tls=settings.mail_starttls,
+    )
+    return EmailWorker(email_queue, transport, batch_size=settings.email_batch_size,
+                       max_attempts=settings.email_max_attempts, backoff=settings.email_retry_backoff)
+
+
+if __name__ == "__main__":
+    # The deployment of the email worker, one or more processes next to the web workers:
+    # python -m src.services.email_worker
+    asyncio.run(create_worker().run())
@@ -0,0 +1,39 @@
+import hashlib
+
+
+def make_etag(*parts) -> str:
+    """
+    Strong ETag built from the values that identify a version of a resource
+
+    :param parts: e.g. id and updated_at, or a count and the max updated_at of a page
+    :return: quoted entity tag
+    :rtype: str
+    """
+    digest = hashlib.sha1("|".join(map(str, parts)).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Whether an If-None-Match header matches the ETag. Uses the weak comparison
+    RFC 9110 prescribes for If-None-Match.
+
+    :param if_none_match: header value, a list of entity tags or *
+    :param etag:
+    :return: True if the client copy is current
+    :rtype: bool
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = (tag.strip() for tag in if_none_match.split(","))
+    return etag.removeprefix("W/") in (tag.removeprefix("W/") for tag in tags)
+
+
+def page_etag(user_id: int, count: int, max_updated_at, id_sum: int | None) -> str:
+    """
+    ETag of a page of contacts. Any insert, delete or update within the page changes
+    the count, the sum of ids or the latest updated_at.
+    """
+    return make_etag("contacts", user_id, count, max_updated_at, id_sum or 0)
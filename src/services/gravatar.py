@@ -0,0 +1,94 @@
+import asyncio
+import urllib.error
+import urllib.request
+
+import redis.asyncio as redis
+from libgravatar import Gravatar
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from src.database.db import async_session_factory
+from src.repository import users as repository_users
+from src.services.cache import redis_client
+from settings import settings
+
+
+class GravatarResolver:
+    """
+    Sets the Gravatar of new users after signup, outside of the request.
+
+    With verify, the URL is only used when Gravatar has an image for the email. The answer is
+    cached in Redis by email hash for ttl seconds, a lookup that fails keeps the URL unverified.
+    """
+
+    def __init__(self, r: redis.Redis, verify: bool = False, timeout: float = 3, ttl: int = 86400,
+                 session_factory: async_sessionmaker = async_session_factory):
+        self.r = r
+        self.verify = verify
+        self.timeout = timeout
+        self.ttl = ttl
+        self.session_factory = session_factory
+
+    @staticmethod
+    def key(email_hash: str) -> str:
+        return f"gravatar:{email_hash}"
+
+    def _exists(self, url: str) -> bool:
+        request = urllib.request.Request(f"{url}?d=404", method="HEAD")
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout):
+                return True
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return False
+            raise
+
+    async def has_image(self, email_hash: str, url: str) -> bool:
+        try:
+            cached = await self.r.get(self.key(email_hash))
+        except redis.RedisError as e:
+            print(e)
+            cached = None
+        if cached is not None:
+            return cached in (b"1", "1")
+        try:
+            exists = await asyncio.to_thread(self._exists, url)
+        except OSError as e:
+            print(e)
+            return True
+        try:
+            await self.r.set(self.key(email_hash), int(exists), ex=self.ttl)
+        except redis.RedisError as e:
+            print(e)
+        return exists
+
+    async def resolve(self, email: str) -> str | None:
+        """
+        Gravatar URL of an email
+
+        :param email:
+        :return: url, None when verify is on and there is no image
+        :rtype: str | None
+        """
+        gravatar = Gravatar(email)
+        url = gravatar.get_image()
+        if self.verify and not await self.has_image(gravatar.email_hash, url):
+            return None
+        return url
+
+    async def assign(self, email: str) -> None:
+        """
+        Background task: set the Gravatar of a user who has no avatar yet
+
+        :param email:
+        """
+        try:
+            url = await self.resolve(email)
+            if url is not None:
+                async with self.session_factory() as db:
+                    await repository_users.set_default_avatar(email, url, db)
+        except Exception as e:
+            print(e)
+
+
+gravatar_resolver = GravatarResolver(redis_client, verify=settings.gravatar_verify, timeout=settings.gravatar_timeout,
+                                     ttl=settings.gravatar_cache_ttl)
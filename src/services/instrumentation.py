@@ -0,0 +1,267 @@
+import cProfile
+import glob
+import hmac
+import os
+import random
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.middleware.base import BaseHTTPMiddleware
+
+
+@dataclass(slots=True)
+class RequestMetrics:
+    """
+    Where the time of one request went, filled in by the hooks below
+    """
+    db_statements: int = 0
+    db_seconds: float = 0.0
+    pool_wait_seconds: float = 0.0
+    redis_calls: int = 0
+    redis_seconds: float = 0.0
+    serialize_seconds: float = 0.0
+
+
+# Set by InstrumentationMiddleware for the duration of a request, None otherwise
+current_metrics: ContextVar[RequestMetrics | None] = ContextVar("request_metrics", default=None)
+
+
+def record_pool_wait(seconds: float) -> None:
+    metrics = current_metrics.get()
+    if metrics is not None:
+        metrics.pool_wait_seconds += seconds
+
+
+@contextmanager
+def timed_serialization():
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.serialize_seconds += time.perf_counter() - started_at
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("instrumentation_started_at", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started_at = conn.info["instrumentation_started_at"].pop()
+    metrics = current_metrics.get()
+    if metrics is not None:
+        metrics.db_statements += 1
+        metrics.db_seconds += time.perf_counter() - started_at
+
+
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute, drop its start time here
+    conn = context.connection
+    started = conn.info.get("instrumentation_started_at") if conn is not None else None
+    if started:
+        started_at = started.pop()
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.db_statements += 1
+            metrics.db_seconds += time.perf_counter() - started_at
+
+
+def instrument_sql() -> None:
+    """
+    Time every SQL statement of every engine
+    """
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+
+
+def instrument_redis(client) -> None:
+    """
+    Count and time the commands sent by a redis.asyncio client
+
+    :param client: e.g. Auth.r or the rate limiter client
+    """
+    execute_command = client.execute_command
+
+    async def timed_execute_command(*args, **options):
+        metrics = current_metrics.get()
+        if metrics is None:
+            return await execute_command(*args, **options)
+        started_at = time.perf_counter()
+        try:
+            return await execute_command(*args, **options)
+        finally:
+            metrics.redis_calls += 1
+            metrics.redis_seconds += time.perf_counter() - started_at
+
+    client.execute_command = timed_execute_command
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """
+    Per-route request metrics of this worker, rendered in the Prometheus text format
+    """
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    TOTALS = (
+        ("db_statements", "http_request_db_statements_total", "SQL statements executed"),
+        ("db_seconds", "http_request_db_seconds_total", "Time spent executing SQL statements"),
+        ("pool_wait_seconds", "http_request_pool_wait_seconds_total", "Time spent waiting for a pooled connection"),
+        ("redis_calls", "http_request_redis_calls_total", "Redis round trips"),
+        ("redis_seconds", "http_request_redis_seconds_total", "Time spent in Redis round trips"),
+        ("serialize_seconds", "http_request_serialize_seconds_total", "Time spent serializing responses"),
+    )
+
+    def __init__(self):
+        self.requests = {}
+        self.durations = {}
+        self.totals = {}
+
+    def observe(self, method: str, route: str, status_code: int, seconds: float, metrics: RequestMetrics) -> None:
+        key = (method, route)
+        self.requests[key + (status_code,)] = self.requests.get(key + (status_code,), 0) + 1
+        buckets, count, total = self.durations.get(key, ([0] * len(self.BUCKETS), 0, 0.0))
+        for index, bound in enumerate(self.BUCKETS):
+            if seconds <= bound:
+                buckets[index] += 1
+        self.durations[key] = (buckets, count + 1, total + seconds)
+        totals = self.totals.setdefault(key, dict.fromkeys((name for name, _, _ in self.TOTALS), 0))
+        for name, _, _ in self.TOTALS:
+            totals[name] += getattr(metrics, name)
+
+    def render(self) -> str:
+        lines = ["# HELP http_requests_total Requests handled", "# TYPE http_requests_total counter"]
+        for (method, route, status_code), count in sorted(self.requests.items()):
+            lines.append(f'http_requests_total{{method="{method}",route="{_escape_label(route)}",'
+                         f'status="{status_code}"}} {count}')
+
+        lines += ["# HELP http_request_duration_seconds Request latency",
+                  "# TYPE http_request_duration_seconds histogram"]
+        for (method, route), (buckets, count, total) in sorted(self.durations.items()):
+            labels = f'method="{method}",route="{_escape_label(route)}"'
+            for bound, bucket_count in zip(self.BUCKETS, buckets):
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {bucket_count}')
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"http_request_duration_seconds_sum{{{labels}}} {total}")
+            lines.append(f"http_request_duration_seconds_count{{{labels}}} {count}")
+
+        for name, metric, description in self.TOTALS:
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} counter"]
+            for (method, route), totals in sorted(self.totals.items()):
+                lines.append(f'{metric}{{method="{method}",route="{_escape_label(route)}"}} {totals[name]}')
+        lines.append("")
+        return "\n".join(lines)
+
+
+class Profiler:
+    """
+    cProfile capture of single requests, sampled at sample_rate or requested with
+    an X-Profile header carrying the configured secret. Without a secret the header is ignored.
+    Profiles are written to directory as .prof files (pstats format), only the newest
+    max_files are kept.
+
+    One request is profiled at a time. The profiler sees everything the event loop runs
+    meanwhile, so profile under low concurrency for a clean picture.
+    """
+    HEADER = "x-profile"
+
+    def __init__(self, directory: str, sample_rate: float = 0.0, secret: str = "", max_files: int = 100):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.secret = secret
+        self.max_files = max_files
+        self.active = False
+
+    def wanted(self, request: Request) -> bool:
+        if self.active:
+            return False
+        header = request.headers.get(self.HEADER)
+        if self.secret and header is not None and hmac.compare_digest(header.encode(), self.secret.encode()):
+            return True
+        return random.random() < self.sample_rate
+
+    def start(self) -> cProfile.Profile:
+        self.active = True
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def _rotate(self) -> None:
+        files = sorted(glob.glob(os.path.join(self.directory, "*.prof")), key=os.path.getmtime)
+        for path in files[:max(len(files) - self.max_files, 0)]:
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(e)
+
+    def stop(self, profile: cProfile.Profile, route: str) -> str:
+        profile.disable()
+        self.active = False
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{slug}-{random.randrange(16 ** 6):06x}.prof"
+        profile.dump_stats(os.path.join(self.directory, filename))
+        self._rotate()
+        return filename
+
+
+def server_timing(total: float, metrics: RequestMetrics) -> str:
+    """
+    Server-Timing header value, durations in milliseconds
+    """
+    return ", ".join((
+        f"total;dur={total * 1000:.2f}",
+        f'db;desc="{metrics.db_statements} queries";dur={metrics.db_seconds * 1000:.2f}',
+        f"pool;dur={metrics.pool_wait_seconds * 1000:.2f}",
+        f'redis;desc="{metrics.redis_calls} calls";dur={metrics.redis_seconds * 1000:.2f}',
+        f"serialize;dur={metrics.serialize_seconds * 1000:.2f}",
+    ))
+
+
+class InstrumentationMiddleware(BaseHTTPMiddleware):
+    """
+    Measures every request and reports it in the Server-Timing header and the registry.
+    Latency is measured until the response headers are ready, streamed bodies are not included.
+    """
+
+    def __init__(self, app, registry: MetricsRegistry, profiler: Profiler | None = None,
+                 exclude: tuple = ("/metrics",)):
+        super().__init__(app)
+        self.registry = registry
+        self.profiler = profiler
+        self.exclude = exclude
+
+    async def dispatch(self, request: Request, call_next):
+        if request.url.path in self.exclude:
+            return await call_next(request)
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        profile = self.profiler.start() if self.profiler is not None and self.profiler.wanted(request) else None
+        started_at = time.perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            total = time.perf_counter() - started_at
+            current_metrics.reset(token)
+            route = request.scope.get("route")
+            route = getattr(route, "path", "unmatched")
+            profile_file = self.profiler.stop(profile, route) if profile is not None else None
+        self.registry.observe(request.method, route, response.status_code, total, metrics)
+        response.headers["Server-Timing"] = server_timing(total, metrics)
+        if profile_file is not None:
+            response.headers["X-Profile"] = profile_file
+        return response
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,107 @@
+import argparse
+import asyncio
+
+
+class SmtpSink:
+    """
+    Minimal plain-text SMTP server that accepts any login and every message
+    and keeps the messages in memory. A stand-in mail server for tests and local development.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, verbose: bool = False):
+        self.host = host
+        self.port = port
+        self.verbose = verbose
+        self.messages = []
+        self.connections = 0
+        self.server = None
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+
+        def reply(line: str) -> None:
+            writer.write(line.encode() + b"\r\n")
+
+        mail_from, recipients = None, []
+        reply("220 smtp-sink ESMTP")
+        try:
+            while line := await reader.readline():
+                command = line.decode(errors="replace").strip()
+                verb = command.split(" ", 1)[0].upper()
+                if verb == "EHLO":
+                    reply("250-smtp-sink")
+                    reply("250-AUTH PLAIN LOGIN")
+                    reply("250 8BITMIME")
+                elif verb == "HELO":
+                    reply("250 smtp-sink")
+                elif verb == "AUTH":
+                    mechanism = command.split(" ")[1:]
+                    if mechanism[0].upper() == "LOGIN":
+                        reply("334 VXNlcm5hbWU6")
+                        await writer.drain()
+                        await reader.readline()
+                        reply("334 UGFzc3dvcmQ6")
+                        await writer.drain()
+                        await reader.readline()
+                    elif len(mechanism) == 1:
+                        reply("334 ")
+                        await writer.drain()
+                        await reader.readline()
+                    reply("235 Authentication successful")
+                elif verb == "MAIL":
+                    mail_from, recipients = command[10:].strip(), []
+                    reply("250 OK")
+                elif verb == "RCPT":
+                    recipients.append(command[8:].strip())
+                    reply("250 OK")
+                elif verb == "DATA":
+                    reply("354 End data with <CR><LF>.<CR><LF>")
+                    await writer.drain()
+                    lines = []
+                    while (data := await reader.readline()) not in (b".\r\n", b""):
+                        lines.append(data[1:] if data.startswith(b"..") else data)
+                    self.messages.append((mail_from, recipients, b"".join(lines)))
+                    if self.verbose:
+                        print(f"Message from {mail_from} to {', '.join(recipients)}")
+                        print(b"".join(lines).decode(errors="replace"))
+                    mail_from, recipients = None, []
+                    reply("250 OK")
+                elif verb == "RSET":
+                    mail_from, recipients = None, []
+                    reply("250 OK")
+                elif verb == "NOOP":
+                    reply("250 OK")
+                elif verb == "QUIT":
+                    reply("221 Bye")
+                    break
+                else:
+                    reply("502 Command not implemented")
+                await writer.drain()
+        finally:
+            await writer.drain()
+            writer.close()
+
+
+async def main(host: str, port: int) -> None:
+    sink = SmtpSink(host, port, verbose=True)
+    await sink.start()
+    print(f"SMTP sink listening on {sink.host}:{sink.port}")
+    await sink.server.serve_forever()
+
+
+if __name__ == "__main__":
+    # Local mail server: python -m src.services.smtp_sink --port 1025
+    # with MAIL_SERVER=localhost, MAIL_PORT=1025 and MAIL_SSL_TLS=false
+    parser = argparse.ArgumentParser(description="Print every email sent to this SMTP server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1025)
+    args = parser.parse_args()
+    asyncio.run(main(args.host, args.port))
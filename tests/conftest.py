@@ -14,6 +14,8 @@ sys.path.append(str(hw_path))
 from main import app
 from src.database.db import get_db
 from src.database.models import Base
+from src.services.cache import user_cache, token_cache
+from src.services.gravatar import gravatar_resolver
 
 
 DATABASE_TEST_URL = "sqlite+aiosqlite:///./test.db"
@@ -36,8 +38,16 @@ def mock_ratelimiter(monkeypatch):
     redis.get = AsyncMock(return_value=None)
     redis.set = AsyncMock(return_value=None)
     redis.expire = AsyncMock(return_value=None)
+    redis.delete = AsyncMock(return_value=None)
+    redis.publish = AsyncMock(return_value=None)
+    redis.incr = AsyncMock(return_value=1)
 
     monkeypatch.setattr("src.services.auth.auth_service.r", redis)
+    monkeypatch.setattr("src.services.cache.user_cache.r", redis)
+    monkeypatch.setattr("src.services.cache.response_cache.r", redis)
+    monkeypatch.setattr("src.services.cache.token_revocations.r", redis)
+    user_cache.local.clear()
+    token_cache.clear()
 
 
 @pytest.fixture(scope="module")
@@ -92,5 +102,6 @@ def client():
             yield session
 
     app.dependency_overrides[get_db] = override_get_db
+    gravatar_resolver.session_factory = TestingSession
 
     yield TestClient(app)
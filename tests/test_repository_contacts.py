@@ -1,17 +1,41 @@
 import unittest
-from unittest.mock import MagicMock, AsyncMock
+from datetime import date, datetime, timedelta
+from unittest.mock import MagicMock, AsyncMock, patch
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.models import User, Contact
-from src.repository.contacts import get_contacts, create_contact, update_contact, delete_contact
+from sqlalchemy.dialects import postgresql, sqlite
+
+from src.database.models import User, Contact, birth_doy
+from src.repository.contacts import (
+    get_contacts,
+    get_contacts_after,
+    get_upcoming_birthdays,
+    get_changes,
+    deletions_horizon,
+    prune_deletions,
+    create_contact,
+    update_contact,
+    delete_contact,
+    update_contacts,
+    delete_contacts,
+    encode_cursor,
+    decode_cursor,
+    trigram_similarity,
+    fuzzy_search_contacts,
+)
 from src.schemas.schemas import ContactSchema
+from src.services.cache import response_cache
 
 
 class TestContactsRepository(unittest.IsolatedAsyncioTestCase):
 
     def setUp(self):
         self.session = AsyncMock(spec=AsyncSession)
+        self.redis = AsyncMock()
+        patcher = patch.object(response_cache, "r", self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
         self.user = User(
             id=1,
             name="unittest",
@@ -37,6 +61,9 @@ class TestContactsRepository(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(result.email, body.email)
         self.assertEqual(result.phone, body.phone)
         self.assertEqual(result.date_of_birth, body.date_of_birth)
+        self.session.commit.assert_awaited_once()
+        self.session.refresh.assert_not_awaited()
+        self.redis.incr.assert_awaited_once_with("contacts_generation:1")
 
     async def test_update_contact(self) -> None:
         contact = Contact(
@@ -55,11 +82,26 @@ class TestContactsRepository(unittest.IsolatedAsyncioTestCase):
             phone="+380111111111",
             date_of_birth="2022-07-07",
         )
+        updated = Contact(**body.model_dump(), id=contact.id, user_id=self.user.id)
         mocked_contact = MagicMock()
-        mocked_contact.scalar_one_or_none.return_value = contact
+        mocked_contact.first.return_value = updated
         self.session.execute.return_value = mocked_contact
         result = await update_contact(self.user, contact.id, body, self.session)
         self.assertEqual(result.phone, body.phone)
+        self.session.execute.assert_awaited_once()
+        query = self.session.execute.await_args.args[0]
+        self.assertEqual(query.compile().params["phone"], body.phone)
+        self.assertEqual(query.compile().params["birth_doy"], 707)
+        self.session.commit.assert_awaited_once()
+        self.session.refresh.assert_not_awaited()
+
+    async def test_update_missing_contact(self) -> None:
+        body = ContactSchema(name="test", surname="test")
+        mocked_contact = MagicMock()
+        mocked_contact.first.return_value = None
+        self.session.execute.return_value = mocked_contact
+        result = await update_contact(self.user, 999, body, self.session)
+        self.assertIsNone(result)
 
     async def test_delete_existing_contact(self) -> None:
         contact = Contact(
@@ -72,10 +114,39 @@ class TestContactsRepository(unittest.IsolatedAsyncioTestCase):
             user_id=self.user.id,
         )
         mocked_contact = MagicMock()
-        mocked_contact.scalars.return_value.first.return_value = contact
+        mocked_contact.first.return_value = contact
         self.session.execute.return_value = mocked_contact
         result = await delete_contact(self.user, contact.id, self.session)
         self.assertEqual(result, contact)
+        self.session.execute.assert_awaited_once()
+        self.session.delete.assert_not_awaited()
+        self.session.commit.assert_awaited_once()
+
+    async def test_update_contacts(self) -> None:
+        mocked_ids = MagicMock()
+        mocked_ids.scalars.return_value.all.return_value = [1, 2]
+        self.session.execute.return_value = mocked_ids
+        patches = {1: {"name": "new"}, 2: {}, 3: {"date_of_birth": date(2000, 2, 3)}}
+        result = await update_contacts(self.user, patches, self.session)
+        self.assertEqual(result, {1, 2})
+        self.session.execute.assert_awaited_once()
+        query = self.session.execute.await_args.args[0]
+        query = str(query.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+        self.assertIn("name=CASE contacts.id WHEN 1 THEN 'new' ELSE contacts.name END", query)
+        self.assertIn("birth_doy=CASE contacts.id WHEN 3 THEN 203 ELSE contacts.birth_doy END", query)
+        self.assertIn("updated_at=CASE WHEN (contacts.id IN (1, 3)) THEN CURRENT_TIMESTAMP "
+                      "ELSE contacts.updated_at END", query)
+        self.assertIn("WHERE contacts.user_id = 1 AND contacts.id IN (1, 2, 3) RETURNING id", query)
+        self.session.commit.assert_awaited_once()
+
+    async def test_delete_contacts(self) -> None:
+        mocked_ids = MagicMock()
+        mocked_ids.scalars.return_value.all.return_value = [1]
+        self.session.execute.return_value = mocked_ids
+        result = await delete_contacts(self.user, [1, 3], self.session)
+        self.assertEqual(result, {1})
+        self.session.execute.assert_awaited_once()
+        self.session.commit.assert_awaited_once()
 
     async def test_get_contacts(self) -> None:
         limit = 10
@@ -119,7 +190,7 @@ class TestContactsRepository(unittest.IsolatedAsyncioTestCase):
             )
         ]
         mocked_contacts = MagicMock()
-        mocked_contacts.scalars.return_value.all.return_value = contacts
+        mocked_contacts.all.return_value = contacts
         self.session.execute.return_value = mocked_contacts
         result = await get_contacts(
             skip=offset, limit=limit, db=self.session, user=self.user
@@ -127,6 +198,121 @@ class TestContactsRepository(unittest.IsolatedAsyncioTestCase):
         print(result)
         self.assertEqual(result, contacts)
 
+    async def test_get_contacts_after(self) -> None:
+        contacts = [
+            Contact(id=5, name="test", surname="test", user_id=self.user.id),
+            Contact(id=7, name="test_2", surname="test_2", user_id=self.user.id),
+        ]
+        mocked_contacts = MagicMock()
+        mocked_contacts.all.return_value = contacts
+        self.session.execute.return_value = mocked_contacts
+        result, next_cursor = await get_contacts_after(
+            cursor=encode_cursor(4), limit=2, db=self.session, user=self.user
+        )
+        self.assertEqual(result, contacts)
+        self.assertEqual(decode_cursor(next_cursor), 7)
+
+    async def test_get_contacts_after_last_page(self) -> None:
+        contacts = [Contact(id=5, name="test", surname="test", user_id=self.user.id)]
+        mocked_contacts = MagicMock()
+        mocked_contacts.all.return_value = contacts
+        self.session.execute.return_value = mocked_contacts
+        result, next_cursor = await get_contacts_after(
+            cursor=None, limit=2, db=self.session, user=self.user
+        )
+        self.assertEqual(result, contacts)
+        self.assertIsNone(next_cursor)
+
+    def test_decode_invalid_cursor(self) -> None:
+        with self.assertRaises(ValueError):
+            decode_cursor("not-a-cursor")
+
+    async def _birthdays_query(self, days: int, today: date) -> str:
+        mocked_contacts = MagicMock()
+        mocked_contacts.all.return_value = []
+        self.session.execute.return_value = mocked_contacts
+        await get_upcoming_birthdays(self.user, days, self.session, today=today)
+        query = self.session.execute.await_args.args[0]
+        return str(query.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+
+    async def test_upcoming_birthdays_range(self) -> None:
+        query = await self._birthdays_query(7, date(2024, 2, 25))
+        self.assertIn("contacts.birth_doy BETWEEN 225 AND 303", query)
+
+    async def test_upcoming_birthdays_year_end(self) -> None:
+        query = await self._birthdays_query(7, date(2024, 12, 28))
+        self.assertIn("contacts.birth_doy >= 1228 OR contacts.birth_doy <= 104", query)
+
+    async def test_get_changes(self) -> None:
+        since = datetime(2024, 1, 1, 12, 0, 0)
+        changed = MagicMock()
+        changed.all.return_value = [MagicMock(id=1, updated_at=datetime(2024, 1, 1, 12, 0, 5))]
+        deleted = MagicMock()
+        deleted.all.return_value = [MagicMock(contact_id=2, created_at=datetime(2024, 1, 1, 12, 0, 9))]
+        self.session.execute.side_effect = [changed, deleted]
+        result, deleted_ids, watermark = await get_changes(self.user, since, self.session, lag=timedelta(seconds=5))
+        self.assertEqual(result, changed.all.return_value)
+        self.assertEqual(deleted_ids, [2])
+        # Moved back by the lag to pick up transactions that commit late
+        self.assertEqual(watermark, datetime(2024, 1, 1, 12, 0, 4))
+
+    async def test_get_changes_watermark_never_goes_back(self) -> None:
+        since = datetime(2024, 1, 1, 12, 0, 0)
+        changed = MagicMock()
+        changed.all.return_value = [MagicMock(id=1, updated_at=datetime(2024, 1, 1, 12, 0, 2))]
+        deleted = MagicMock()
+        deleted.all.return_value = []
+        self.session.execute.side_effect = [changed, deleted]
+        *_, watermark = await get_changes(self.user, since, self.session, lag=timedelta(seconds=5))
+        self.assertEqual(watermark, since)
+
+    async def test_prune_deletions(self) -> None:
+        now = datetime(2024, 3, 1)
+        horizon = deletions_horizon(timedelta(days=30), now=now)
+        self.assertEqual(horizon, datetime(2024, 1, 31))
+        self.session.execute.return_value = MagicMock(rowcount=3)
+        self.assertEqual(await prune_deletions(horizon, self.session), 3)
+        query = str(self.session.execute.await_args.args[0].compile(compile_kwargs={"literal_binds": True}))
+        self.assertIn("DELETE FROM contact_deletions WHERE contact_deletions.created_at < '2024-01-31 00:00:00'", query)
+        self.session.commit.assert_awaited_once()
+
+    async def test_get_changes_full(self) -> None:
+        changed = MagicMock()
+        changed.all.return_value = []
+        self.session.execute.return_value = changed
+        result, deleted_ids, watermark = await get_changes(self.user, None, self.session)
+        self.assertEqual((result, deleted_ids, watermark), ([], [], None))
+        self.session.execute.assert_awaited_once()
+
+    def test_birth_doy(self) -> None:
+        self.assertEqual(birth_doy(date(2000, 12, 31)), 1231)
+        self.assertEqual(birth_doy("2000-02-29"), 229)
+        self.assertIsNone(birth_doy(None))
+        self.assertEqual(Contact(date_of_birth=date(2000, 7, 7)).birth_doy, 707)
+
+    async def test_fuzzy_search_postgresql(self) -> None:
+        self.session.get_bind = MagicMock(return_value=MagicMock(dialect=postgresql.dialect()))
+        mocked_contacts = MagicMock()
+        mocked_contacts.all.return_value = []
+        self.session.execute.return_value = mocked_contacts
+        await fuzzy_search_contacts(self.user, self.session, "jo_n", limit=5)
+        query = self.session.execute.await_args.args[0]
+        query = str(query.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+        self.assertIn("contacts.user_id = 1", query)
+        # The psycopg paramstyle doubles literal percent signs
+        self.assertIn("contacts.name ILIKE '%%jo/_n%%' ESCAPE '/'", query)
+        self.assertIn("(contacts.email %% 'jo_n')", query)
+        self.assertIn("ORDER BY CASE WHEN (contacts.name ILIKE 'jo/_n%%' ESCAPE '/'", query)
+        self.assertIn("greatest(similarity(contacts.name, 'jo_n'), similarity(contacts.surname, 'jo_n'), "
+                      "similarity(contacts.email, 'jo_n')) DESC", query)
+        self.assertIn("LIMIT 5", query)
+
+    def test_trigram_similarity(self) -> None:
+        self.assertEqual(trigram_similarity("Word", "word"), 1.0)
+        self.assertAlmostEqual(trigram_similarity("second", "secnd"), 4 / 9)
+        self.assertEqual(trigram_similarity("abc", "xyz"), 0.0)
+        self.assertEqual(trigram_similarity("", "xyz"), 0.0)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,16 +1,18 @@
 import unittest
-from unittest.mock import AsyncMock, MagicMock
+from unittest.mock import AsyncMock, MagicMock, patch
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.models import User
 from src.schemas.schemas import UserSchema
+from src.services.cache import user_cache
 from src.repository.users import (
     create_user,
     get_user_by_email,
     update_token,
     confirmed_email,
     update_avatar,
+    set_default_avatar,
 )
 
 
@@ -18,6 +20,10 @@ class TestUsersRepository(unittest.IsolatedAsyncioTestCase):
 
     def setUp(self) -> None:
         self.session = AsyncMock(spec=AsyncSession)
+        self.redis = AsyncMock()
+        patcher = patch.object(user_cache, "r", self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     async def test_create_user(self):
         body = UserSchema(
@@ -26,6 +32,7 @@ class TestUsersRepository(unittest.IsolatedAsyncioTestCase):
         result = await create_user(body=body, db=self.session)
         self.assertEqual(result.name, body.name)
         self.assertEqual(result.email, body.email)
+        self.assertIsNone(result.avatar)
 
     async def test_get_user_by_email(self):
         user = User(
@@ -49,6 +56,7 @@ class TestUsersRepository(unittest.IsolatedAsyncioTestCase):
         )
         self.assertEqual(result, None)
         self.assertEqual(user.refresh_token, "test_update_token")
+        self.redis.delete.assert_awaited_once_with(user_cache.key(user.email))
 
     async def test_confirmed_email(self):
         user = User(
@@ -65,6 +73,7 @@ class TestUsersRepository(unittest.IsolatedAsyncioTestCase):
         result = await confirmed_email(email="test@example.com", db=self.session)
         self.assertEqual(result, None)
         self.assertEqual(user.confirmed, True)
+        self.redis.delete.assert_awaited_once_with(user_cache.key(user.email))
 
     async def test_update_avatar(self):
         user = User(
@@ -82,3 +91,16 @@ class TestUsersRepository(unittest.IsolatedAsyncioTestCase):
 
         result = await update_avatar(email=user.email, url="test_url", db=self.session)
         self.assertEqual(result.avatar, "test_url")
+        self.redis.delete.assert_awaited_once_with(user_cache.key(user.email))
+
+    async def test_set_default_avatar(self):
+        self.session.execute.return_value = MagicMock(rowcount=1)
+        result = await set_default_avatar(email="test@example.com", url="test_url", db=self.session)
+        self.assertTrue(result)
+        self.redis.delete.assert_awaited_once_with(user_cache.key("test@example.com"))
+
+    async def test_set_default_avatar_keeps_existing(self):
+        self.session.execute.return_value = MagicMock(rowcount=0)
+        result = await set_default_avatar(email="test@example.com", url="test_url", db=self.session)
+        self.assertFalse(result)
+        self.redis.delete.assert_not_awaited()
@@ -4,6 +4,8 @@ import pytest
 from sqlalchemy import select
 
 from src.database.models import User
+from src.services.auth import auth_service
+from src.services.cache import TokenRevocations, token_cache
 from tests.conftest import TestingSession
 
 
@@ -17,6 +19,14 @@ def test_signup(client, user, mock_ratelimiter, monkeypatch):
     print(data)
 
 
+@pytest.mark.asyncio
+async def test_signup_sets_gravatar_after_response(user):
+    async with TestingSession() as session:
+        new_user = await session.execute(select(User).where(User.email == user["email"]))
+        new_user = new_user.scalar_one()
+    assert new_user.avatar.startswith("https://www.gravatar.com/avatar/")
+
+
 def test_singup_twice(client, user, mock_ratelimiter):
     response = client.post("/api/auth/signup", json=user)
 
@@ -86,3 +96,42 @@ def test_validation_error(client, user, mock_ratelimiter):
     assert response.status_code == 422, response.text
     data = response.json()
     assert "detail" in data
+
+
+@pytest.mark.asyncio
+async def test_refresh_token_reuse_revokes_access_tokens(client, user, mock_ratelimiter):
+    data = {}
+    redis = auth_service.revocations.r
+    redis.get.side_effect = lambda key: data.get(key)
+    redis.set.side_effect = lambda key, value, ex=None: data.__setitem__(key, value)
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get("email"), "password": user.get("password")},
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    assert client.get("/api/auth/secret", headers=headers).status_code == 200
+
+    stale = await auth_service.create_refresh_token(data={"sub": user["email"]}, expires_delta=60)
+    response = client.get("/api/auth/refresh_token", headers={"Authorization": f"Bearer {stale}"})
+    assert response.status_code == 401, response.text
+    redis.publish.assert_awaited_with(TokenRevocations.CHANNEL, user["email"])
+
+    # Another worker has not cached the token and finds the revocation in Redis
+    token_cache.clear()
+    response = client.get("/api/auth/secret", headers=headers)
+    assert response.status_code == 401, response.text
+
+    # Logging in again right away gives a token issued after the revocation
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get("email"), "password": user.get("password")},
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    assert client.get("/api/auth/secret", headers=headers).status_code == 200
+
+
+def test_invalid_access_token(client, mock_ratelimiter):
+    response = client.get("/api/auth/secret", headers={"Authorization": "Bearer invalid"})
+
+    assert response.status_code == 401, response.text
+    assert response.json()["detail"] == "Could not validate credentials"
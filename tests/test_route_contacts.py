@@ -1,10 +1,15 @@
-from unittest.mock import Mock
+import gzip
+import json
+from datetime import date, datetime, timedelta
+from unittest.mock import AsyncMock, Mock
 import pytest_asyncio
-from sqlalchemy import select
+from sqlalchemy import event, select
+from sqlalchemy.engine import Engine
 
 from tests.conftest import TestingSession
 
 from src.database.models import User
+from src.services.cache import response_cache
 
 
 @pytest_asyncio.fixture()
@@ -56,6 +61,35 @@ def test_get_contacts(client, token, mock_ratelimiter):
     assert len(data) == 1
 
 
+def test_get_contacts_cursor(client, token, mock_ratelimiter):
+    response = client.get(
+        "/api/contacts/", params={"limit": 1}, headers={"Authorization": f"Bearer {token}"}
+    )
+
+    assert response.status_code == 200, response.text
+    assert len(response.json()) == 1
+    next_cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get(
+        "/api/contacts/",
+        params={"limit": 1, "cursor": next_cursor},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+    assert response.status_code == 200, response.text
+    assert response.json() == []
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_get_contacts_invalid_cursor(client, token, mock_ratelimiter):
+    response = client.get(
+        "/api/contacts/", params={"cursor": "invalid"}, headers={"Authorization": f"Bearer {token}"}
+    )
+
+    assert response.status_code == 400, response.text
+    assert response.json()["detail"] == "Invalid cursor"
+
+
 def test_get_contact(client, token, contact, mock_ratelimiter):
     response = client.get(
         f"/api/contacts/{contact['id']}", headers={"Authorization": f"Bearer {token}"}
@@ -103,3 +137,333 @@ def test_delete_contact_not_found(client, token, contact, mock_ratelimiter):
     )
 
     assert response.status_code == 404, response.text
+
+
+def test_import_contacts_csv(client, token, mock_ratelimiter):
+    body = (
+        "name,surname,email,phone,date_of_birth\n"
+        "first,contact,first@example.com,+380000000001,2000-01-01\n"
+        "x,invalid,,,2000-01-02\n"
+        "second,contact,,,2000-01-03\n"
+    )
+    response = client.post(
+        "/api/contacts/import",
+        files={"file": ("contacts.csv", body, "text/csv")},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["imported"] == 2
+    assert data["failed"] == 1
+    assert data["errors"][0]["row"] == 2
+    assert data["errors"][0]["errors"][0]["loc"] == ["name"]
+
+
+def test_import_contacts_csv_not_utf8(client, token, mock_ratelimiter):
+    body = "name,surname\nx,invalid\nJosé,Müller\n".encode("latin-1")
+    response = client.post(
+        "/api/contacts/import",
+        files={"file": ("contacts.csv", body, "text/csv")},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+    assert response.status_code == 400, response.text
+    detail = response.json()["detail"]
+    assert detail["failed"] == 2
+    assert detail["errors"][0]["errors"][0]["loc"] == ["name"]
+    assert detail["errors"][1:] == [{"row": 2, "errors": [
+        {"type": "unicode_decode_error", "loc": [], "msg": "File is not valid UTF-8: invalid continuation byte"}]}]
+
+
+def test_import_contacts_csv_field_too_large(client, token, mock_ratelimiter):
+    body = "\ufeffname,surname\nx,invalid\n" + "x" * 200_000 + ",contact\n"
+    response = client.post(
+        "/api/contacts/import",
+        files={"file": ("contacts.csv", body.encode(), "text/csv")},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+    assert response.status_code == 400, response.text
+    detail = response.json()["detail"]
+    assert detail["failed"] == 2
+    assert detail["errors"][1]["row"] == 2
+    assert detail["errors"][1]["errors"][0]["type"] == "csv_error"
+
+
+def test_import_contacts_ndjson(client, token, mock_ratelimiter):
+    body = (
+        '{"name": "third", "surname": "contact", "date_of_birth": "2000-01-04"}\n'
+        "not json\n"
+        '{"name": "fourth", "surname": "contact"}\n'
+    )
+    response = client.post(
+        "/api/contacts/import",
+        files={"file": ("contacts.ndjson", body, "application/x-ndjson")},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["imported"] == 1
+    assert data["failed"] == 2
+    assert [error["row"] for error in data["errors"]] == [2, 3]
+    assert data["errors"][1]["errors"][0]["type"] == "database_error"
+
+    response = client.get("/api/contacts/", headers={"Authorization": f"Bearer {token}"})
+    assert len(response.json()) == 3
+
+
+def test_export_contacts_csv(client, token, mock_ratelimiter):
+    response = client.get("/api/contacts/export", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("text/csv")
+    lines = response.text.splitlines()
+    assert lines[0] == "id,name,surname,email,phone,date_of_birth"
+    assert len(lines) == 4
+    assert lines[1].endswith(",first,contact,first@example.com,+380000000001,2000-01-01")
+
+
+def test_export_contacts_ndjson_gzip(client, token, mock_ratelimiter):
+    response = client.get(
+        "/api/contacts/export",
+        params={"format": "ndjson", "gzip": True},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == "application/gzip"
+    records = [json.loads(line) for line in gzip.decompress(response.content).splitlines()]
+    assert [record["name"] for record in records] == ["first", "second", "third"]
+    assert records[0]["date_of_birth"] == "2000-01-01"
+
+
+def test_export_contacts_vcard(client, token, mock_ratelimiter):
+    response = client.get(
+        "/api/contacts/export", params={"format": "vcard"}, headers={"Authorization": f"Bearer {token}"}
+    )
+
+    assert response.status_code == 200, response.text
+    assert response.text.count("BEGIN:VCARD") == 3
+    assert "N:contact;first;;;" in response.text
+    assert "BDAY:2000-01-01" in response.text
+
+
+def test_search_contacts_fuzzy(client, token, mock_ratelimiter):
+    headers = {"Authorization": f"Bearer {token}"}
+
+    response = client.get("/api/contacts/search", params={"q": "secnd"}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert [contact["name"] for contact in response.json()] == ["second"]
+
+    response = client.get("/api/contacts/search", params={"q": "IRS"}, headers=headers)
+    assert [contact["name"] for contact in response.json()] == ["first"]
+
+    response = client.get("/api/contacts/search", params={"q": "cont", "limit": 2}, headers=headers)
+    assert [contact["name"] for contact in response.json()] == ["first", "second"]
+
+
+def test_upcoming_birthdays(client, token, mock_ratelimiter):
+    headers = {"Authorization": f"Bearer {token}"}
+    today = date.today()
+    for name, offset in (("later", 3), ("sooner", 1), ("far", 40)):
+        birthday = (today + timedelta(days=offset)).replace(year=1992)
+        body = {"name": name, "surname": "birthday", "date_of_birth": birthday.isoformat()}
+        response = client.post("/api/contacts/", json=body, headers=headers)
+        assert response.status_code == 201, response.text
+
+    response = client.get("/api/contacts/birthdays", params={"days": 7}, headers=headers)
+
+    assert response.status_code == 200, response.text
+    names = [contact["name"] for contact in response.json() if contact["surname"] == "birthday"]
+    assert names == ["sooner", "later"]
+
+
+def test_batch_update_and_delete_contacts(client, token, mock_ratelimiter):
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.get("/api/contacts/search", params={"surname": "birthday"}, headers=headers)
+    ids = {contact["name"]: contact["id"] for contact in response.json()}
+
+    body = {"items": [
+        {"id": ids["far"], "patch": {"phone": "+380000000001", "date_of_birth": "1992-01-02"}},
+        {"id": 999999, "patch": {"name": "missing"}},
+    ]}
+    response = client.post("/api/contacts/batch/update", json=body, headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json() == [{"id": ids["far"], "status": "updated"}, {"id": 999999, "status": "not_found"}]
+
+    response = client.get(f"/api/contacts/{ids['far']}", headers=headers)
+    data = response.json()
+    assert data["name"] == "far"
+    assert data["phone"] == "+380000000001"
+    assert data["date_of_birth"] == "1992-01-02"
+
+    response = client.post("/api/contacts/batch/update",
+                           json={"items": [{"id": ids["far"], "patch": {"name": None}}]}, headers=headers)
+    assert response.status_code == 422, response.text
+
+    body = {"ids": [ids["sooner"], ids["later"], 999999]}
+    response = client.post("/api/contacts/batch/delete", json=body, headers=headers)
+    assert response.status_code == 200, response.text
+    assert [item["status"] for item in response.json()] == ["deleted", "deleted", "not_found"]
+
+    response = client.get(f"/api/contacts/{ids['sooner']}", headers=headers)
+    assert response.status_code == 404, response.text
+
+
+def test_batch_update_runs_one_statement(client, token, mock_ratelimiter):
+    headers = {"Authorization": f"Bearer {token}"}
+    contacts = client.get("/api/contacts/", headers=headers).json()[:3]
+    body = {"items": [
+        {"id": contacts[0]["id"], "patch": {"phone": "+380000000002"}},
+        {"id": contacts[1]["id"], "patch": {"surname": contacts[1]["surname"], "date_of_birth": "1991-03-04"}},
+        {"id": contacts[2]["id"], "patch": {}},
+    ]}
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        response = client.post("/api/contacts/batch/update", json=body, headers=headers)
+    finally:
+        event.remove(Engine, "before_cursor_execute", before_cursor_execute)
+
+    assert response.status_code == 200, response.text
+    assert [item["status"] for item in response.json()] == ["updated"] * 3
+    assert len(statements) == 1, statements
+    assert statements[0].startswith("UPDATE contacts")
+    assert client.get(f"/api/contacts/{contacts[0]['id']}", headers=headers).json()["phone"] == "+380000000002"
+    assert client.get(f"/api/contacts/{contacts[1]['id']}", headers=headers).json()["date_of_birth"] == "1991-03-04"
+    assert client.get(f"/api/contacts/{contacts[2]['id']}", headers=headers).json() == contacts[2]
+
+
+def test_contact_changes(client, token, mock_ratelimiter):
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.get("/api/contacts/changes", headers=headers)
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["deleted"] == []
+    assert {contact["name"] for contact in data["changed"]} >= {"first", "second", "far"}
+    ids = {contact["name"]: contact["id"] for contact in data["changed"]}
+    watermark = data["watermark"]
+    # SQLite keeps CURRENT_TIMESTAMP without fractional seconds, which never equals a bound datetime
+    since = (datetime.fromisoformat(watermark) - timedelta(seconds=1)).isoformat()
+
+    response = client.post("/api/contacts/", json={"name": "fresh", "surname": "sync", "date_of_birth": "1990-01-01"},
+                           headers=headers)
+    fresh_id = response.json()["id"]
+    client.delete(f"/api/contacts/{ids['far']}", headers=headers)
+
+    response = client.get("/api/contacts/changes", params={"since": since}, headers=headers)
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert fresh_id in [contact["id"] for contact in data["changed"]]
+    assert ids["far"] in data["deleted"]
+    assert ids["far"] not in [contact["id"] for contact in data["changed"]]
+    assert data["watermark"] >= watermark
+    assert data["full"] is False
+
+
+def test_contact_changes_before_retention_is_full(client, token, mock_ratelimiter):
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.get("/api/contacts/changes", params={"since": "2000-01-01T00:00:00"}, headers=headers)
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["full"] is True
+    assert data["deleted"] == []
+    assert len(data["changed"]) == len(client.get("/api/contacts/", headers=headers).json())
+
+
+def test_get_contacts_etag(client, token, mock_ratelimiter):
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.get("/api/contacts/", params={"limit": 2}, headers=headers)
+    assert response.status_code == 200, response.text
+    etag = response.headers["ETag"]
+
+    response = client.get("/api/contacts/", params={"limit": 2}, headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304, response.text
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+    contact_id = client.get("/api/contacts/", params={"limit": 1}, headers=headers).json()[0]["id"]
+    client.delete(f"/api/contacts/{contact_id}", headers=headers)
+    response = client.get("/api/contacts/", params={"limit": 2}, headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200, response.text
+    assert response.headers["ETag"] != etag
+
+
+def test_get_contact_etag(client, token, mock_ratelimiter):
+    headers = {"Authorization": f"Bearer {token}"}
+    contact_id = client.get("/api/contacts/", params={"limit": 1}, headers=headers).json()[0]["id"]
+    response = client.get(f"/api/contacts/{contact_id}", headers=headers)
+    etag = response.headers["ETag"]
+
+    response = client.get(f"/api/contacts/{contact_id}", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304, response.text
+
+    response = client.get("/api/contacts/999999", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 404, response.text
+
+
+def test_read_users_me_etag(client, token, mock_ratelimiter):
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.get("/api/users/me", headers=headers)
+    assert response.status_code == 200, response.text
+    etag = response.headers["ETag"]
+
+    response = client.get("/api/users/me", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304, response.text
+
+
+def test_get_contacts_from_response_cache(client, token, mock_ratelimiter):
+    headers = {"Authorization": f"Bearer {token}"}
+    cached = b'{"ETag":"\\"cached\\""}\n[{"id":42,"name":"cached"}]'
+
+    async def get(key):
+        return cached if key.startswith("contacts_response:") else None
+
+    response_cache.r.get.side_effect = get
+    response = client.get("/api/contacts/", headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json() == [{"id": 42, "name": "cached"}]
+    assert response.headers["ETag"] == '"cached"'
+
+    response = client.get("/api/contacts/", headers={**headers, "If-None-Match": '"cached"'})
+    assert response.status_code == 304, response.text
+
+
+def test_replica_reads_are_not_cached(client, token, mock_ratelimiter, monkeypatch):
+    headers = {"Authorization": f"Bearer {token}"}
+    monkeypatch.setattr("src.database.db.replica_router.session_factory_for", AsyncMock(return_value=TestingSession))
+
+    response = client.get("/api/contacts/", headers=headers)
+    assert response.status_code == 200, response.text
+    response = client.get("/api/contacts/search", params={"q": "test"}, headers=headers)
+    assert response.status_code == 200, response.text
+    cached_keys = [call.args[0] for call in response_cache.r.set.await_args_list]
+    assert not any(key.startswith("contacts_response:") for key in cached_keys)
+
+
+def test_get_contacts_runs_one_statement(client, token, mock_ratelimiter):
+    headers = {"Authorization": f"Bearer {token}"}
+    # Warm the token and user caches
+    client.get("/api/contacts/", headers=headers)
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        response = client.get("/api/contacts/", headers=headers)
+    finally:
+        event.remove(Engine, "before_cursor_execute", before_cursor_execute)
+
+    assert response.status_code == 200, response.text
+    assert len(statements) == 1, statements
+    assert "users" not in statements[0]
@@ -0,0 +1,128 @@
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import select
+
+from tests.conftest import TestingSession
+
+from src.database.models import User
+from src.services.avatars import LocalStorage, avatar_memory
+
+
+@pytest_asyncio.fixture()
+async def token(client, user, mock_ratelimiter, monkeypatch):
+    mock_send_email = Mock()
+    monkeypatch.setattr("src.routes.auth.send_email", mock_send_email)
+    client.post("/api/auth/signup", json=user)
+
+    async with TestingSession() as session:
+        existing_user = await session.execute(
+            select(User).where(User.name == user["name"])
+        )
+        existing_user = existing_user.scalar_one_or_none()
+        if existing_user:
+            existing_user.confirmed = True
+            await session.commit()
+
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get("email"), "password": user.get("password")},
+    )
+
+    data = response.json()
+    return data.get("access_token")
+
+
+def test_update_avatar_is_accepted(client, token, mock_ratelimiter, monkeypatch):
+    job = {"job_id": "job", "user_id": 1, "status": "pending", "avatar": None, "error": None}
+    submit = AsyncMock(return_value=job)
+    monkeypatch.setattr("src.routes.users.avatar_pipeline.submit", submit)
+    response = client.patch(
+        "/api/users/avatar",
+        files={"file": ("avatar.png", b"image", "image/png")},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+    assert response.status_code == 202, response.text
+    assert response.json()["status"] == "pending"
+    assert response.headers["Location"] == "/api/users/avatar/jobs/job"
+    submit.assert_awaited_once()
+
+
+def test_update_avatar_rejects_non_image(client, token, mock_ratelimiter):
+    response = client.patch(
+        "/api/users/avatar",
+        files={"file": ("avatar.txt", b"text", "text/plain")},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+    assert response.status_code == 415, response.text
+
+
+def test_read_avatar_job_of_another_user(client, token, mock_ratelimiter, monkeypatch):
+    job = {"job_id": "job", "user_id": 999, "status": "done", "avatar": "url", "error": None}
+    monkeypatch.setattr("src.routes.users.avatar_pipeline.jobs.get", AsyncMock(return_value=job))
+    response = client.get("/api/users/avatar/jobs/job", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 404, response.text
+
+
+def test_read_avatar_job_has_absolute_url(client, token, mock_ratelimiter, monkeypatch):
+    response = client.get("/api/users/me", headers={"Authorization": f"Bearer {token}"})
+    avatar = "/api/users/avatars/" + "a" * 64 + "_250.jpg"
+    job = {"job_id": "job", "user_id": response.json()["id"], "status": "done", "avatar": avatar, "error": None}
+    monkeypatch.setattr("src.routes.users.avatar_pipeline.jobs.get", AsyncMock(return_value=job))
+    response = client.get("/api/users/avatar/jobs/job", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 200, response.text
+    assert response.json()["avatar"] == "http://testserver" + avatar
+    assert response.json()["avatar_thumbnail"] == "http://testserver" + avatar.replace("_250.jpg", "_64.jpg")
+
+    monkeypatch.setattr("settings.settings.avatar_public_url", "https://contacts.example.com")
+    response = client.get("/api/users/avatar/jobs/job", headers={"Authorization": f"Bearer {token}"})
+    assert response.json()["avatar"] == "https://contacts.example.com" + avatar
+
+
+@pytest.mark.asyncio
+async def test_read_users_me_has_absolute_avatar_url(client, user, token, mock_ratelimiter):
+    avatar = "/api/users/avatars/" + "a" * 64 + "_250.jpg"
+    async with TestingSession() as session:
+        db_user = (await session.execute(select(User).where(User.email == user["email"]))).scalar_one()
+        previous, db_user.avatar = db_user.avatar, avatar
+        await session.commit()
+    try:
+        response = client.get("/api/users/me", headers={"Authorization": f"Bearer {token}"})
+    finally:
+        async with TestingSession() as session:
+            db_user = (await session.execute(select(User).where(User.email == user["email"]))).scalar_one()
+            db_user.avatar = previous
+            await session.commit()
+
+    assert response.status_code == 200, response.text
+    assert response.json()["avatar"] == "http://testserver" + avatar
+    assert response.json()["avatar_thumbnail"] == "http://testserver" + avatar.replace("_250.jpg", "_64.jpg")
+
+
+def test_read_avatar_file(client, tmp_path, monkeypatch):
+    name = "a" * 64 + "_64.jpg"
+    (tmp_path / name).write_bytes(b"jpeg")
+    monkeypatch.setattr("src.services.avatars.avatar_storage", LocalStorage(tmp_path, "/api/users/avatars/"))
+    avatar_memory.clear()
+    response = client.get(f"/api/users/avatars/{name}")
+
+    assert response.status_code == 200, response.text
+    assert response.content == b"jpeg"
+    assert response.headers["content-type"] == "image/jpeg"
+    assert "immutable" in response.headers["Cache-Control"]
+
+    response = client.get(f"/api/users/avatars/{name}", headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+
+
+@pytest.mark.parametrize("name", ["b" * 64 + "_64.jpg", "..%2Fsettings.py", "avatar.jpg"])
+def test_read_avatar_file_not_found(client, tmp_path, monkeypatch, name):
+    monkeypatch.setattr("src.services.avatars.avatar_storage", LocalStorage(tmp_path, "/api/users/avatars/"))
+    response = client.get(f"/api/users/avatars/{name}")
+
+    assert response.status_code == 404, response.text
@@ -0,0 +1,150 @@
+import hashlib
+import io
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from fastapi import HTTPException, UploadFile
+from PIL import Image
+from starlette.datastructures import Headers
+
+from src.services.avatars import (AvatarIndex, AvatarJobs, AvatarPipeline, LocalStorage, MirroredStorage,
+                                  avatar_thumbnail_url, render_avatar)
+
+
+def image_bytes(width: int = 400, height: int = 300, fmt: str = "PNG") -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def upload(data: bytes, content_type: str = "image/png") -> UploadFile:
+    return UploadFile(io.BytesIO(data), size=len(data), filename="avatar.png",
+                      headers=Headers({"content-type": content_type}))
+
+
+class TestRenderAvatar(unittest.TestCase):
+
+    def test_variants_are_square_jpegs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "upload"
+            path.write_bytes(image_bytes(fmt="JPEG"))
+            variants = render_avatar(path, sizes=(64, 250))
+        self.assertEqual(list(variants), [250, 64])
+        for size, data in variants.items():
+            with Image.open(io.BytesIO(data)) as image:
+                self.assertEqual(image.format, "JPEG")
+                self.assertEqual(image.size, (size, size))
+
+
+class TestAvatarThumbnailUrl(unittest.TestCase):
+
+    def test_stored_avatar_has_variant(self):
+        digest = "a" * 64
+        self.assertEqual(avatar_thumbnail_url(f"http://api/avatars/{digest}_250.jpg"),
+                         f"http://api/avatars/{digest}_64.jpg")
+
+    def test_gravatar_is_resized(self):
+        url = "https://www.gravatar.com/avatar/55502f40dc8b7c769880b10874abc9d0"
+        self.assertEqual(avatar_thumbnail_url(url), f"{url}?s=64")
+
+    def test_other_avatars_have_none(self):
+        self.assertIsNone(avatar_thumbnail_url("https://example.com/avatar.png"))
+        self.assertIsNone(avatar_thumbnail_url(None))
+
+
+class TestAvatarPipeline(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.media = Path(self.directory.name) / "media"
+        self.spool = Path(self.directory.name) / "spool"
+        self.spool.mkdir()
+        self.redis = AsyncMock()
+        self.redis.get.return_value = None
+        self.pipeline = AvatarPipeline(LocalStorage(self.media, "/media/avatars"), AvatarJobs(self.redis),
+                                       AvatarIndex(self.redis, ttl=60), max_bytes=100_000, spool_dir=str(self.spool),
+                                       session_factory=MagicMock())
+        self.addAsyncCleanup(self.pipeline.close)
+        self.user = MagicMock(id=1, email="test@example.com")
+
+    async def test_job_stores_variants_and_updates_user(self):
+        data = image_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        with patch("src.repository.users.update_avatar", new_callable=AsyncMock) as update_avatar:
+            job = await self.pipeline.submit(self.user, upload(data))
+            self.assertEqual(job["status"], "pending")
+            await next(iter(self.pipeline.tasks))
+
+        url = f"/media/avatars/{digest}_250.jpg"
+        self.assertEqual(update_avatar.await_args.args[:2], ("test@example.com", url))
+        self.assertEqual(sorted(p.name for p in self.media.iterdir()), [f"{digest}_250.jpg", f"{digest}_64.jpg"])
+        self.assertEqual(list(self.spool.iterdir()), [])
+        self.redis.set.assert_any_await(AvatarIndex.key(digest), url, ex=60)
+        key, data = self.redis.set.await_args.args
+        self.assertEqual(key, AvatarJobs.key(job["job_id"]))
+        self.assertEqual(json.loads(data)["status"], "done")
+
+    async def test_known_image_is_not_processed_again(self):
+        self.redis.get.return_value = b"/media/avatars/known_250.jpg"
+        with patch("src.repository.users.update_avatar", new_callable=AsyncMock) as update_avatar, \
+                patch("src.services.avatars.render_avatar") as render:
+            job = await self.pipeline.submit(self.user, upload(image_bytes()))
+            await next(iter(self.pipeline.tasks))
+
+        render.assert_not_called()
+        self.assertFalse(self.media.exists())
+        self.assertEqual(update_avatar.await_args.args[1], "/media/avatars/known_250.jpg")
+        self.assertEqual(job["avatar"], "/media/avatars/known_250.jpg")
+
+    async def test_job_fails_on_invalid_image(self):
+        job = await self.pipeline.submit(self.user, upload(b"not an image"))
+        await next(iter(self.pipeline.tasks))
+        self.assertEqual(job["status"], "failed")
+        self.assertEqual(list(self.spool.iterdir()), [])
+
+    async def test_rejects_oversized_upload(self):
+        data = b"x" * 100_001
+        with self.assertRaises(HTTPException) as e:
+            await self.pipeline.submit(self.user, upload(data))
+        self.assertEqual(e.exception.status_code, 413)
+        # The declared size may be missing, the spool stops at max_bytes anyway
+        file = upload(data)
+        file.size = None
+        with self.assertRaises(HTTPException) as e:
+            await self.pipeline.submit(self.user, file)
+        self.assertEqual(e.exception.status_code, 413)
+        self.assertEqual(list(self.spool.iterdir()), [])
+
+    async def test_rejects_non_image(self):
+        with self.assertRaises(HTTPException) as e:
+            await self.pipeline.submit(self.user, upload(b"text", content_type="text/plain"))
+        self.assertEqual(e.exception.status_code, 415)
+
+
+class TestMirroredStorage(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.origin = AsyncMock()
+        self.storage = MirroredStorage(self.origin, LocalStorage(self.directory.name, "/avatars/"))
+
+    async def test_save_writes_both_and_serves_local_url(self):
+        self.assertEqual(await self.storage.save("a_64.jpg", b"jpeg"), "/avatars/a_64.jpg")
+        self.origin.save.assert_awaited_once_with("a_64.jpg", b"jpeg")
+        self.assertEqual(await self.storage.read("a_64.jpg"), b"jpeg")
+        self.origin.read.assert_not_awaited()
+
+    async def test_read_fetches_from_origin_once(self):
+        self.origin.read.return_value = b"jpeg"
+        self.assertEqual(await self.storage.read("a_64.jpg"), b"jpeg")
+        self.assertEqual(await self.storage.read("a_64.jpg"), b"jpeg")
+        self.origin.read.assert_awaited_once_with("a_64.jpg")
+
+
+if __name__ == '__main__':
+    unittest.main()
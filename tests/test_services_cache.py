@@ -0,0 +1,196 @@
+import unittest
+from unittest.mock import AsyncMock
+
+from src.database.models import User
+from src.services.cache import LocalCache, ResponseCache, TokenCache, TokenRevocations, UserCache, UserSnapshot
+
+
+class TestLocalCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.now = 0.0
+        self.cache = LocalCache(maxsize=2, ttl=10, timer=lambda: self.now)
+
+    def test_get_set(self):
+        self.cache.set("a", 1)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertIsNone(self.cache.get("b"))
+
+    def test_expired_entry_is_dropped(self):
+        self.cache.set("a", 1)
+        self.now = 10
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("c"), 3)
+
+
+class TestUserCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.redis = AsyncMock()
+        self.cache = UserCache(self.redis, ttl=60)
+        self.user = User(
+            id=1,
+            name="test",
+            email="test@example.com",
+            password="hashed_password",
+            avatar=None,
+            refresh_token="refresh_token",
+            confirmed=True,
+        )
+
+    async def test_set_stores_snapshot_without_secrets(self):
+        snapshot = await self.cache.set(self.user)
+        self.assertEqual(snapshot, UserSnapshot(1, "test", "test@example.com", None, True))
+        key, data = self.redis.set.await_args.args
+        self.assertEqual(key, "user_snapshot:test@example.com")
+        self.assertEqual(self.redis.set.await_args.kwargs, {"ex": 60})
+        self.assertNotIn(b"hashed_password", data)
+        self.assertNotIn(b"refresh_token", data)
+
+    async def test_get_round_trip(self):
+        await self.cache.set(self.user)
+        self.redis.get.return_value = self.redis.set.await_args.args[1]
+        snapshot = await self.cache.get(self.user.email)
+        self.assertEqual(snapshot.id, self.user.id)
+        self.assertEqual(snapshot.email, self.user.email)
+        self.assertTrue(snapshot.confirmed)
+
+    async def test_get_miss(self):
+        self.redis.get.return_value = None
+        self.assertIsNone(await self.cache.get(self.user.email))
+
+    async def test_get_other_version_is_miss(self):
+        self.redis.get.return_value = b'[0,1,"test","test@example.com",null,true]'
+        self.assertIsNone(await self.cache.get(self.user.email))
+
+    async def test_get_garbage_is_miss(self):
+        self.redis.get.return_value = b"\x80\x04garbage"
+        self.assertIsNone(await self.cache.get(self.user.email))
+
+    async def test_invalidate(self):
+        await self.cache.invalidate(self.user.email)
+        self.redis.delete.assert_awaited_once_with("user_snapshot:test@example.com")
+        self.redis.publish.assert_awaited_once_with(UserCache.CHANNEL, "test@example.com")
+
+
+class TestUserCacheWithLocal(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.redis = AsyncMock()
+        self.cache = UserCache(self.redis, local=LocalCache(maxsize=10, ttl=30))
+        self.user = User(id=1, name="test", email="test@example.com", avatar=None, confirmed=True)
+
+    async def test_local_hit_skips_redis(self):
+        snapshot = await self.cache.set(self.user)
+        self.assertEqual(await self.cache.get(self.user.email), snapshot)
+        self.redis.get.assert_not_awaited()
+
+    async def test_redis_hit_fills_local(self):
+        data = self.cache.dumps(UserSnapshot(1, "test", "test@example.com", None, True))
+        self.redis.get.return_value = data
+        await self.cache.get(self.user.email)
+        await self.cache.get(self.user.email)
+        self.redis.get.assert_awaited_once()
+
+    async def test_invalidate_drops_local(self):
+        await self.cache.set(self.user)
+        await self.cache.invalidate(self.user.email)
+        self.redis.get.return_value = None
+        self.assertIsNone(await self.cache.get(self.user.email))
+
+
+class TestTokenCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.now = 1000
+        self.cache = TokenCache(maxsize=2, timer=lambda: self.now)
+
+    def test_hit_and_miss_counters(self):
+        self.assertIsNone(self.cache.get("token"))
+        self.cache.set("token", "test@example.com", "access_token", 2000)
+        self.assertEqual(self.cache.get("token"), ("test@example.com", "access_token", 2000))
+        self.assertEqual(self.cache.stats(), {"size": 1, "maxsize": 2, "hits": 1, "misses": 1})
+
+    def test_expired_token_is_miss(self):
+        self.cache.set("token", "test@example.com", "access_token", 2000)
+        self.now = 2000
+        self.assertIsNone(self.cache.get("token"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_bounded(self):
+        for token in ("a", "b", "c"):
+            self.cache.set(token, "test@example.com", "access_token", 2000)
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_revoke(self):
+        self.cache.set("a", "test@example.com", "access_token", 2000)
+        self.cache.set("b", "other@example.com", "access_token", 2000)
+        self.cache.revoke("b")
+        self.cache.revoke_subject("test@example.com")
+        self.assertEqual(len(self.cache), 0)
+
+
+class TestTokenRevocations(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.data = {}
+        self.redis = AsyncMock()
+        self.redis.get.side_effect = lambda key: self.data.get(key)
+        self.redis.set.side_effect = lambda key, value, ex=None: self.data.__setitem__(key, value)
+        self.tokens = TokenCache(maxsize=2, timer=lambda: 1000)
+        self.revocations = TokenRevocations(self.redis, self.tokens, ttl=3600, timer=lambda: 1500.5)
+
+    async def test_revoke_rejects_tokens_issued_before(self):
+        self.tokens.set("token", "test@example.com", "access_token", 2000)
+        self.assertFalse(await self.revocations.is_revoked("test@example.com", 1400))
+        await self.revocations.revoke("test@example.com")
+        self.assertEqual(len(self.tokens), 0)
+        self.redis.set.assert_awaited_once_with(TokenRevocations.key("test@example.com"), 1500500, ex=3600)
+        self.redis.publish.assert_awaited_once_with(TokenRevocations.CHANNEL, "test@example.com")
+        self.assertTrue(await self.revocations.is_revoked("test@example.com", 1400))
+        self.assertTrue(await self.revocations.is_revoked("test@example.com", 1500.499))
+        self.assertFalse(await self.revocations.is_revoked("other@example.com", 1400))
+
+    async def test_token_issued_right_after_revoke_is_valid(self):
+        await self.revocations.revoke("test@example.com")
+        # Same second as the revocation, a moment later
+        self.assertFalse(await self.revocations.is_revoked("test@example.com", 1500.501))
+        self.assertFalse(await self.revocations.is_revoked("test@example.com", 1500.5))
+
+
+class TestResponseCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.data = {}
+        self.redis = AsyncMock()
+        self.redis.get.side_effect = lambda key: self.data.get(key)
+        self.redis.set.side_effect = lambda key, value, ex=None: self.data.__setitem__(key, value)
+        self.redis.incr.side_effect = lambda key: self.data.__setitem__(key, int(self.data.get(key, 0)) + 1)
+        self.cache = ResponseCache(self.redis, ttl=60)
+
+    async def test_round_trip(self):
+        key = await self.cache.key(1, "list")
+        self.assertIsNone(await self.cache.get(key))
+        await self.cache.set(key, {"ETag": '"abc"'}, b'[{"id":1}]')
+        self.assertEqual(await self.cache.get(key), ({"ETag": '"abc"'}, b'[{"id":1}]'))
+        self.assertEqual(self.redis.set.await_args.kwargs, {"ex": 60})
+
+    async def test_invalidate_changes_keys_of_the_user_only(self):
+        key, other = await self.cache.key(1, "list"), await self.cache.key(2, "list")
+        await self.cache.invalidate(1)
+        self.assertNotEqual(await self.cache.key(1, "list"), key)
+        self.assertEqual(await self.cache.key(2, "list"), other)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import io
+import threading
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from sqlalchemy.exc import IntegrityError
+
+from src.services import contacts_io
+from src.services.contacts_io import validate_rows
+from src.services.cache import response_cache
+
+
+def csv_file(rows: int, rejected: set) -> io.BytesIO:
+    lines = ["name,surname,date_of_birth"]
+    for n in range(1, rows + 1):
+        lines.append(f"name{n},{'reject' if n in rejected else 'contact'},2000-01-01")
+    return io.BytesIO("\n".join(lines).encode())
+
+
+class TestImportContacts(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.db = MagicMock()
+        self.db.commit = AsyncMock()
+        self.db.begin_nested.return_value.__aenter__ = AsyncMock()
+        self.db.begin_nested.return_value.__aexit__ = AsyncMock(return_value=False)
+        self.user = MagicMock(id=1)
+        self.redis = AsyncMock()
+        patcher = patch.object(response_cache, "r", self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.inserted = []
+        self.threads = set()
+
+    async def insert_contacts(self, user, contacts, db):
+        if any(contact.surname == "reject" for contact in contacts):
+            raise IntegrityError("INSERT", {}, Exception("rejected"))
+        self.inserted.append([contact.name for contact in contacts])
+
+    def validate_rows(self, *args):
+        self.threads.add(threading.get_ident())
+        return validate_rows(*args)
+
+    async def test_rejected_rows_are_bisected_under_savepoints(self):
+        with patch("src.repository.contacts.insert_contacts", side_effect=self.insert_contacts), \
+                patch("src.services.contacts_io.validate_rows", side_effect=self.validate_rows):
+            report = await contacts_io.import_contacts(csv_file(10, {3}), "csv", self.user, self.db,
+                                                       chunk_size=8, max_errors=10)
+
+        self.assertEqual(report["imported"], 9)
+        self.assertEqual([error["row"] for error in report["errors"]], [3])
+        # The valid rows of the failed chunk go in as halves and quarters, not row by row
+        self.assertEqual(self.inserted, [["name1", "name2"], ["name4"], ["name5", "name6", "name7", "name8"],
+                                         ["name9", "name10"]])
+        self.assertEqual(self.db.commit.await_count, 2)
+        self.redis.incr.assert_awaited_once_with(response_cache.generation_key(1))
+        self.assertNotIn(threading.get_ident(), self.threads)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,223 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import aiosmtplib
+
+from src.services.email import EmailQueue, TEMPLATE_FOLDER, email_queue, send_email
+from src.services.email_worker import (EmailTemplates, EmailWorker, SmtpTransport, is_server_failure, is_transient,
+                                       render_message)
+from src.services.smtp_sink import SmtpSink
+
+
+def confirmation_job(recipient: str = "test@example.com", attempts: int = 0) -> dict:
+    return {
+        "id": "job",
+        "attempts": attempts,
+        "template": "email_template.html",
+        "subject": "Confirm your email ",
+        "recipient": recipient,
+        "body": {"host": "http://test/", "username": "test", "token": "token"},
+    }
+
+
+class TestEmailQueue(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.redis = AsyncMock()
+        self.pipe = MagicMock()
+        self.pipe.execute = AsyncMock()
+        self.redis.pipeline = MagicMock(return_value=self.pipe)
+        self.queue = EmailQueue(self.redis, worker_id="w1")
+
+    async def test_send_email_enqueues_job(self):
+        with patch.object(email_queue, "r", self.redis):
+            await send_email("test@example.com", "test", "http://test/")
+        key, data = self.redis.lpush.await_args.args
+        job = json.loads(data)
+        self.assertEqual(key, EmailQueue.QUEUE)
+        self.assertEqual(job["recipient"], "test@example.com")
+        self.assertEqual(job["body"]["host"], "http://test/")
+        self.assertTrue(job["body"]["token"])
+        self.assertEqual(job["attempts"], 0)
+
+    async def test_take_batch_keeps_jobs_until_acknowledged(self):
+        first, second = json.dumps({"id": 1}).encode(), json.dumps({"id": 2}).encode()
+        self.redis.blmove.return_value = first
+        self.pipe.execute.return_value = [second, None]
+        jobs = await self.queue.take(batch_size=3, timeout=1)
+        self.assertEqual(jobs, [{"id": 1}, {"id": 2}])
+        self.redis.blmove.assert_awaited_once_with(EmailQueue.QUEUE, "email:processing:w1", 1,
+                                                   src="RIGHT", dest="LEFT")
+        self.assertEqual(self.pipe.lmove.call_count, 2)
+
+        await self.queue.ack(jobs[0])
+        self.pipe.lrem.assert_called_once_with("email:processing:w1", 1, first)
+        await self.queue.retry_later(jobs[1], 10)
+        self.pipe.zadd.assert_called_once()
+        self.pipe.lrem.assert_called_with("email:processing:w1", 1, second)
+
+    async def test_take_buries_malformed_job(self):
+        self.redis.blmove.return_value = b"not json"
+        self.pipe.execute.return_value = [json.dumps({"id": 2}).encode()]
+        jobs = await self.queue.take(batch_size=2, timeout=1)
+        self.assertEqual(jobs, [{"id": 2}])
+        self.pipe.lpush.assert_called_once_with(EmailQueue.DEAD, b"not json")
+        self.pipe.lrem.assert_called_once_with("email:processing:w1", 1, b"not json")
+
+    async def test_take_nothing(self):
+        self.redis.blmove.return_value = None
+        self.assertEqual(await self.queue.take(batch_size=10, timeout=1), [])
+
+    async def test_requeue_due(self):
+        self.redis.zrangebyscore.return_value = [b"a", b"b"]
+        self.redis.zrem.side_effect = [1, 0]
+        self.assertEqual(await self.queue.requeue_due(), 1)
+        self.redis.lpush.assert_awaited_once_with(EmailQueue.QUEUE, b"a")
+
+    async def test_requeue_unsent(self):
+        self.redis.lmove.side_effect = [b"a", b"b", None]
+        self.assertEqual(await self.queue.requeue_unsent(), 2)
+        self.redis.lmove.assert_awaited_with("email:processing:w1", EmailQueue.QUEUE, src="LEFT", dest="RIGHT")
+
+    async def test_recover_abandoned(self):
+        async def scan_iter(match):
+            for key in (b"email:processing:w1", b"email:processing:alive", b"email:processing:dead"):
+                yield key
+
+        self.redis.scan_iter = scan_iter
+        self.redis.exists.side_effect = lambda key: int(key == "email:worker:alive")
+        self.redis.lmove.side_effect = [b"a", None]
+        self.assertEqual(await self.queue.recover_abandoned(), 1)
+        self.redis.lmove.assert_awaited_with("email:processing:dead", EmailQueue.QUEUE, src="LEFT", dest="RIGHT")
+
+
+class TestEmailWorker(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.queue = AsyncMock()
+        self.transport = AsyncMock()
+        self.worker = EmailWorker(self.queue, self.transport, render=MagicMock(), max_attempts=3, backoff=10)
+
+    async def test_failed_message_is_retried_with_backoff(self):
+        self.transport.send.side_effect = [None, aiosmtplib.SMTPDataError(451, "Try again later")]
+        await self.worker.process([confirmation_job("a@example.com"), confirmation_job("b@example.com", 1)])
+        job, delay = self.queue.retry_later.await_args.args
+        self.assertEqual(job["recipient"], "b@example.com")
+        self.assertEqual(job["attempts"], 2)
+        self.assertEqual(delay, 20)
+        self.queue.bury.assert_not_awaited()
+
+    async def test_sent_message_is_acknowledged(self):
+        self.transport.send.return_value = None
+        self.assertIsNone(await self.worker.process([confirmation_job()]))
+        self.queue.ack.assert_awaited_once()
+        self.queue.retry_later.assert_not_awaited()
+
+    async def test_permanent_failure_is_buried_at_once(self):
+        refused = aiosmtplib.SMTPRecipientsRefused([aiosmtplib.SMTPRecipientRefused(550, "No such user", "b")])
+        self.transport.send.side_effect = [refused, aiosmtplib.SMTPDataError(451, "Try again later")]
+        await self.worker.process([confirmation_job("b@example.com"), confirmation_job("c@example.com")])
+        self.assertEqual(self.queue.bury.await_args.args[0]["recipient"], "b@example.com")
+        self.assertEqual(self.queue.retry_later.await_args.args[0]["recipient"], "c@example.com")
+
+    async def test_render_error_is_buried(self):
+        self.worker.render.side_effect = KeyError("template")
+        await self.worker.process([confirmation_job()])
+        self.queue.bury.assert_awaited_once()
+        self.transport.send.assert_not_awaited()
+
+    async def test_server_failure_stops_batch_without_counting_attempts(self):
+        error = aiosmtplib.SMTPAuthenticationError(535, "Authentication failed")
+        self.transport.send.return_value = error
+        jobs = [confirmation_job("a@example.com", 2), confirmation_job("b@example.com", 2)]
+        self.assertIs(await self.worker.process(jobs), error)
+        self.transport.send.assert_awaited_once()
+        self.assertEqual([call.args for call in self.queue.retry_later.await_args_list], [(job, 10) for job in jobs])
+        self.assertEqual([job["attempts"] for job in jobs], [2, 2])
+        self.queue.bury.assert_not_awaited()
+
+    def test_is_transient(self):
+        self.assertTrue(is_transient(aiosmtplib.SMTPServerDisconnected("gone")))
+        self.assertTrue(is_transient(aiosmtplib.SMTPResponseException(421, "busy")))
+        self.assertTrue(is_transient(aiosmtplib.SMTPAuthenticationError(535, "Authentication failed")))
+        self.assertTrue(is_transient(aiosmtplib.SMTPSenderRefused(553, "Sender rejected", "from@example.com")))
+        self.assertFalse(is_transient(aiosmtplib.SMTPDataError(554, "rejected")))
+        self.assertFalse(is_transient(aiosmtplib.SMTPRecipientsRefused(
+            [aiosmtplib.SMTPRecipientRefused(550, "No such user", "b")])))
+        self.assertFalse(is_transient(KeyError("template")))
+        self.assertTrue(is_server_failure(aiosmtplib.SMTPAuthenticationError(530, "Authentication required")))
+        self.assertFalse(is_server_failure(aiosmtplib.SMTPDataError(451, "Try again later")))
+
+    async def test_cancelled_worker_requeues_unsent_jobs(self):
+        async def take(*args):
+            await asyncio.sleep(10)
+
+        self.queue.take.side_effect = take
+        task = asyncio.create_task(self.worker.run())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        self.queue.requeue_unsent.assert_awaited_once()
+        self.transport.close.assert_awaited_once()
+
+    async def test_unexpected_error_does_not_stop_worker(self):
+        self.queue.take.side_effect = [RuntimeError("boom"), asyncio.CancelledError()]
+        with patch("asyncio.sleep", new_callable=AsyncMock) as sleep:
+            with self.assertRaises(asyncio.CancelledError):
+                await self.worker.run()
+        sleep.assert_awaited_once_with(1)
+        self.assertEqual(self.queue.take.await_count, 2)
+        self.queue.requeue_unsent.assert_awaited_once()
+
+    async def test_message_is_buried_after_max_attempts(self):
+        self.transport.send.return_value = aiosmtplib.SMTPDataError(451, "Try again later")
+        await self.worker.process([confirmation_job(attempts=2)])
+        self.queue.bury.assert_awaited_once()
+        self.queue.retry_later.assert_not_awaited()
+
+    def test_render_message(self):
+        message = render_message(confirmation_job())
+        self.assertEqual(message["To"], "test@example.com")
+        self.assertIn("http://test/api/auth/confirmed_email/token", message.get_payload(decode=True).decode())
+
+    def test_templates_are_compiled_once(self):
+        templates = EmailTemplates(TEMPLATE_FOLDER)
+        with patch.object(templates.env, "get_template") as get_template:
+            first = templates.render("email_template.html", {"username": "a", "host": "h/", "token": "t"})
+            second = templates.render("email_template.html", {"username": "b", "host": "h/", "token": "t"})
+        get_template.assert_not_called()
+        self.assertIn("Hi a,", first)
+        self.assertIn("Hi b,", second)
+
+
+class TestSmtpTransport(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.sink = SmtpSink()
+        await self.sink.start()
+        self.transport = SmtpTransport("127.0.0.1", self.sink.port, username="user", password="password")
+
+    async def asyncTearDown(self) -> None:
+        await self.transport.close()
+        await self.sink.stop()
+
+    async def test_batch_reuses_connection(self):
+        messages = [render_message(confirmation_job(f"user{i}@example.com")) for i in range(3)]
+        self.assertEqual(await self.transport.send_batch(messages), [None, None, None])
+        self.assertEqual(await self.transport.send_batch(messages[:1]), [None])
+        self.assertEqual(len(self.sink.messages), 4)
+        self.assertEqual(self.sink.connections, 1)
+        self.assertEqual(self.sink.messages[0][1], ["<user0@example.com>"])
+
+    async def test_reconnects_after_disconnect(self):
+        await self.transport.send(render_message(confirmation_job()))
+        self.transport.smtp.close()
+        self.assertIsNone(await self.transport.send(render_message(confirmation_job())))
+        self.assertEqual(self.sink.connections, 2)
+        self.assertEqual(len(self.sink.messages), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+from datetime import datetime
+
+from src.services.etag import etag_matches, make_etag, page_etag
+
+
+class TestETag(unittest.TestCase):
+
+    def test_make_etag(self):
+        etag = make_etag("contact", 1, datetime(2024, 1, 1))
+        self.assertTrue(etag.startswith('"') and etag.endswith('"'))
+        self.assertEqual(etag, make_etag("contact", 1, datetime(2024, 1, 1)))
+        self.assertNotEqual(etag, make_etag("contact", 1, datetime(2024, 1, 2)))
+
+    def test_page_etag_of_empty_page(self):
+        self.assertEqual(page_etag(1, 0, None, None), page_etag(1, 0, None, 0))
+
+    def test_etag_matches(self):
+        etag = make_etag("contact", 1)
+        self.assertTrue(etag_matches(etag, etag))
+        self.assertTrue(etag_matches(f'"other", W/{etag}', etag))
+        self.assertTrue(etag_matches("*", etag))
+        self.assertFalse(etag_matches('"other"', etag))
+        self.assertFalse(etag_matches(None, etag))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from src.services.gravatar import GravatarResolver
+
+EMAIL = "test@example.com"
+EMAIL_HASH = "55502f40dc8b7c769880b10874abc9d0"
+URL = f"https://www.gravatar.com/avatar/{EMAIL_HASH}"
+
+
+class TestGravatarResolver(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.redis = AsyncMock()
+        self.redis.get.return_value = None
+        self.resolver = GravatarResolver(self.redis, verify=True, ttl=60, session_factory=MagicMock())
+
+    async def test_resolve_without_verify_makes_no_request(self):
+        self.resolver.verify = False
+        with patch.object(self.resolver, "_exists") as exists:
+            self.assertEqual(await self.resolver.resolve(EMAIL), URL)
+        exists.assert_not_called()
+        self.redis.get.assert_not_awaited()
+
+    async def test_verified_answer_is_cached_by_email_hash(self):
+        with patch.object(self.resolver, "_exists", return_value=False) as exists:
+            self.assertIsNone(await self.resolver.resolve(EMAIL))
+        exists.assert_called_once_with(URL)
+        self.redis.set.assert_awaited_once_with(GravatarResolver.key(EMAIL_HASH), 0, ex=60)
+
+    async def test_cached_answer_skips_request(self):
+        self.redis.get.return_value = b"1"
+        with patch.object(self.resolver, "_exists") as exists:
+            self.assertEqual(await self.resolver.resolve(EMAIL), URL)
+        exists.assert_not_called()
+
+    async def test_failed_lookup_keeps_url_uncached(self):
+        with patch.object(self.resolver, "_exists", side_effect=TimeoutError()):
+            self.assertEqual(await self.resolver.resolve(EMAIL), URL)
+        self.redis.set.assert_not_awaited()
+
+    async def test_assign_sets_default_avatar(self):
+        self.redis.get.return_value = b"1"
+        with patch("src.repository.users.set_default_avatar", new_callable=AsyncMock) as set_default_avatar:
+            await self.resolver.assign(EMAIL)
+        self.assertEqual(set_default_avatar.await_args.args[:2], (EMAIL, URL))
+
+    async def test_assign_without_image_leaves_user(self):
+        self.redis.get.return_value = b"0"
+        with patch("src.repository.users.set_default_avatar", new_callable=AsyncMock) as set_default_avatar:
+            await self.resolver.assign(EMAIL)
+        set_default_avatar.assert_not_awaited()
+
+
+if __name__ == '__main__':
+    unittest.main()
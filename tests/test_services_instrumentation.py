@@ -0,0 +1,124 @@
+import os
+import tempfile
+import unittest
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.services.instrumentation import (
+    InstrumentationMiddleware,
+    MetricsRegistry,
+    Profiler,
+    RequestMetrics,
+    instrument_redis,
+    instrument_sql,
+    record_pool_wait,
+    timed_serialization,
+)
+
+
+class FakeRedis:
+
+    async def execute_command(self, *args, **options):
+        return None
+
+
+class TestInstrumentationMiddleware(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.profile_dir = tempfile.mkdtemp()
+        self.registry = MetricsRegistry()
+        self.engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+        self.redis = FakeRedis()
+        instrument_sql()
+        instrument_redis(self.redis)
+
+        app = FastAPI()
+        self.profiler = Profiler(self.profile_dir, secret="secret", max_files=2)
+        app.add_middleware(InstrumentationMiddleware, registry=self.registry, profiler=self.profiler)
+
+        @app.get("/items/{item_id}")
+        async def read_item(item_id: int):
+            async with self.engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+                await conn.execute(text("SELECT 2"))
+            await self.redis.execute_command("GET", "key")
+            record_pool_wait(0.5)
+            with timed_serialization():
+                return {"id": item_id}
+
+        @app.get("/fail")
+        async def fail():
+            async with self.engine.connect() as conn:
+                try:
+                    await conn.execute(text("SELECT * FROM missing"))
+                except Exception:
+                    pass
+                self.started = list(conn.sync_connection.info.get("instrumentation_started_at", []))
+            return {}
+
+        self.client = TestClient(app)
+
+    def test_server_timing(self):
+        response = self.client.get("/items/1")
+        self.assertEqual(response.status_code, 200)
+        timing = response.headers["Server-Timing"]
+        self.assertIn('db;desc="2 queries"', timing)
+        self.assertIn('redis;desc="1 calls"', timing)
+        self.assertIn("pool;dur=500.00", timing)
+        self.assertNotIn("X-Profile", response.headers)
+
+    def test_metrics_per_route(self):
+        self.client.get("/items/1")
+        self.client.get("/items/2")
+        self.client.get("/missing")
+        metrics = self.registry.render()
+        self.assertIn('http_requests_total{method="GET",route="/items/{item_id}",status="200"} 2', metrics)
+        self.assertIn('http_requests_total{method="GET",route="unmatched",status="404"} 1', metrics)
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="/items/{item_id}"} 2', metrics)
+        self.assertIn('http_request_db_statements_total{method="GET",route="/items/{item_id}"} 4', metrics)
+        self.assertIn('http_request_redis_calls_total{method="GET",route="/items/{item_id}"} 2', metrics)
+
+    def test_profile_on_header(self):
+        response = self.client.get("/items/1", headers={"X-Profile": "secret"})
+        profile_file = response.headers["X-Profile"]
+        self.assertTrue(profile_file.endswith(".prof"))
+        self.assertTrue(os.path.exists(os.path.join(self.profile_dir, profile_file)))
+
+    def test_profile_header_needs_secret(self):
+        for value in ("1", "wrong"):
+            response = self.client.get("/items/1", headers={"X-Profile": value})
+            self.assertNotIn("X-Profile", response.headers)
+        self.profiler.secret = ""
+        response = self.client.get("/items/1", headers={"X-Profile": ""})
+        self.assertNotIn("X-Profile", response.headers)
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_profiles_are_rotated(self):
+        for _ in range(4):
+            self.client.get("/items/1", headers={"X-Profile": "secret"})
+        self.assertEqual(len(os.listdir(self.profile_dir)), 2)
+
+    def test_failed_statement_leaves_no_start_time(self):
+        response = self.client.get("/fail")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.started, [])
+        self.assertIn('db;desc="1 queries"', response.headers["Server-Timing"])
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def test_histogram_buckets(self):
+        registry = MetricsRegistry()
+        registry.observe("GET", "/", 200, 0.02, RequestMetrics())
+        registry.observe("GET", "/", 200, 3.0, RequestMetrics())
+        metrics = registry.render()
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",route="/",le="0.025"} 1', metrics)
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",route="/",le="5.0"} 2', metrics)
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",route="/",le="+Inf"} 2', metrics)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import asyncio
+import threading
+import unittest
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from src.services.passwords import PasswordHasher
+
+
+class TestPasswordHasher(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.hasher = PasswordHasher(CryptContext(schemes=["sha256_crypt"]), workers=1, max_pending=1)
+
+    async def test_hash_and_verify(self):
+        hashed = await self.hasher.hash("password")
+        self.assertTrue(await self.hasher.verify("password", hashed))
+        self.assertFalse(await self.hasher.verify("wrong", hashed))
+        stats = self.hasher.stats()
+        self.assertEqual(stats["completed"], 3)
+        self.assertEqual(stats["pending"], 0)
+        self.assertEqual(stats["running"], 0)
+
+    async def test_rejects_when_queue_is_full(self):
+        release = threading.Event()
+        blocked = asyncio.create_task(self.hasher._run(release.wait))
+        await asyncio.sleep(0)
+        with self.assertRaises(HTTPException) as cm:
+            await self.hasher.hash("password")
+        self.assertEqual(cm.exception.status_code, 503)
+        self.assertEqual(self.hasher.stats()["rejected"], 1)
+        release.set()
+        await blocked
+
+
+if __name__ == '__main__':
+    unittest.main()